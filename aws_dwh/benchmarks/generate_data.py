@@ -0,0 +1,178 @@
+"""
+Grow the sample data in `aws_dwh/data` by a configurable factor while keeping its characteristics:
+- artist/song popularity follows a zipf like skew
+- session lengths are drawn from the session lengths observed in the sample
+- pages (and hence the share of `NextSong` events) are drawn from the page distribution of the sample
+
+    $ python aws_dwh/benchmarks/generate_data.py --factor 10 --output /tmp/sparkify_x10/
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import string
+from collections import Counter, defaultdict
+from datetime import datetime, timezone
+
+SAMPLE_DATA = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data")
+
+# exponent of the zipf distribution we draw played songs from
+POPULARITY_SKEW = 1.1
+
+# share of played songs that are part of the song catalog, the remaining plays are songs we have no metadata for
+CATALOG_HIT_RATE = 0.5
+
+
+def _random_id(rng, prefix, length=16):
+    return prefix + "".join(rng.choice(string.ascii_uppercase + string.digits) for _ in range(length))
+
+
+def _zipf_weights(count, skew=POPULARITY_SKEW):
+    return [1.0 / (rank ** skew) for rank in range(1, count + 1)]
+
+
+def load_sample(sample_data=SAMPLE_DATA):
+    songs = []
+    for path in sorted(glob.glob(os.path.join(sample_data, "song_data", "*", "*", "*", "*.json"))):
+        with open(path) as song_file:
+            songs.append(json.load(song_file))
+
+    events = []
+    for path in sorted(glob.glob(os.path.join(sample_data, "log_data", "*", "*", "*.json"))):
+        with open(path) as log_file:
+            events.extend(json.loads(line) for line in log_file if line.strip())
+    return songs, events
+
+
+def grow_songs(songs, factor, rng):
+    """every artist of the sample gets `factor - 1` synthetic siblings that own copies of its songs"""
+    grown = list(songs)
+    for copy in range(1, factor):
+        artist_ids = {}
+        for song in songs:
+            artist_id = artist_ids.setdefault(song["artist_id"], _random_id(rng, "AR"))
+            grown.append(dict(
+                song,
+                artist_id=artist_id,
+                artist_name=f"{song['artist_name']} {copy}",
+                song_id=_random_id(rng, "SO"),
+                title=f"{song['title']} ({copy})",
+                duration=round(song["duration"] * rng.uniform(0.8, 1.2), 5),
+            ))
+    return grown
+
+
+def write_songs(songs, output, rng):
+    for song in songs:
+        track_id = _random_id(rng, "TR", length=16)
+        directory = os.path.join(output, "song_data", track_id[2], track_id[3], track_id[4])
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{track_id}.json"), "w") as song_file:
+            json.dump(song, song_file)
+
+
+def _profiles(events):
+    """user attributes, session lengths and the page distribution of the sample"""
+    users = {}
+    sessions = Counter()
+    pages = Counter()
+    plays = Counter()
+    for event in events:
+        if event["userId"]:
+            users[event["userId"]] = {key: event[key] for key in
+                                      ["firstName", "lastName", "gender", "level", "location", "userAgent",
+                                       "registration"]}
+        sessions[(event["sessionId"], event["userId"])] += 1
+        pages[event["page"]] += 1
+        if event["page"] == "NextSong":
+            plays[(event["song"], event["artist"], event["length"])] += 1
+    return users, list(sessions.values()), pages, [play for play, _ in plays.most_common()]
+
+
+def generate_events(events, songs, factor, rng):
+    """
+    Generate `factor` times as many sessions as the sample has, spread over the days of the sample
+    Returns:
+        {dict}: day -> list of events
+    """
+    users, session_lengths, pages, sample_plays = _profiles(events)
+    user_ids = list(users)
+    synthetic_users = {}
+    for copy in range(factor):
+        for user_id in user_ids:
+            synthetic_id = user_id if copy == 0 else str(int(user_id) + copy * 100000)
+            synthetic_users[synthetic_id] = users[user_id]
+    synthetic_user_ids = list(synthetic_users)
+
+    catalog = [(song["title"], song["artist_name"], song["duration"]) for song in songs]
+    rng.shuffle(catalog)
+    catalog_weights = _zipf_weights(len(catalog))
+    sample_weights = _zipf_weights(len(sample_plays))
+    page_names, page_weights = zip(*pages.items())
+
+    days = sorted({datetime.fromtimestamp(event["ts"] / 1000, tz=timezone.utc).date() for event in events})
+    events_per_day = defaultdict(list)
+    for session_id in range(1, len(session_lengths) * factor + 1):
+        user_id = rng.choice(synthetic_user_ids)
+        user = synthetic_users[user_id]
+        day = rng.choice(days)
+        ts = int(datetime(day.year, day.month, day.day, tzinfo=timezone.utc).timestamp() * 1000)
+        ts += rng.randrange(24 * 3600 * 1000)
+
+        for item_in_session in range(rng.choice(session_lengths)):
+            page = rng.choices(page_names, page_weights)[0]
+            song = artist = length = None
+            if page == "NextSong":
+                if rng.random() < CATALOG_HIT_RATE:
+                    song, artist, length = rng.choices(catalog, catalog_weights)[0]
+                else:
+                    song, artist, length = rng.choices(sample_plays, sample_weights)[0]
+
+            event_day = datetime.fromtimestamp(ts / 1000, tz=timezone.utc).date()
+            events_per_day[event_day].append({
+                "artist": artist, "auth": "Logged In", "firstName": user["firstName"], "gender": user["gender"],
+                "itemInSession": item_in_session, "lastName": user["lastName"], "length": length,
+                "level": user["level"], "location": user["location"], "method": "PUT" if song else "GET",
+                "page": page, "registration": user["registration"], "sessionId": session_id, "song": song,
+                "status": 200, "ts": ts, "userAgent": user["userAgent"], "userId": user_id,
+            })
+            ts += int((length or rng.uniform(5, 60)) * 1000)
+    return events_per_day
+
+
+def write_events(events_per_day, output):
+    for day, day_events in events_per_day.items():
+        directory = os.path.join(output, "log_data", f"{day.year}", f"{day.month:02d}")
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, f"{day.isoformat()}-events.json"), "w") as log_file:
+            for event in sorted(day_events, key=lambda e: e["ts"]):
+                log_file.write(json.dumps(event) + "\n")
+
+
+def generate(output, factor, seed=42, sample_data=SAMPLE_DATA):
+    """
+    Arguments:
+        output {str}: local directory the `song_data/` and `log_data/` trees are written to
+        factor {int}: how many times bigger than the sample the generated data should be
+        seed {int}: seed of the random generator, the same seed produces the same data
+    """
+    rng = random.Random(seed)
+    songs, events = load_sample(sample_data)
+    grown_songs = grow_songs(songs, factor, rng)
+    write_songs(grown_songs, output, rng)
+    write_events(generate_events(events, grown_songs, factor, rng), output)
+    print(f"generated {len(grown_songs)} songs and x{factor} log events into {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="generate synthetic sparkify data based on the sample data")
+    parser.add_argument("--factor", type=int, default=10)
+    parser.add_argument("--output", required=True)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    generate(args.output, args.factor, seed=args.seed)
+
+
+if __name__ == "__main__":
+    main()
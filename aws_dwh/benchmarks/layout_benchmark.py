@@ -0,0 +1,107 @@
+"""
+Compare the bytes typical queries scan in our output tables written with the default parquet layout
+(arbitrary row order, one row group per file) and with the layouts of `tables.TABLES`.
+Both variants are built from the same synthetic data in local spark mode, the scanned bytes are the input bytes
+spark reports for the queries, i.e. what is left after row groups and files were skipped by their statistics.
+
+    $ python aws_dwh/benchmarks/layout_benchmark.py --scale 10 --results /tmp/layout_benchmark.json
+"""
+import argparse
+import json
+import os
+import shutil
+
+# importing the benchmarks puts `pyspark/` on the import path
+from run_benchmarks import create_local_spark_session
+
+from context import PipelineContext  # noqa: E402
+from example import SparkEngine  # noqa: E402
+from generate_data import generate  # noqa: E402
+from metrics import job_group_metrics  # noqa: E402
+from tables import DEFAULT_LAYOUT, TABLES, table_path  # noqa: E402
+
+# typical dashboard/analyst queries, `{...}` are filled with values that exist in the data
+QUERIES = {
+    "songplays_of_user": ("songplays", "SELECT COUNT(*), MAX(start_time) FROM songplays WHERE user_id = {user_id}"),
+    "songplays_of_song": ("songplays", "SELECT COUNT(DISTINCT user_id) FROM songplays WHERE song_id = '{song_id}'"),
+    "songplays_of_hour": ("songplays", "SELECT COUNT(*) FROM songplays "
+                                       "WHERE start_time BETWEEN {start_time} AND {start_time} + 3600000"),
+    "current_user": ("users", "SELECT * FROM users WHERE user_id = {user_id} AND is_current"),
+}
+
+
+def build_tables(spark, input_data, output_data, layouts):
+    """run the etl with the given layouts, `TABLES` is restored afterwards"""
+    specs = dict(TABLES)
+    try:
+        for table, layout in layouts.items():
+            TABLES[table] = TABLES[table]._replace(layout=layout)
+        shutil.rmtree(output_data, ignore_errors=True)
+        SparkEngine(PipelineContext(spark, input_data, output_data, full_refresh=True)).run()
+    finally:
+        TABLES.update(specs)
+
+
+def query_values(spark, output_data):
+    """user, song and time of one (pseudo random) songplay"""
+    row = spark.read.parquet(table_path(output_data, "songplays")) \
+        .orderBy("songplay_id").select("user_id", "song_id", "start_time").first()
+    return row.asDict()
+
+
+def scanned_bytes(spark, output_data, values, variant):
+    results = {}
+    for name, (table, sql) in QUERIES.items():
+        spark.read.parquet(table_path(output_data, table)).createOrReplaceTempView(table)
+        job_group = f"{variant}_{name}"
+        spark.sparkContext.setJobGroup(job_group, f"layout benchmark {name} ({variant})")
+        spark.sql(sql.format(**values)).collect()
+        results[name] = job_group_metrics(spark, job_group)["input_bytes"]
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="bytes scanned by typical queries with and without table layouts")
+    parser.add_argument("--scale", type=int, default=10, help="growth factor of the sample data")
+    parser.add_argument("--work-dir", default="/tmp/sparkify_layout_benchmark")
+    parser.add_argument("--results", default="layout_benchmark_results.json")
+    parser.add_argument(
+        "--row-group-bytes",
+        type=int,
+        help="row group size of the layouts that set one, the files of the sample data are too small "
+             "to hold more than a single row group of the production size",
+    )
+    args = parser.parse_args()
+
+    input_data = os.path.join(args.work_dir, f"scale_{args.scale}", "input") + "/"
+    if not os.path.exists(input_data):
+        generate(input_data, args.scale)
+
+    spark = create_local_spark_session()
+    variants = {
+        "default": {table: DEFAULT_LAYOUT for table in TABLES},
+        "layout": {
+            table: spec.layout._replace(row_group_bytes=args.row_group_bytes)
+            for table, spec in TABLES.items() if args.row_group_bytes and spec.layout.row_group_bytes
+        },
+    }
+    values = None
+    results = {}
+    for variant, layouts in variants.items():
+        output_data = os.path.join(args.work_dir, f"scale_{args.scale}", variant) + "/"
+        build_tables(spark, input_data, output_data, layouts)
+        # both variants are queried for the same values
+        values = values or query_values(spark, output_data)
+        results[variant] = scanned_bytes(spark, output_data, values, variant)
+    spark.stop()
+
+    for name in QUERIES:
+        before, after = results["default"][name], results["layout"][name]
+        print(f"{name}: {before} -> {after} bytes scanned ({after / before if before else 0:.1%})")
+
+    with open(args.results, "w") as results_file:
+        json.dump({"values": values, "scanned_bytes": results}, results_file, indent=2, sort_keys=True)
+
+
+if __name__ == "__main__":
+    main()
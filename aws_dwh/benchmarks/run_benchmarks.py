@@ -0,0 +1,143 @@
+"""
+Run the stages of `pyspark/example.py` in local spark mode on synthetic data of several scales and
+record wall time, shuffle bytes and output file counts per stage.
+Results are written to a json file and compared against a stored baseline; any regression beyond the
+tolerance makes the run fail.
+
+    $ python aws_dwh/benchmarks/run_benchmarks.py --scales 1,5,10 --results /tmp/benchmark.json
+    $ python aws_dwh/benchmarks/run_benchmarks.py --scales 1,5,10 --update-baseline
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import time
+from datetime import date
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(os.path.dirname(BENCHMARK_DIR), "pyspark"))
+
+from pyspark.sql import SparkSession  # noqa: E402
+
+from context import PipelineContext  # noqa: E402
+from example import process_calendar, process_log_data, process_song_data, run_compaction  # noqa: E402
+from generate_data import generate  # noqa: E402
+from marts import update_marts  # noqa: E402
+from metrics import job_group_metrics  # noqa: E402
+from tables import TABLES, table_path  # noqa: E402
+
+BASELINE = os.path.join(BENCHMARK_DIR, "baseline.json")
+
+# relative increase of a metric compared to the baseline that counts as regression
+TOLERANCE = 0.25
+
+# the stages run in this order, the later ones work on the tables the earlier ones wrote
+STAGES = {
+    "song_data": process_song_data,
+    "log_data": process_log_data,
+    # the log data of the sample (and hence the synthetic data) is from late 2018
+    "calendar": lambda context: process_calendar(context, date(2018, 1, 1), date(2018, 12, 31)),
+    # a full rebuild, the log_data stage only updates the marts for the partitions it replaced
+    "marts": lambda context: update_marts(context.spark, context.output_data),
+    "compaction": run_compaction,
+}
+
+
+def create_local_spark_session():
+    return SparkSession \
+        .builder \
+        .master("local[*]") \
+        .config("spark.sql.session.timeZone", "UTC") \
+        .config("spark.ui.enabled", "true") \
+        .getOrCreate()
+
+
+def output_file_counts(output_data):
+    counts = {}
+    for table in TABLES:
+        location = table_path(output_data, table)
+        counts[table] = sum(
+            1 for _, _, files in os.walk(location) for name in files if name.endswith(".parquet")
+        )
+    return counts
+
+
+def run_scale(spark, scale, work_dir):
+    input_data = os.path.join(work_dir, f"scale_{scale}", "input") + "/"
+    output_data = os.path.join(work_dir, f"scale_{scale}", "output") + "/"
+    if not os.path.exists(input_data):
+        generate(input_data, scale)
+    shutil.rmtree(output_data, ignore_errors=True)
+
+    context = PipelineContext(spark, input_data, output_data, full_refresh=True)
+    results = {}
+    for stage, process in STAGES.items():
+        job_group = f"scale_{scale}_{stage}"
+        spark.sparkContext.setJobGroup(job_group, f"benchmark {stage} at scale {scale}")
+        started = time.perf_counter()
+        process(context)
+        results[stage] = {"wall_seconds": round(time.perf_counter() - started, 3)}
+        metrics = job_group_metrics(spark, job_group)
+        results[stage]["shuffle_read_bytes"] = metrics["shuffle_read_bytes"]
+        results[stage]["shuffle_write_bytes"] = metrics["shuffle_write_bytes"]
+
+    results["output_files"] = output_file_counts(output_data)
+    return results
+
+
+def compare(results, baseline, tolerance=TOLERANCE):
+    """
+    Returns:
+        {list}: human readable descriptions of all metrics that regressed
+    """
+    regressions = []
+    for scale, stages in results.items():
+        for stage, metrics in stages.items():
+            for metric, value in metrics.items():
+                expected = baseline.get(scale, {}).get(stage, {}).get(metric)
+                if expected is None:
+                    continue
+                if value > expected * (1 + tolerance):
+                    regressions.append(f"scale {scale} {stage} {metric}: {value} (baseline {expected})")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="benchmark the stages of the sparkify ETL in local mode")
+    parser.add_argument("--scales", default="1,5,10", help="comma separated growth factors of the sample data")
+    parser.add_argument("--work-dir", default="/tmp/sparkify_benchmark")
+    parser.add_argument("--results", default="benchmark_results.json")
+    parser.add_argument("--baseline", default=BASELINE)
+    parser.add_argument("--tolerance", type=float, default=TOLERANCE)
+    parser.add_argument("--update-baseline", action="store_true", help="store the results as new baseline")
+    args = parser.parse_args()
+
+    spark = create_local_spark_session()
+    results = {scale: run_scale(spark, int(scale), args.work_dir) for scale in args.scales.split(",")}
+    spark.stop()
+
+    with open(args.results, "w") as results_file:
+        json.dump(results, results_file, indent=2, sort_keys=True)
+
+    if args.update_baseline:
+        with open(args.baseline, "w") as baseline_file:
+            json.dump(results, baseline_file, indent=2, sort_keys=True)
+        print(f"stored baseline {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"no baseline at {args.baseline}, run with --update-baseline to create one")
+        sys.exit(1)
+
+    with open(args.baseline) as baseline_file:
+        regressions = compare(results, json.load(baseline_file), tolerance=args.tolerance)
+
+    if regressions:
+        print("REGRESSIONS:\n" + "\n".join(regressions))
+        sys.exit(1)
+    print("no regressions compared to the baseline")
+
+
+if __name__ == "__main__":
+    main()
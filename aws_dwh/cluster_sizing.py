@@ -0,0 +1,97 @@
+"""
+Sizing policy of the EMR cluster of a pipeline run. It is plain python without any CDK or AWS dependency:
+the stack builds one `CreateCluster` task per size class from it and the `size_cluster` lambda, which is deployed
+together with this module, picks the size class of a run from the size of its input.
+"""
+from collections import namedtuple
+
+# An instance type the cluster may use and the capacity units (vcpus) one instance of it counts for.
+# The types of a fleet are alternatives, EMR provisions whatever is available.
+# A master fleet has exactly one instance, EMR requires a target capacity of 1 and weighted capacities of 1 for it.
+InstanceType = namedtuple("InstanceType", ["name", "weighted_capacity"])
+
+# Capacity of one size class in units (vcpus):
+#   max_input_bytes: largest input the size class is meant for, None for the largest class
+#   core_units: on-demand core nodes, they hold HDFS and the shuffle data and must not be reclaimed
+#   task_spot_units: spot task nodes that only add compute
+ClusterSize = namedtuple("ClusterSize", ["name", "max_input_bytes", "core_units", "task_spot_units"])
+
+MASTER_INSTANCE_TYPES = [
+    InstanceType("m5.xlarge", 1),
+    InstanceType("m5a.xlarge", 1),
+    InstanceType("m4.xlarge", 1),
+]
+
+MASTER_CAPACITY = 1
+
+WORKER_INSTANCE_TYPES = [
+    InstanceType("m5.xlarge", 4),
+    InstanceType("m5a.xlarge", 4),
+    InstanceType("m4.xlarge", 4),
+    InstanceType("m5.2xlarge", 8),
+    InstanceType("r5.xlarge", 4),
+]
+
+GIB = 1024 ** 3
+
+# raw input of the spark job, every step reads one of them (see `input_sources` of `pyspark/example.py`)
+INPUT_SOURCES = ["song_data", "log_data"]
+
+SIZE_CLASSES = [
+    # a day or a month of events
+    ClusterSize("small", 5 * GIB, core_units=8, task_spot_units=0),
+    # the full sample history
+    ClusterSize("medium", 100 * GIB, core_units=16, task_spot_units=16),
+    # backfills
+    ClusterSize("large", None, core_units=32, task_spot_units=64),
+]
+
+# used if neither the input size nor a size class is known
+DEFAULT_SIZE_CLASS = "medium"
+
+# spot capacity that is not available after this many minutes is provisioned on demand instead
+SPOT_TIMEOUT_MINUTES = 10
+
+
+def size_class(input_bytes):
+    """
+    Returns:
+        {str}: name of the smallest size class whose `max_input_bytes` covers `input_bytes`
+    """
+    if input_bytes is None:
+        return DEFAULT_SIZE_CLASS
+    for cluster_size in SIZE_CLASSES:
+        if cluster_size.max_input_bytes is None or input_bytes <= cluster_size.max_input_bytes:
+            return cluster_size.name
+    return SIZE_CLASSES[-1].name
+
+
+def get_size_class(name):
+    for cluster_size in SIZE_CLASSES:
+        if cluster_size.name == name:
+            return cluster_size
+    raise ValueError(f"unknown size class {name}, expected one of {[size.name for size in SIZE_CLASSES]}")
+
+
+def size_run(event, list_source_bytes):
+    """
+    Size class of a run and the size of the sources its steps read. The execution input may set the size class
+    (`{"sizeClass": "large"}`) and the size of the sources (`{"sourceBytes": {"song_data": 1, "log_data": 2}}`),
+    otherwise the sources are listed.
+    Arguments:
+        event {dict}: execution input
+        list_source_bytes {callable}: lists the input, returns source -> bytes
+    Returns:
+        {dict}: {"sizeClass": name, "inputBytes": bytes of all sources, "sourceBytes": source -> bytes}
+    """
+    source_bytes = event.get("sourceBytes") or list_source_bytes()
+    missing = [source for source in INPUT_SOURCES if source not in source_bytes]
+    if missing:
+        raise ValueError(f"no size of the sources {missing}, expected one for each of {INPUT_SOURCES}")
+    source_bytes = {source: int(source_bytes[source]) for source in INPUT_SOURCES}
+    input_bytes = sum(source_bytes.values())
+    if event.get("sizeClass"):
+        name = get_size_class(event["sizeClass"]).name
+    else:
+        name = size_class(input_bytes)
+    return {"sizeClass": name, "inputBytes": input_bytes, "sourceBytes": source_bytes}
@@ -8,9 +8,16 @@ from aws_cdk import (
     aws_lambda as lambda_,
     core,
 )
+import glob
 import os
+import shutil
+import tempfile
 from pathlib import Path
 
+from aws_dwh import cluster_sizing
+
+EMR_RELEASE_LABEL = "emr-6.6.0"
+
 
 def create_emr_instance_role(scope: core.Construct) -> iam.Role:
     """
@@ -108,17 +115,36 @@ class UdacityCapstoneStack(core.Stack):
     def _create_sfn_pipeline(self):
         pipeline_name = "EMRSparkifyDWH"
 
-        create_cluster_task = self._emr_create_cluster_task(pipeline_name)
-        sample_spark_step_task = self._emr_spark_step_task()
+        # tables that do not depend on each other are built by concurrent steps,
+        # the critical path is songs/artists -> songplays
+        build_tables = sfn.Parallel(self, "BuildTables", result_path="DISCARD")
+        build_tables.branch(
+            self._emr_spark_step_task("songs,artists", "song_data")
+                .next(self._emr_spark_step_task("songplays", "log_data"))
+        )
+        build_tables.branch(self._emr_spark_step_task("users", "log_data"))
+        build_tables.branch(self._emr_spark_step_task("time", "log_data"))
+
+        enable_step_concurrency_task = self.lambda_step_concurrency_task
         terminate_cluster_task = self._emr_terminate_cluster_task()
+        enable_step_concurrency_task \
+            .next(build_tables) \
+            .next(terminate_cluster_task) \
+            .next(self.lambda_register_partitions_task) \
+            .next(self.lambda_quality_check_task)
+
+        # one CreateCluster task per size class, the sizing lambda decides which one a run uses
+        choose_cluster_size = sfn.Choice(self, "ChooseClusterSize")
+        for cluster_size in cluster_sizing.SIZE_CLASSES:
+            create_cluster_task = self._emr_create_cluster_task(pipeline_name, cluster_size)
+            create_cluster_task.next(enable_step_concurrency_task)
+            choose_cluster_size.when(
+                sfn.Condition.string_equals("$.sizing.sizeClass", cluster_size.name), create_cluster_task
+            )
+            if cluster_size.name == cluster_sizing.DEFAULT_SIZE_CLASS:
+                choose_cluster_size.otherwise(create_cluster_task)
 
-        pipeline = (
-            create_cluster_task
-                .next(sample_spark_step_task)
-                .next(terminate_cluster_task)
-                .next(self.lambda_glue_crawler_task)
-                .next(self.lambda_quality_check_task)
-        )
+        pipeline = self.lambda_size_cluster_task.next(choose_cluster_size)
 
         # Create & deploy StateMachine
         machine = sfn.StateMachine(
@@ -131,12 +157,53 @@ class UdacityCapstoneStack(core.Stack):
 
         return machine
 
-    def _emr_create_cluster_task(self, pipeline_name):
-        # Let the Stepfunction create a uniform instance group cluster
-        # with 1 Master and 5 Core nodes
+    def _emr_create_cluster_task(self, pipeline_name, cluster_size):
+        # Let the Stepfunction create an instance fleet cluster sized for the run: an on-demand master,
+        # on-demand core nodes (they hold HDFS and the shuffle data) and optionally spot task nodes.
+        # Every fleet lists several instance types, EMR falls back to another one if a type is not available.
+        def instance_type_configs(instance_types):
+            return [
+                sfnt.EmrCreateCluster.InstanceTypeConfigProperty(
+                    instance_type=instance_type.name,
+                    weighted_capacity=instance_type.weighted_capacity,
+                    bid_price_as_percentage_of_on_demand_price=100,
+                )
+                for instance_type in instance_types
+            ]
+
+        spot_specification = sfnt.EmrCreateCluster.InstanceFleetProvisioningSpecificationsProperty(
+            spot_specification=sfnt.EmrCreateCluster.SpotProvisioningSpecificationProperty(
+                timeout_action=sfnt.EmrCreateCluster.SpotTimeoutAction.SWITCH_TO_ON_DEMAND,
+                timeout_duration_minutes=cluster_sizing.SPOT_TIMEOUT_MINUTES,
+            )
+        )
+
+        instance_fleets = [
+            sfnt.EmrCreateCluster.InstanceFleetConfigProperty(
+                instance_fleet_type=sfnt.EmrCreateCluster.InstanceRoleType.MASTER,
+                name="Master",
+                target_on_demand_capacity=cluster_sizing.MASTER_CAPACITY,
+                instance_type_configs=instance_type_configs(cluster_sizing.MASTER_INSTANCE_TYPES),
+            ),
+            sfnt.EmrCreateCluster.InstanceFleetConfigProperty(
+                instance_fleet_type=sfnt.EmrCreateCluster.InstanceRoleType.CORE,
+                name="Core",
+                target_on_demand_capacity=cluster_size.core_units,
+                instance_type_configs=instance_type_configs(cluster_sizing.WORKER_INSTANCE_TYPES),
+            ),
+        ]
+        if cluster_size.task_spot_units:
+            instance_fleets.append(sfnt.EmrCreateCluster.InstanceFleetConfigProperty(
+                instance_fleet_type=sfnt.EmrCreateCluster.InstanceRoleType.TASK,
+                name="Task",
+                target_spot_capacity=cluster_size.task_spot_units,
+                instance_type_configs=instance_type_configs(cluster_sizing.WORKER_INSTANCE_TYPES),
+                launch_specifications=spot_specification,
+            ))
+
         create_cluster = sfn.Task(
             self,
-            "CreateCluster",
+            f"CreateCluster-{cluster_size.name}",
             # this is very similar to the specification menu in AWS UI we used during the course
             task=sfnt.EmrCreateCluster(
                 name=pipeline_name,
@@ -145,63 +212,80 @@ class UdacityCapstoneStack(core.Stack):
                 ],
                 # specify the cluster worker/master hardware
                 instances=sfnt.EmrCreateCluster.InstancesConfigProperty(
-                    instance_groups=[
-                        sfnt.EmrCreateCluster.InstanceGroupConfigProperty(
-                            instance_count=1,
-                            instance_role=sfnt.EmrCreateCluster.InstanceRoleType.MASTER,
-                            instance_type="m5.xlarge",
-                            name="Master",
-                        ),
-                        sfnt.EmrCreateCluster.InstanceGroupConfigProperty(
-                            instance_count=4,
-                            instance_role=sfnt.EmrCreateCluster.InstanceRoleType.CORE,
-                            instance_type="m5.xlarge",
-                            name="Core",
-                        ),
-                    ],
+                    instance_fleets=instance_fleets,
                 ),
                 cluster_role=self.emr_instance_role,
                 service_role=self.emr_service_role,
-                release_label="emr-6.0.0",
+                # spark 3.2: adaptive skew joins and pinned python threads (see `pyspark/task_graph.py`)
+                release_label=EMR_RELEASE_LABEL,
                 log_uri=f"s3://{self.emr_logging_bucket.bucket_name}/{pipeline_name}"
             ),
-            # we output the ClusterId on the state machine status
-            output_path="$.ClusterId",
-            result_path="$.ClusterId",
+            # the ClusterId ends up on the state machine status next to the sizing of the run, which the steps read
+            result_path="$.cluster",
         )
         return create_cluster
 
-    def _emr_spark_step_task(self):
-        # Add a EMR Step to run our pyspark job; an asset with our application will be
-        # created and referenced in the job definition
+    def _create_pyspark_assets(self):
+        # an asset with our application will be created and referenced in the job definition
         root_path = Path(os.path.dirname(os.path.abspath(__file__)))
         pyspark_script = root_path.joinpath('pyspark', 'example.py').as_posix()
         pyspark_example_asset = s3_assets.Asset(
             self, "PythonScript", path=pyspark_script
         )
+        # the job imports helper modules living next to it; a directory asset is uploaded as zip archive
+        # which we can hand over to spark via `--py-files`
+        pyspark_modules = root_path.joinpath('pyspark').as_posix()
+        pyspark_modules_asset = s3_assets.Asset(
+            self, "PythonModules", path=pyspark_modules
+        )
+        return pyspark_example_asset, pyspark_modules_asset
+
+    def _emr_spark_step_task(self, tables, source):
+        # Add a EMR Step to run our pyspark job for some of our tables
+        pyspark_example_asset, pyspark_modules_asset = self.pyspark_assets
+        step_name = "".join(table.capitalize() for table in tables.split(","))
+
+        # The arguments of the step are not all static: the job gets the size of the source it reads from the sizing
+        # lambda and the execution name as the id of the run its report is part of. Paths are not allowed within the list of arguments of a task, so a Pass state puts them together
+        # with intrinsic functions (none of the static arguments contains a quote or a brace).
+        static_args = [
+            "spark-submit",
+            "--deploy-mode",
+            "cluster",
+            "--master",
+            "yarn",
+            "--py-files",
+            f"s3://{pyspark_modules_asset.s3_bucket_name}/{pyspark_modules_asset.s3_object_key}",
+            f"s3://{pyspark_example_asset.s3_bucket_name}/{pyspark_example_asset.s3_object_key}",
+            "--tables",
+            tables,
+        ]
+        args = [f"'{arg}'" for arg in static_args] + [
+            "'--input-bytes'", f"States.Format('{{}}', $.sizing.sourceBytes.{source})",
+            "'--run-id'", "$$.Execution.Name",
+        ]
+        step_args = sfn.Pass(
+            self,
+            f"SparkArgs{step_name}",
+            parameters={"args.$": f"States.Array({', '.join(args)})"},
+            result_path="$.stepArgs",
+        )
 
-        sample_spark_step = sfn.Task(
+        spark_step = sfn.Task(
             self,
-            "RunSparkExample",
+            f"RunSpark{step_name}",
             task=sfnt.EmrAddStep(
                 # the concrete ClusterId will be picked up from the current state of the statem achine
-                cluster_id=sfn.Data.string_at("$.ClusterId"),
-                name="SparkExample",
+                cluster_id=sfn.Data.string_at("$.cluster.ClusterId"),
+                name=f"Spark{step_name}",
                 # `command-runner.jar` is a jar from AWS that can be used to execute generic command (like `spark-submit`)
                 # if you write your programs in Java/Scala you can directly insert your jar file here instead of script location
                 jar="command-runner.jar",
-                args=[
-                    "spark-submit",
-                    "--deploy-mode",
-                    "cluster",
-                    "--master",
-                    "yarn",
-                    f"s3://{pyspark_example_asset.s3_bucket_name}/{pyspark_example_asset.s3_object_key}",
-                ],
+                args=sfn.Data.list_at("$.stepArgs.args"),
             ),
             result_path="DISCARD",
         )
-        return sample_spark_step
+        return sfn.Chain.start(step_args).next(spark_step)
 
     def _emr_terminate_cluster_task(self):
         # Shutdown the cluster
@@ -209,7 +293,7 @@ class UdacityCapstoneStack(core.Stack):
             self,
             "TerminateCluster",
             task=sfnt.EmrTerminateCluster(
-                cluster_id=sfn.Data.string_at("$.ClusterId"),
+                cluster_id=sfn.Data.string_at("$.cluster.ClusterId"),
                 integration_pattern=sfn.ServiceIntegrationPattern.SYNC,
             ),
             result_path="DISCARD",
@@ -286,7 +370,11 @@ class UdacityCapstoneStack(core.Stack):
         :return:
         """
         s3_target = glue.CfnCrawler.S3TargetProperty(
-            path=f"s3://{self.data_bucket.bucket_name}/"
+            path=f"s3://{self.data_bucket.bucket_name}/",
+            # bookkeeping documents of our spark job are no tables
+            exclusions=["_manifests/**", "_staging/**", "_catalog/**", "_reports/**", "_quality/**",
+                        "_stats/**", "_partitions/**", "_checkpoints/**", "songplays_stream_data/**",
+                        "_zone_maps/**"],
         )
         # schedule = "cron(30 5 * * ? *)"
 
@@ -305,37 +393,130 @@ class UdacityCapstoneStack(core.Stack):
         return crawler
 
     ### Lambda stuff
-    def _lambda_glue_crawler_task(self):
+    def _lambda_register_partitions_task(self):
         root_path = Path(os.path.dirname(os.path.abspath(__file__)))
-        lambda_handler = root_path.joinpath('lambdas', 'trigger_glue_crawler').as_posix()
+        lambda_handler = root_path.joinpath('lambdas', 'register_partitions').as_posix()
 
         func = lambda_.Function(
             self,
-            "TriggerGlueCrawlerLambdaHandler",
+            "RegisterPartitionsLambdaHandler",
             handler="lambda.lambda_handler",
             code=lambda_.AssetCode(
                 lambda_handler
             ),
             environment={
-                "crawlerName": f"{self.glue_crawler.name}"
+                "glueDatabase": self.glue_db_name,
+                "crawlerName": f"{self.glue_crawler.name}",
+                "dataBucket": self.data_bucket.bucket_name,
             },
             initial_policy=[
                 iam.PolicyStatement(
-                    actions=["glue:StartCrawler"],
+                    actions=[
+                        "glue:GetTable",
+                        "glue:GetPartitions",
+                        "glue:BatchCreatePartition",
+                        "glue:BatchDeletePartition",
+                        "glue:StartCrawler",
+                        "glue:GetCrawler",
+                    ],
                     resources=["*"],
                 ),
             ],
-            timeout=core.Duration.seconds(30),
+            # waits for the crawler if the schema of a table changed
+            timeout=core.Duration.minutes(15),
             runtime=lambda_.Runtime.PYTHON_3_7,
         )
+        # the partition manifests of the spark job
+        self.data_bucket.grant_read_write(func)
 
         # turn the lambda into a stepfunction task so we can use it in our state machine
         task = sfn.Task(
             self,
-            "TriggerGlueCrawlerLambda",
+            "RegisterPartitionsLambda",
             task=sfnt.InvokeFunction(
                 func
             ),
+            result_path="DISCARD",
+        )
+
+        return task
+
+    def _lambda_size_cluster_task(self):
+        root_path = Path(os.path.dirname(os.path.abspath(__file__)))
+        # the lambda sizes the cluster with the same `cluster_sizing.py` the CreateCluster tasks are built from,
+        # the asset is a copy of the lambda directory with the module next to it
+        lambda_handler = tempfile.mkdtemp(prefix="size_cluster.")
+        for path in glob.glob(root_path.joinpath('lambdas', 'size_cluster', '*.py').as_posix()):
+            shutil.copy(path, lambda_handler)
+        shutil.copy(root_path.joinpath('cluster_sizing.py').as_posix(), lambda_handler)
+
+        func = lambda_.Function(
+            self,
+            "SizeClusterLambdaHandler",
+            handler="lambda.lambda_handler",
+            code=lambda_.AssetCode(
+                lambda_handler
+            ),
+            environment={
+                "inputBucket": "udacity-dend",
+            },
+            initial_policy=[
+                iam.PolicyStatement(
+                    actions=["s3:ListBucket"],
+                    resources=["arn:aws:s3:::udacity-dend"],
+                ),
+            ],
+            # listing the complete input takes a while, run parameters can skip it
+            timeout=core.Duration.minutes(5),
+            runtime=lambda_.Runtime.PYTHON_3_7,
+        )
+
+        # turn the lambda into a stepfunction task so we can use it in our state machine
+        task = sfn.Task(
+            self,
+            "SizeClusterLambda",
+            task=sfnt.InvokeFunction(
+                func
+            ),
+            result_path="$.sizing",
+        )
+
+        return task
+
+    def _lambda_step_concurrency_task(self):
+        root_path = Path(os.path.dirname(os.path.abspath(__file__)))
+        lambda_handler = root_path.joinpath('lambdas', 'step_concurrency').as_posix()
+
+        func = lambda_.Function(
+            self,
+            "StepConcurrencyLambdaHandler",
+            handler="lambda.lambda_handler",
+            code=lambda_.AssetCode(
+                lambda_handler
+            ),
+            environment={
+                # the branches of the BuildTables state
+                "stepConcurrency": "3",
+            },
+            initial_policy=[
+                iam.PolicyStatement(
+                    actions=["elasticmapreduce:ModifyCluster"],
+                    resources=["*"],
+                ),
+            ],
+            timeout=core.Duration.seconds(30),
+            runtime=lambda_.Runtime.PYTHON_3_7,
+        )
+
+        # turn the lambda into a stepfunction task so we can use it in our state machine
+        task = sfn.Task(
+            self,
+            "StepConcurrencyLambda",
+            task=sfnt.InvokeFunction(
+                func,
+                payload={"ClusterId": sfn.Data.string_at("$.cluster.ClusterId")},
+            ),
+            result_path="DISCARD",
         )
 
         return task
@@ -362,10 +543,12 @@ class UdacityCapstoneStack(core.Stack):
                 lambda_handler
             ),
             environment={
-                "athenaDatabase": f"{self.glue_db_name}"
+                "athenaDatabase": f"{self.glue_db_name}",
+                "dataBucket": self.data_bucket.bucket_name,
             },
             role=lambda_role,
-            timeout=core.Duration.seconds(30),
+            # the rules run as a handful of concurrent athena queries, polled with backoff
+            timeout=core.Duration.minutes(5),
             runtime=lambda_.Runtime.PYTHON_3_7,
         )
 
@@ -398,8 +581,11 @@ class UdacityCapstoneStack(core.Stack):
         self.glue_role = self._create_glue_role()
         self.glue_crawler = self._create_glue_crawler()
 
-        self.lambda_glue_crawler_task = self._lambda_glue_crawler_task()
+        self.lambda_register_partitions_task = self._lambda_register_partitions_task()
         self.lambda_quality_check_task = self._lambda_quality_check_task()
+        self.lambda_size_cluster_task = self._lambda_size_cluster_task()
+        self.lambda_step_concurrency_task = self._lambda_step_concurrency_task()
+        self.pyspark_assets = self._create_pyspark_assets()
 
         # put together all tasks into a StateMachine/StepFunction etl pipeline
         self.state_machine = self._create_sfn_pipeline()
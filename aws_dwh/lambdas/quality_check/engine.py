@@ -0,0 +1,183 @@
+import time
+from collections import OrderedDict, namedtuple
+
+# one athena query that evaluates several rules at once, every rule is one column of the result
+Query = namedtuple("Query", ["name", "table", "sql", "columns"])
+
+# polling starts fast (most of our queries finish within a few seconds) and backs off exponentially
+POLL_INITIAL_SECONDS = 0.5
+POLL_MAX_SECONDS = 5.0
+QUERY_TIMEOUT_SECONDS = 240
+
+
+class QueryFailed(Exception):
+    pass
+
+
+def _table(database, table):
+    return f'"{database}"."{table}"'
+
+
+def compile_queries(rules, database):
+    """
+    Fold the rules into as few queries as possible:
+    all `not_null`, `unique` and `row_count_delta` rules of a table share one scan of that table and all
+    `references` rules of a table are evaluated as scalar subqueries of one additional query
+    Returns:
+        {list}: `Query` objects, `columns` maps the result column alias to the rule (None for the row count)
+    """
+    table_rules = OrderedDict()
+    reference_rules = OrderedDict()
+    for rule in rules:
+        target = reference_rules if rule.kind == "references" else table_rules
+        target.setdefault(rule.table, []).append(rule)
+
+    queries = []
+    for table, rules_of_table in table_rules.items():
+        columns = OrderedDict([("row_count", None)])
+        expressions = ["COUNT(*) AS row_count"]
+        for rule in rules_of_table:
+            alias = f"rule_{len(columns)}"
+            if rule.kind == "not_null":
+                expressions.append(f'SUM(CASE WHEN "{rule.column}" IS NULL THEN 1 ELSE 0 END) AS {alias}')
+            elif rule.kind == "unique":
+                value = f'"{rule.column}"' if not rule.where else f'CASE WHEN {rule.where} THEN "{rule.column}" END'
+                expressions.append(f'COUNT({value}) - COUNT(DISTINCT {value}) AS {alias}')
+            elif rule.kind == "row_count_delta":
+                # evaluated against the row count of the previous run
+                continue
+            else:
+                raise ValueError(f"unknown rule kind {rule.kind}")
+            columns[alias] = rule
+        queries.append(Query(
+            table,
+            table,
+            f"SELECT {', '.join(expressions)} FROM {_table(database, table)}",
+            columns,
+        ))
+
+    for table, rules_of_table in reference_rules.items():
+        columns = OrderedDict()
+        expressions = []
+        for rule in rules_of_table:
+            alias = f"rule_{len(columns)}"
+            expressions.append(
+                f"(SELECT COUNT(*) FROM {_table(database, table)} f "
+                f"LEFT JOIN (SELECT DISTINCT \"{rule.reference_column}\" AS k "
+                f"FROM {_table(database, rule.reference_table)}) d "
+                f"ON f.\"{rule.column}\" = d.k "
+                f"WHERE f.\"{rule.column}\" IS NOT NULL AND d.k IS NULL) AS {alias}"
+            )
+            columns[alias] = rule
+        queries.append(Query(f"{table}_references", table, f"SELECT {', '.join(expressions)}", columns))
+
+    return queries
+
+
+def _result_row(client, query_execution_id):
+    result = client.get_query_results(QueryExecutionId=query_execution_id)
+    header, row = result["ResultSet"]["Rows"][:2]
+    names = [column["VarCharValue"] for column in header["Data"]]
+    values = [column.get("VarCharValue") for column in row["Data"]]
+    return dict(zip(names, values))
+
+
+def run_queries(client, queries, database, output_location, timeout=QUERY_TIMEOUT_SECONDS, sleep=time.sleep):
+    """
+    Start all queries at once and poll them with exponential backoff until all of them finished
+    Arguments:
+        client: athena client (or a stand-in with the same methods, see `local_athena.py`)
+        queries {list}: queries as returned by `compile_queries`
+        database {str}: athena/glue database
+        output_location {str}: s3 location for the athena query results
+        timeout {float}: seconds after which we give up waiting
+        sleep {callable}: used for waiting between polls
+    Returns:
+        {dict}: query name -> first result row as dict (column -> string value)
+    """
+    executions = {}
+    for query in queries:
+        response = client.start_query_execution(
+            QueryString=query.sql,
+            QueryExecutionContext={"Database": database},
+            ResultConfiguration={"OutputLocation": output_location},
+        )
+        executions[response["QueryExecutionId"]] = query
+
+    results = {}
+    pending = set(executions)
+    waited = 0.0
+    delay = POLL_INITIAL_SECONDS
+    while pending:
+        for query_execution_id in sorted(pending):
+            status = client.get_query_execution(QueryExecutionId=query_execution_id)["QueryExecution"]["Status"]
+            state = status["State"]
+            if state == "SUCCEEDED":
+                results[executions[query_execution_id].name] = _result_row(client, query_execution_id)
+                pending.discard(query_execution_id)
+            elif state in ("FAILED", "CANCELLED"):
+                raise QueryFailed(f"{executions[query_execution_id].name}: {state} "
+                                  f"{status.get('StateChangeReason', '')}")
+
+        if pending:
+            if waited >= timeout:
+                raise QueryFailed(f"queries did not finish within {timeout}s: "
+                                  f"{sorted(executions[i].name for i in pending)}")
+            sleep(delay)
+            waited += delay
+            delay = min(delay * 2, POLL_MAX_SECONDS)
+
+    return results
+
+
+def evaluate(queries, results):
+    """
+    Turn the raw query results into one result per rule
+    Arguments:
+        queries {list}: queries as returned by `compile_queries`
+        results {dict}: query results as returned by `run_queries`
+    Returns:
+        {tuple}: (list of per rule results, dict of the current row counts per table)
+    """
+    rule_results = []
+    row_counts = {}
+
+    for query in queries:
+        row = results[query.name]
+        if "row_count" in query.columns:
+            row_counts[query.table] = int(row["row_count"])
+        for alias, rule in query.columns.items():
+            if rule is None:
+                continue
+            violations = int(row[alias] or 0)
+            rule_results.append({"rule": rule.name, "kind": rule.kind, "table": rule.table,
+                                 "passed": violations == 0, "violations": violations})
+
+    return rule_results, row_counts
+
+
+def evaluate_row_count_deltas(rules, row_counts, previous_row_counts):
+    """a table must not shrink below `min_ratio` of the row count it had in the previous run"""
+    results = []
+    for rule in rules:
+        if rule.kind != "row_count_delta":
+            continue
+        current = row_counts.get(rule.table)
+        previous = previous_row_counts.get(rule.table)
+        passed = previous is None or (current is not None and current >= previous * rule.min_ratio)
+        results.append({"rule": rule.name, "kind": rule.kind, "table": rule.table, "passed": passed,
+                        "row_count": current, "previous_row_count": previous})
+    return results
+
+
+def run_rules(client, rules, database, output_location, previous_row_counts=None, sleep=time.sleep):
+    """
+    Evaluate a rule set
+    Returns:
+        {tuple}: (list of per rule results, dict of the current row counts per table)
+    """
+    queries = compile_queries(rules, database)
+    results = run_queries(client, queries, database, output_location, sleep=sleep)
+    rule_results, row_counts = evaluate(queries, results)
+    rule_results += evaluate_row_count_deltas(rules, row_counts, previous_row_counts or {})
+    return rule_results, row_counts
@@ -1,56 +1,67 @@
-import boto3
+import json
 import os
 
-# athena constants
-DATABASE = os.environ["athenaDatabase"]
-TABLE = 'artist_data'
-S3_OUTPUT = 's3://athena-query-results-udacc/'
-
+import boto3
 
-def lambda_handler(event, context):
-    # dq query
-    query = 'SELECT COUNT(1) as cnt FROM "dbsparkify"."artist_data" WHERE name IS NULL;'
+from engine import evaluate_row_count_deltas, run_rules
+from rules import RULES
+from stats import ZONE_MAPS_PREFIX, evaluate_with_stats, load_sidecars
 
-    # athena client
-    client = boto3.client('athena')
+# athena constants
+DATABASE = os.environ["athenaDatabase"]
+S3_OUTPUT = os.environ.get("athenaOutput", 's3://athena-query-results-udacc/')
 
-    # Execution
-    response = client.start_query_execution(
-        QueryString=query,
-        QueryExecutionContext={
-            'Database': DATABASE
-        },
-        ResultConfiguration={
-            'OutputLocation': S3_OUTPUT,
-        }
-    )
+# row counts of the previous run, needed for the row count delta rules
+DATA_BUCKET = os.environ.get("dataBucket")
+ROW_COUNTS_KEY = "_quality/row_counts.json"
 
-    query_execution_id = response['QueryExecutionId']
-    print(query_execution_id)
 
-    # check query status
-    while True:
-        query_status = client.get_query_execution(QueryExecutionId=query_execution_id)
-        query_execution_status = query_status['QueryExecution']['Status']['State']
+def _load_row_counts(s3):
+    try:
+        response = s3.get_object(Bucket=DATA_BUCKET, Key=ROW_COUNTS_KEY)
+    except s3.exceptions.NoSuchKey:
+        return {}
+    return json.loads(response["Body"].read())
 
-        if query_execution_status == 'SUCCEEDED':
-            print("STATUS:" + query_execution_status)
-            break
 
-        if query_execution_status == 'FAILED':
-            raise Exception("STATUS:" + query_execution_status)
+def lambda_handler(event, context):
+    """
+    Evaluates all data quality rules of `rules.RULES` on the athena tables of our data lake
+    and returns one result per rule. Rules the statistics sidecars of the tables can answer
+    are not sent to athena.
+    """
+    # athena client
+    client = boto3.client('athena')
+    s3 = boto3.client('s3')
 
-    # get query results
-    result = client.get_query_results(QueryExecutionId=query_execution_id)
-    print(result['ResultSet']['Rows'][1]['Data'][0]['VarCharValue'])
+    previous_row_counts = _load_row_counts(s3) if DATA_BUCKET else {}
+    sidecars = load_sidecars(s3, DATA_BUCKET, {rule.table for rule in RULES}) if DATA_BUCKET else {}
+    zone_maps = load_sidecars(s3, DATA_BUCKET, {rule.table for rule in RULES if rule.kind == "unique"},
+                              prefix=ZONE_MAPS_PREFIX) if DATA_BUCKET else {}
+    results, remaining_rules, row_counts = evaluate_with_stats(RULES, sidecars, zone_maps=zone_maps)
 
-    # retrieve the value of the count column of our `query`
-    if result['ResultSet']['Rows'][1]['Data'][0]['VarCharValue'] == '0':
+    athena_results, athena_row_counts = run_rules(client, remaining_rules, DATABASE, S3_OUTPUT,
+                                                  previous_row_counts=previous_row_counts)
+    row_counts.update(athena_row_counts)
+    results += athena_results
+    results += evaluate_row_count_deltas(
+        [rule for rule in RULES if rule.table in sidecars], row_counts, previous_row_counts
+    )
+    print(f"{len(RULES) - len(remaining_rules)} of {len(RULES)} rules answered by the table statistics and zone maps")
 
-        check_result = "quality check passed"
+    failed = [result for result in results if not result["passed"]]
+    for result in failed:
+        print(f"FAILED: {result}")
 
-    else:
-        check_result = "quality check not passed"
+    if DATA_BUCKET:
+        s3.put_object(Bucket=DATA_BUCKET, Key=ROW_COUNTS_KEY, Body=json.dumps(row_counts).encode("utf-8"))
 
+    check_result = "quality check passed" if not failed else "quality check not passed"
 
-    return check_result
\ No newline at end of file
+    return {
+        "status": check_result,
+        "passed": not failed,
+        "failed_rules": [result["rule"] for result in failed],
+        "results": results,
+        "row_counts": row_counts,
+    }
@@ -0,0 +1,54 @@
+import sqlite3
+import uuid
+
+
+class LocalAthenaClient:
+    """
+    Local stand-in for the athena client, backed by an in-memory sqlite database.
+    It implements the subset of the boto3 athena api our quality check uses, so the rule engine
+    can be exercised without AWS:
+
+        client = LocalAthenaClient("dwh_udacity_capstone")
+        client.load_table("artist_data", [{"artist_id": "AR1", "name": None}])
+        results, row_counts = engine.run_rules(client, rules.RULES, "dwh_udacity_capstone", "s3://unused/")
+    """
+
+    def __init__(self, database):
+        self.database = database
+        self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self.connection.execute(f"ATTACH DATABASE ':memory:' AS \"{database}\"")
+        self.executions = {}
+
+    def load_table(self, table, rows, columns=None):
+        """create `table` in our database and insert `rows` (a list of dicts)"""
+        columns = columns or list(rows[0])
+        column_list = ", ".join(f'"{column}"' for column in columns)
+        self.connection.execute(f'DROP TABLE IF EXISTS "{self.database}"."{table}"')
+        self.connection.execute(f'CREATE TABLE "{self.database}"."{table}" ({column_list})')
+        self.connection.executemany(
+            f'INSERT INTO "{self.database}"."{table}" VALUES ({", ".join("?" for _ in columns)})',
+            [[row.get(column) for column in columns] for row in rows],
+        )
+
+    def start_query_execution(self, QueryString, QueryExecutionContext=None, ResultConfiguration=None):
+        query_execution_id = str(uuid.uuid4())
+        try:
+            cursor = self.connection.execute(QueryString)
+            names = [description[0] for description in cursor.description or []]
+            self.executions[query_execution_id] = ("SUCCEEDED", "", names, cursor.fetchall())
+        except sqlite3.Error as e:
+            self.executions[query_execution_id] = ("FAILED", str(e), [], [])
+        return {"QueryExecutionId": query_execution_id}
+
+    def get_query_execution(self, QueryExecutionId):
+        state, reason, _, _ = self.executions[QueryExecutionId]
+        return {"QueryExecution": {"QueryExecutionId": QueryExecutionId,
+                                   "Status": {"State": state, "StateChangeReason": reason}}}
+
+    def get_query_results(self, QueryExecutionId):
+        _, _, names, rows = self.executions[QueryExecutionId]
+
+        def _row(values):
+            return {"Data": [{} if value is None else {"VarCharValue": str(value)} for value in values]}
+
+        return {"ResultSet": {"Rows": [_row(names)] + [_row(row) for row in rows]}}
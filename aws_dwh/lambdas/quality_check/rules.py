@@ -0,0 +1,65 @@
+from collections import namedtuple
+
+# A declarative data quality rule
+#   kind: `not_null`, `unique`, `references` or `row_count_delta`
+#   table/column: what the rule checks
+#   reference_table/reference_column: the dimension a `references` rule looks up `column` in
+#   min_ratio: a `row_count_delta` rule fails if the table shrank below this share of the previous row count
+#   where: a `unique` rule only considers the rows matching this sql condition
+Rule = namedtuple(
+    "Rule",
+    ["name", "kind", "table", "column", "reference_table", "reference_column", "min_ratio", "where"],
+    defaults=[None, None, None, None, None],
+)
+
+
+def not_null(table, column):
+    return Rule(f"{table}.{column} not null", "not_null", table, column)
+
+
+def unique(table, column, where=None):
+    name = f"{table}.{column} unique" + (f" where {where}" if where else "")
+    return Rule(name, "unique", table, column, where=where)
+
+
+def references(table, column, reference_table, reference_column):
+    return Rule(f"{table}.{column} references {reference_table}.{reference_column}", "references", table, column,
+                reference_table=reference_table, reference_column=reference_column)
+
+
+def row_count_delta(table, min_ratio=0.9):
+    return Rule(f"{table} row count delta", "row_count_delta", table, min_ratio=min_ratio)
+
+
+RULES = [
+    not_null("song_data", "song_id"),
+    not_null("song_data", "title"),
+    unique("song_data", "song_id"),
+    row_count_delta("song_data"),
+
+    not_null("artist_data", "artist_id"),
+    not_null("artist_data", "name"),
+    unique("artist_data", "artist_id"),
+    row_count_delta("artist_data"),
+
+    not_null("users_data", "user_id"),
+    not_null("users_data", "level"),
+    not_null("users_data", "valid_from"),
+    # users_data keeps all versions of a user, but only one of them is the current one
+    unique("users_data", "user_id", where="is_current"),
+    row_count_delta("users_data"),
+
+    not_null("time_data", "start_time"),
+    unique("time_data", "start_time"),
+    row_count_delta("time_data"),
+
+    not_null("songplays_data", "songplay_id"),
+    not_null("songplays_data", "start_time"),
+    not_null("songplays_data", "user_id"),
+    unique("songplays_data", "songplay_id"),
+    references("songplays_data", "song_id", "song_data", "song_id"),
+    references("songplays_data", "artist_id", "artist_data", "artist_id"),
+    references("songplays_data", "user_id", "users_data", "user_id"),
+    references("songplays_data", "start_time", "time_data", "start_time"),
+    row_count_delta("songplays_data"),
+]
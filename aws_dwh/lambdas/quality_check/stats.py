@@ -0,0 +1,108 @@
+import json
+
+# statistics sidecars the spark job writes next to every table, see `pyspark/table_stats.py`
+STATS_PREFIX = "_stats/"
+
+# per file zone map indexes of the tables, see `pyspark/zone_maps.py`
+ZONE_MAPS_PREFIX = "_zone_maps/"
+
+
+def load_sidecars(s3, bucket, tables, prefix=STATS_PREFIX):
+    """
+    Returns:
+        {dict}: table -> sidecar, tables without a sidecar (e.g. written by the local engine) are missing and
+            so are tables whose sidecar does not describe all of their partitions, athena checks these tables
+    """
+    sidecars = {}
+    for table in tables:
+        try:
+            response = s3.get_object(Bucket=bucket, Key=f"{prefix}{table}.json")
+        except s3.exceptions.NoSuchKey:
+            continue
+        sidecar = json.loads(response["Body"].read())
+        if not sidecar.get("complete"):
+            print(f"{prefix}{table}.json covers only part of the table, ignoring it")
+            continue
+        sidecars[table] = sidecar
+    return sidecars
+
+
+def _violations(rule, sidecar):
+    """
+    Returns:
+        {int}: violations of `rule` according to the statistics, None if they do not answer the rule
+    """
+    partitions = sidecar["partitions"].values()
+    if any(rule.column not in partition["columns"] for partition in partitions):
+        return None
+    if rule.kind == "not_null":
+        return sum(partition["columns"][rule.column]["nulls"] for partition in partitions)
+    if rule.kind == "unique" and not sidecar["partition_by"]:
+        # distinct counts of several partitions can not be added up, a key might show up in more than one,
+        # an unpartitioned table has a single entry (or none if it is empty)
+        violations = 0
+        for partition in partitions:
+            column = partition["columns"][rule.column]
+            if "distinct" not in column:
+                return None
+            violations += partition["row_count"] - column["nulls"] - column["distinct"]
+        return violations
+    return None
+
+
+def _unique_by_zone_maps(rule, index):
+    """
+    A key is unique if it is unique within every file and the key ranges of the files do not overlap,
+    e.g. for tables sorted/clustered by their key.
+    Returns:
+        {int}: 0 if the zone maps prove the key unique, None if athena has to check it
+    """
+    ranges = []
+    for zone_map in index["files"].values():
+        column = zone_map["columns"].get(rule.column)
+        if column is None or "distinct" not in column or "min" not in column:
+            return None
+        if zone_map["row_count"] - column["nulls"] != column["distinct"]:
+            # duplicates within a file, athena counts all of them
+            return None
+        if column["min"] is not None:
+            ranges.append((column["min"], column["max"]))
+
+    ranges.sort()
+    for (_, previous_max), (current_min, _) in zip(ranges, ranges[1:]):
+        if current_min <= previous_max:
+            return None
+    return 0
+
+
+def evaluate_with_stats(rules, sidecars, zone_maps=None):
+    """
+    Answer all rules the statistics sidecars can answer without querying athena:
+    `not_null` from the null counts, `unique` of unpartitioned tables from the distinct counts and the row counts
+    needed by `row_count_delta`; `unique` of partitioned tables whose files hold disjoint key ranges from the
+    zone maps. Only complete sidecars and zone maps (as returned by `load_sidecars`) may be passed.
+    Returns:
+        {tuple}: (list of per rule results, rules that still need athena, dict of row counts per table)
+    """
+    row_counts = {
+        table: sum(partition["row_count"] for partition in sidecar["partitions"].values())
+        for table, sidecar in sidecars.items()
+    }
+
+    results = []
+    remaining = []
+    for rule in rules:
+        violations = None
+        if rule.table in sidecars and rule.kind in ("not_null", "unique") and not rule.where:
+            violations = _violations(rule, sidecars[rule.table])
+        if violations is None and rule.table in (zone_maps or {}) and rule.kind == "unique" and not rule.where:
+            violations = _unique_by_zone_maps(rule, zone_maps[rule.table])
+        if violations is None:
+            remaining.append(rule)
+            continue
+        results.append({"rule": rule.name, "kind": rule.kind, "table": rule.table,
+                        "passed": violations == 0, "violations": violations, "source": "stats"})
+
+    # row count deltas only need athena for the tables without statistics
+    remaining = [rule for rule in remaining if not (rule.kind == "row_count_delta" and rule.table in row_counts)]
+    return results, remaining, row_counts
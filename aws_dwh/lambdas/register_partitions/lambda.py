@@ -0,0 +1,40 @@
+import json
+import os
+
+import boto3
+
+from registration import register_partitions
+
+DATABASE = os.environ["glueDatabase"]
+CRAWLER_NAME = os.environ["crawlerName"]
+
+# partition manifests the spark job writes next to our tables
+DATA_BUCKET = os.environ["dataBucket"]
+MANIFEST_PREFIX = "_partitions/"
+
+
+def _load_manifests(s3):
+    manifests = {}
+    for page in s3.get_paginator("list_objects_v2").paginate(Bucket=DATA_BUCKET, Prefix=MANIFEST_PREFIX):
+        for item in page.get("Contents", []):
+            manifests[item["Key"]] = json.loads(s3.get_object(Bucket=DATA_BUCKET, Key=item["Key"])["Body"].read())
+    return manifests
+
+
+def lambda_handler(event, context):
+    """
+    Registers the partitions the spark job wrote in the glue catalog,
+    the crawler only runs if the schema of a table changed
+    """
+    glue = boto3.client("glue")
+    s3 = boto3.client("s3")
+
+    manifests = _load_manifests(s3)
+    result = register_partitions(glue, DATABASE, CRAWLER_NAME, list(manifests.values()))
+
+    # registered partitions are done, the next run of the job adds its own ones
+    for key, manifest in manifests.items():
+        manifest.update(partitions=[], replace_all=False)
+        s3.put_object(Bucket=DATA_BUCKET, Key=key, Body=json.dumps(manifest).encode("utf-8"))
+
+    return result
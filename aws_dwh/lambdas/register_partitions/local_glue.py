@@ -0,0 +1,77 @@
+class _Exceptions:
+    class EntityNotFoundException(Exception):
+        pass
+
+    class CrawlerRunningException(Exception):
+        pass
+
+
+class LocalGlueClient:
+    """
+    Local stand-in for the glue client, keeping tables and partitions in memory.
+    It implements the subset of the boto3 glue api the registration uses, so it
+    can be exercised without AWS:
+
+        client = LocalGlueClient("dwh_udacity_capstone")
+        client.create_table("songplays_data", [("start_time", "bigint")], ["year", "month"], "s3://bucket/songplays_data/")
+        registration.register_partitions(client, "dwh_udacity_capstone", "crawler", manifests, sleep=lambda _: None)
+
+    A crawl is finished immediately and creates the tables passed as `crawl_result`.
+    """
+
+    exceptions = _Exceptions
+
+    def __init__(self, database, crawl_result=None):
+        self.database = database
+        self.tables = {}
+        self.partitions = {}
+        self.crawl_result = crawl_result or []
+        self.crawls = 0
+
+    def create_table(self, name, columns, partition_keys, location):
+        self.tables[name] = {
+            "Name": name,
+            "DatabaseName": self.database,
+            "StorageDescriptor": {
+                "Columns": [{"Name": column, "Type": type_} for column, type_ in columns],
+                "Location": location,
+            },
+            "PartitionKeys": [{"Name": key, "Type": "string"} for key in partition_keys],
+        }
+        self.partitions.setdefault(name, {})
+
+    def get_table(self, DatabaseName, Name):
+        if Name not in self.tables:
+            raise self.exceptions.EntityNotFoundException(f"table {DatabaseName}.{Name} not found")
+        return {"Table": self.tables[Name]}
+
+    def batch_create_partition(self, DatabaseName, TableName, PartitionInputList):
+        if len(PartitionInputList) > 100:
+            raise ValueError("at most 100 partitions per call")
+        errors = []
+        for partition in PartitionInputList:
+            values = tuple(partition["Values"])
+            if values in self.partitions[TableName]:
+                errors.append({"PartitionValues": list(values),
+                               "ErrorDetail": {"ErrorCode": "AlreadyExistsException"}})
+            else:
+                self.partitions[TableName][values] = partition
+        return {"Errors": errors}
+
+    def batch_delete_partition(self, DatabaseName, TableName, PartitionsToDelete):
+        if len(PartitionsToDelete) > 25:
+            raise ValueError("at most 25 partitions per call")
+        for partition in PartitionsToDelete:
+            self.partitions[TableName].pop(tuple(partition["Values"]), None)
+        return {"Errors": []}
+
+    def get_partitions(self, DatabaseName, TableName, NextToken=None):
+        return {"Partitions": [{"Values": list(values)} for values in self.partitions[TableName]]}
+
+    def start_crawler(self, Name):
+        self.crawls += 1
+        for table in self.crawl_result:
+            self.create_table(*table)
+
+    def get_crawler(self, Name):
+        return {"Crawler": {"Name": Name, "State": "READY", "LastCrawl": {"Status": "SUCCEEDED"}}}
@@ -0,0 +1,151 @@
+import time
+
+# limits of the glue partition apis per call
+CREATE_BATCH_SIZE = 100
+DELETE_BATCH_SIZE = 25
+
+# a crawl of our bucket takes minutes, so we poll slowly and back off up to a minute
+POLL_INITIAL_SECONDS = 5.0
+POLL_MAX_SECONDS = 60.0
+CRAWLER_TIMEOUT_SECONDS = 840
+
+
+class RegistrationFailed(Exception):
+    pass
+
+
+def _chunks(items, size):
+    return [items[start:start + size] for start in range(0, len(items), size)]
+
+
+def _get_table(glue, database, table):
+    try:
+        return glue.get_table(DatabaseName=database, Name=table)["Table"]
+    except glue.exceptions.EntityNotFoundException:
+        return None
+
+
+def schema_changed(glue_table, manifest):
+    """
+    The crawler has to (re)create a table that does not exist yet or whose columns or partition keys changed.
+    Partition key types are not compared, the crawler infers them from the directory names as strings.
+    """
+    if glue_table is None:
+        return True
+    columns = {column["Name"]: column["Type"] for column in glue_table["StorageDescriptor"]["Columns"]}
+    partition_keys = [column["Name"] for column in glue_table.get("PartitionKeys", [])]
+    return columns != {column["Name"]: column["Type"] for column in manifest["columns"]} \
+        or partition_keys != [column["Name"] for column in manifest["partition_keys"]]
+
+
+def _partition_input(glue_table, values):
+    storage_descriptor = dict(glue_table["StorageDescriptor"])
+    directory = "/".join(f"{key['Name']}={value}" for key, value in zip(glue_table["PartitionKeys"], values))
+    storage_descriptor["Location"] = f"{storage_descriptor['Location'].rstrip('/')}/{directory}/"
+    return {"Values": values, "StorageDescriptor": storage_descriptor}
+
+
+def _registered_partitions(glue, database, table):
+    partitions = set()
+    kwargs = {"DatabaseName": database, "TableName": table}
+    while True:
+        response = glue.get_partitions(**kwargs)
+        partitions.update(tuple(partition["Values"]) for partition in response["Partitions"])
+        if not response.get("NextToken"):
+            return partitions
+        kwargs["NextToken"] = response["NextToken"]
+
+
+def register_table_partitions(glue, database, glue_table, manifest):
+    """
+    Register the partitions of the manifest in batches, partitions that already exist are fine.
+    If the manifest lists all partitions of the table (`replace_all`), registered partitions that are not part
+    of it anymore are deleted.
+    Returns:
+        {dict}: number of created and deleted partitions
+    """
+    table = glue_table["Name"]
+    partitions = [list(values) for values in manifest["partitions"]]
+
+    created = 0
+    for chunk in _chunks(partitions, CREATE_BATCH_SIZE):
+        response = glue.batch_create_partition(
+            DatabaseName=database,
+            TableName=table,
+            PartitionInputList=[_partition_input(glue_table, values) for values in chunk],
+        )
+        errors = [error for error in response.get("Errors", [])
+                  if error["ErrorDetail"]["ErrorCode"] != "AlreadyExistsException"]
+        if errors:
+            raise RegistrationFailed(f"{table}: {errors}")
+        created += len(chunk) - len(response.get("Errors", []))
+
+    deleted = 0
+    if manifest.get("replace_all"):
+        stale = sorted(_registered_partitions(glue, database, table) - {tuple(values) for values in partitions})
+        for chunk in _chunks(stale, DELETE_BATCH_SIZE):
+            response = glue.batch_delete_partition(
+                DatabaseName=database,
+                TableName=table,
+                PartitionsToDelete=[{"Values": list(values)} for values in chunk],
+            )
+            if response.get("Errors"):
+                raise RegistrationFailed(f"{table}: {response['Errors']}")
+            deleted += len(chunk)
+
+    print(f"{table}: registered {created} new partitions, deleted {deleted} stale partitions")
+    return {"created": created, "deleted": deleted}
+
+
+def run_crawler(glue, crawler_name, timeout=CRAWLER_TIMEOUT_SECONDS, sleep=time.sleep):
+    """start the crawler (or join a running crawl) and wait with exponential backoff until it finished"""
+    try:
+        glue.start_crawler(Name=crawler_name)
+    except glue.exceptions.CrawlerRunningException:
+        print(f"crawler {crawler_name} is already running")
+
+    waited = 0.0
+    delay = POLL_INITIAL_SECONDS
+    while True:
+        crawler = glue.get_crawler(Name=crawler_name)["Crawler"]
+        if crawler["State"] == "READY":
+            status = crawler.get("LastCrawl", {}).get("Status")
+            if status != "SUCCEEDED":
+                raise RegistrationFailed(f"crawler {crawler_name} finished with {status}: "
+                                         f"{crawler.get('LastCrawl', {}).get('ErrorMessage', '')}")
+            return
+        if waited >= timeout:
+            raise RegistrationFailed(f"crawler {crawler_name} did not finish within {timeout}s")
+        sleep(delay)
+        waited += delay
+        delay = min(delay * 2, POLL_MAX_SECONDS)
+
+
+def register_partitions(glue, database, crawler_name, manifests, sleep=time.sleep):
+    """
+    Make the partitions of the manifests visible in the glue catalog (and hence in athena)
+    Arguments:
+        glue: glue client (or a stand-in with the same methods, see `local_glue.py`)
+        database {str}: glue database
+        crawler_name {str}: crawler of our bucket, only started if the schema of a table changed
+        manifests {list}: partition manifests written by the spark job
+        sleep {callable}: used for waiting between polls of the crawler
+    Returns:
+        {dict}: `crawled` tables and `registered` partitions per table
+    """
+    tables = {manifest["table"]: _get_table(glue, database, manifest["table"]) for manifest in manifests}
+    crawled = sorted(
+        manifest["table"] for manifest in manifests if schema_changed(tables[manifest["table"]], manifest)
+    )
+
+    if crawled:
+        # the crawler creates/updates the tables and registers all of their partitions itself
+        print(f"schema of {crawled} changed, running crawler {crawler_name}")
+        run_crawler(glue, crawler_name, sleep=sleep)
+
+    registered = {}
+    for manifest in manifests:
+        table = manifest["table"]
+        if table not in crawled and manifest["partitions"]:
+            registered[table] = register_table_partitions(glue, database, tables[table], manifest)
+    return {"crawled": crawled, "registered": registered}
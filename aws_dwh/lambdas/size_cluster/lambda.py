@@ -0,0 +1,29 @@
+import os
+
+import boto3
+
+# deployed next to this module, see `_lambda_size_cluster_task` of the stack
+from cluster_sizing import INPUT_SOURCES, size_run
+
+# raw input of the spark job
+INPUT_BUCKET = os.environ.get("inputBucket", "udacity-dend")
+
+
+def _source_bytes(s3):
+    source_bytes = {}
+    for source in INPUT_SOURCES:
+        source_bytes[source] = 0
+        for page in s3.get_paginator("list_objects_v2").paginate(Bucket=INPUT_BUCKET, Prefix=f"{source}/"):
+            source_bytes[source] += sum(item["Size"] for item in page.get("Contents", []))
+    return source_bytes
+
+
+def lambda_handler(event, context):
+    """
+    Picks the size class of the EMR cluster for this run and measures the sources the steps read,
+    they hand their size on to the spark job (`--input-bytes`). See `cluster_sizing.size_run` for
+    the execution input that skips the listing.
+    """
+    sizing = size_run(event or {}, lambda: _source_bytes(boto3.client("s3")))
+    print(f"{sizing['sourceBytes']} bytes of input -> size class {sizing['sizeClass']}")
+    return sizing
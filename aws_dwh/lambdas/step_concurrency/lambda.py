@@ -0,0 +1,16 @@
+import os
+
+import boto3
+
+emr = boto3.client("emr")
+
+
+def lambda_handler(event, context):
+    """
+    Lets the cluster run several steps at once, so the independent table builds of our pipeline
+    can run concurrently (there is no stepfunction task for `ModifyCluster`)
+    """
+    step_concurrency = int(os.environ["stepConcurrency"])
+    response = emr.modify_cluster(ClusterId=event["ClusterId"], StepConcurrencyLevel=step_concurrency)
+    print(f"step concurrency of {event['ClusterId']}: {response['StepConcurrencyLevel']}")
+    return {"StepConcurrencyLevel": response["StepConcurrencyLevel"]}
@@ -0,0 +1,185 @@
+"""
+Query the tables of our data lake locally, without deploying anything and without a spark session.
+The parquet tables written by `pyspark/example.py` (local directory or s3 / an s3 compatible store) are registered
+as views in an embedded duckdb database, named like the glue tables (`song_data`, `songplays_data`, ...).
+duckdb reads the hive partition directories as columns, prunes partitions a filter excludes and only reads
+the columns a query needs.
+
+    $ python aws_dwh/local_query.py --data /tmp/sparkify/ "SELECT level, COUNT(*) FROM songplays_data GROUP BY 1"
+    $ python aws_dwh/local_query.py --data /tmp/sparkify/ --quality-check
+    $ python aws_dwh/local_query.py --data s3://capstone-uda-data/ --s3-endpoint localhost:9000 "SELECT ..."
+"""
+import argparse
+import glob
+import os
+import sys
+import time
+import uuid
+
+import duckdb
+
+AWS_DWH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(AWS_DWH_DIR, "pyspark"))
+sys.path.insert(0, os.path.join(AWS_DWH_DIR, "lambdas", "quality_check"))
+
+from engine import run_rules  # noqa: E402
+from rules import RULES  # noqa: E402
+from tables import TABLES  # noqa: E402
+
+# the glue/athena database of our stack, the quality check sql refers to the tables as `"<database>"."<table>"`
+DATABASE = "dwh_udacity_capstone"
+
+# rows of a query result that are printed
+MAX_ROWS = 50
+
+
+def _is_remote(path):
+    return path.startswith(("s3://", "s3a://"))
+
+
+def connect(data, database=DATABASE, s3_endpoint=None):
+    """
+    Open an in-memory duckdb database and register a view for every table found under `data`
+    Arguments:
+        data {str}: root of our output tables, local path or `s3://`/`s3a://` url
+        database {str}: schema the views are created in, it is also the default schema of the connection
+        s3_endpoint {str}: host(:port) of an s3 compatible store, e.g. minio
+    Returns:
+        {tuple}: (duckdb connection, list of the registered views)
+    """
+    connection = duckdb.connect(":memory:")
+    if _is_remote(data):
+        # duckdb knows s3:// only, the credentials are the usual aws environment variables
+        data = "s3://" + data.split("://", 1)[1]
+        connection.execute("INSTALL httpfs")
+        connection.execute("LOAD httpfs")
+        settings = {
+            "s3_region": os.environ.get("AWS_DEFAULT_REGION", os.environ.get("AWS_REGION")),
+            "s3_access_key_id": os.environ.get("AWS_ACCESS_KEY_ID"),
+            "s3_secret_access_key": os.environ.get("AWS_SECRET_ACCESS_KEY"),
+            "s3_session_token": os.environ.get("AWS_SESSION_TOKEN"),
+        }
+        if s3_endpoint:
+            settings.update({"s3_endpoint": s3_endpoint, "s3_url_style": "path",
+                             "s3_use_ssl": not s3_endpoint.startswith(("localhost", "127.0.0.1"))})
+        for name, value in settings.items():
+            if isinstance(value, bool):
+                connection.execute(f"SET {name} = {str(value).lower()}")
+            elif value is not None:
+                connection.execute(f"SET {name} = '{value}'")
+
+    connection.execute(f'CREATE SCHEMA IF NOT EXISTS "{database}"')
+    connection.execute(f"SET search_path = '{database},main'")
+
+    views = []
+    for spec in TABLES.values():
+        view = spec.location.strip("/")
+        pattern = f"{data}{spec.location}" + "*/" * len(spec.partition_by) + "*.parquet"
+        if not _is_remote(data) and not glob.glob(pattern):
+            continue
+        try:
+            connection.execute(
+                f'CREATE OR REPLACE VIEW "{database}"."{view}" AS '
+                f"SELECT * FROM read_parquet('{pattern}', hive_partitioning = true)"
+            )
+        except duckdb.Error as e:
+            # e.g. a table the pipeline did not write (yet)
+            print(f"skipping {view}: {e}")
+            continue
+        views.append(view)
+    return connection, views
+
+
+class LocalDuckDBClient:
+    """
+    Stand-in for the athena client backed by the duckdb views of `connect`, it implements the subset of the
+    boto3 athena api the quality check uses (see `lambdas/quality_check/local_athena.py` for the sqlite one)
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+        self.executions = {}
+
+    def start_query_execution(self, QueryString, QueryExecutionContext=None, ResultConfiguration=None):
+        query_execution_id = str(uuid.uuid4())
+        try:
+            cursor = self.connection.execute(QueryString)
+            names = [description[0] for description in cursor.description or []]
+            self.executions[query_execution_id] = ("SUCCEEDED", "", names, cursor.fetchall())
+        except duckdb.Error as e:
+            self.executions[query_execution_id] = ("FAILED", str(e), [], [])
+        return {"QueryExecutionId": query_execution_id}
+
+    def get_query_execution(self, QueryExecutionId):
+        state, reason, _, _ = self.executions[QueryExecutionId]
+        return {"QueryExecution": {"QueryExecutionId": QueryExecutionId,
+                                   "Status": {"State": state, "StateChangeReason": reason}}}
+
+    def get_query_results(self, QueryExecutionId):
+        _, _, names, rows = self.executions[QueryExecutionId]
+
+        def _row(values):
+            return {"Data": [{} if value is None else {"VarCharValue": str(value)} for value in values]}
+
+        return {"ResultSet": {"Rows": [_row(names)] + [_row(row) for row in rows]}}
+
+
+def format_result(names, rows, max_rows=MAX_ROWS):
+    """the rows as a plain text table, at most `max_rows` of them"""
+    cells = [[str(name) for name in names]] + [["NULL" if value is None else str(value) for value in row]
+                                               for row in rows[:max_rows]]
+    widths = [max(len(row[i]) for row in cells) for i in range(len(names))]
+    lines = ["  ".join(value.ljust(width) for value, width in zip(row, widths)) for row in cells]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    if len(rows) > max_rows:
+        lines.append(f"... {len(rows) - max_rows} more rows")
+    return "\n".join(lines)
+
+
+def run_query(connection, sql):
+    started = time.perf_counter()
+    cursor = connection.execute(sql)
+    names = [description[0] for description in cursor.description or []]
+    rows = cursor.fetchall()
+    print(format_result(names, rows))
+    print(f"({len(rows)} rows in {(time.perf_counter() - started) * 1000:.1f} ms)")
+
+
+def run_quality_check(connection, views, database=DATABASE):
+    """
+    Evaluate the rules of the quality check lambda that only refer to registered views
+    Returns:
+        {bool}: whether all of them passed
+    """
+    rules = [rule for rule in RULES if rule.table in views and (rule.reference_table or rule.table) in views]
+    started = time.perf_counter()
+    # the local database has no previous run, hence all row count deltas pass
+    results, _ = run_rules(LocalDuckDBClient(connection), rules, database, "unused", sleep=lambda seconds: None)
+    for result in results:
+        print(f"{'PASSED' if result['passed'] else 'FAILED'}  {result['rule']}")
+    print(f"({len(results)} rules in {(time.perf_counter() - started) * 1000:.1f} ms)")
+    return all(result["passed"] for result in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="query the data lake tables locally with duckdb")
+    parser.add_argument("queries", nargs="*", help="sql queries, the tables are named like the glue tables")
+    parser.add_argument("--data", required=True, help="root of the output tables, local path or s3 url")
+    parser.add_argument("--database", default=DATABASE)
+    parser.add_argument("--s3-endpoint", help="host(:port) of an s3 compatible store")
+    parser.add_argument("--quality-check", action="store_true", help="evaluate the rules of the quality check")
+    args = parser.parse_args()
+
+    data = args.data if args.data.endswith("/") else args.data + "/"
+    connection, views = connect(data, database=args.database, s3_endpoint=args.s3_endpoint)
+    print(f"registered views: {', '.join(views) or '(none)'}")
+
+    for sql in args.queries:
+        run_query(connection, sql)
+
+    if args.quality_check and not run_quality_check(connection, views, database=args.database):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
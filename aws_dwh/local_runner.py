@@ -0,0 +1,465 @@
+"""
+Run the state machine of `UdacityCapstoneStack` on a laptop: the definition (amazon states language) is taken from
+the synthesized stack and interpreted state by state. EMR tasks become local spark runs of `pyspark/example.py`,
+the lambdas are replaced by local stand-ins working on the local output directory. Every state is timed and the
+critical path through the pipeline is reported, e.g. to measure how a change in the step layout pays off.
+
+    $ python aws_dwh/local_runner.py --input-data aws_dwh/data/ --output-data /tmp/sparkify/
+    $ python aws_dwh/local_runner.py --definition state_machine.json --input '{"sizeClass": "small"}' ...
+"""
+import argparse
+import copy
+import glob
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+AWS_DWH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.dirname(AWS_DWH_DIR))
+sys.path.insert(0, AWS_DWH_DIR)
+sys.path.insert(0, os.path.join(AWS_DWH_DIR, "lambdas", "register_partitions"))
+sys.path.insert(0, os.path.join(AWS_DWH_DIR, "lambdas", "quality_check"))
+
+from aws_dwh import cluster_sizing  # noqa: E402
+from local_glue import LocalGlueClient  # noqa: E402
+from registration import register_partitions  # noqa: E402
+
+PYSPARK_SCRIPT = os.path.join(AWS_DWH_DIR, "pyspark", "example.py")
+DATABASE = "dwh_udacity_capstone"
+
+
+class ExecutionFailed(Exception):
+    pass
+
+
+def _resolve_intrinsics(value):
+    """
+    The definition of a synthesized state machine is a `Fn::Join` over strings and references to other
+    resources (lambda arns, asset buckets); references become placeholders, we map tasks by their names anyway
+    """
+    if isinstance(value, str):
+        return value
+    if "Fn::Join" in value:
+        separator, parts = value["Fn::Join"]
+        return separator.join(_resolve_intrinsics(part) for part in parts)
+    if "Fn::Select" in value:
+        # e.g. the object key of an asset, selected from its `||` separated version key parameter
+        index, values = value["Fn::Select"]
+        if "Fn::Split" in values:
+            separator, source = values["Fn::Split"]
+            parts = _resolve_intrinsics(source).split(separator)
+        else:
+            parts = [_resolve_intrinsics(part) for part in values]
+        # placeholders do not have the parts of the value they stand for
+        return parts[index] if index < len(parts) else f"${{{'|'.join(parts)}[{index}]}}"
+    if "Ref" in value:
+        return f"${{{value['Ref']}}}"
+    if "Fn::GetAtt" in value:
+        return f"arn:local:{'.'.join(value['Fn::GetAtt'])}"
+    raise ValueError(f"unsupported intrinsic function {sorted(value)}")
+
+
+def definition_from_stack():
+    """synthesize the stack (needs the aws cdk) and return the definition of its state machine"""
+    from aws_cdk import core
+    from aws_dwh.emr_stack import UdacityCapstoneStack
+
+    app = core.App(outdir=tempfile.mkdtemp(prefix="cdk.out."))
+    stack = UdacityCapstoneStack(app, "capstone-stack", env={"region": "us-west-2"})
+    template = app.synth().get_stack(stack.stack_name).template
+    for resource in template["Resources"].values():
+        if resource["Type"] == "AWS::StepFunctions::StateMachine":
+            return json.loads(_resolve_intrinsics(resource["Properties"]["DefinitionString"]))
+    raise ValueError("the stack has no state machine")
+
+
+# a tiny subset of JsonPath: `$` and `$.a.b`, which is all our definition uses (`$$.a.b` for the context object)
+
+def _path_keys(path):
+    if path == "$":
+        return []
+    if not path.startswith("$."):
+        raise ValueError(f"unsupported path {path}")
+    return path[2:].split(".")
+
+
+def get_path(data, path):
+    for key in _path_keys(path):
+        data = data[key]
+    return data
+
+
+def set_path(data, path, value):
+    keys = _path_keys(path)
+    if not keys:
+        return value
+    data = copy.deepcopy(data)
+    target = data
+    for key in keys[:-1]:
+        target = target.setdefault(key, {})
+    target[keys[-1]] = value
+    return data
+
+
+def _format(template, *values):
+    parts = template.split("{}")
+    if len(parts) != len(values) + 1:
+        raise ValueError(f"{template} has {len(parts) - 1} placeholders for {len(values)} values")
+    rendered = [value if isinstance(value, str) else json.dumps(value) for value in values] + [""]
+    return "".join(part + value for part, value in zip(parts, rendered))
+
+
+# the intrinsic functions our definition uses
+_INTRINSICS = {
+    "States.Array": lambda *values: list(values),
+    "States.Format": _format,
+}
+
+
+def _evaluate(expression, position, data, context):
+    """
+    Evaluate the argument of an intrinsic function at `position`: a quoted string, a path,
+    a json literal or another intrinsic function
+    Returns:
+        {tuple}: (value, position after the argument)
+    """
+    while expression[position] == " ":
+        position += 1
+    if expression[position] == "'":
+        literal = []
+        position += 1
+        while expression[position] != "'":
+            if expression[position] == "\\":
+                position += 1
+            literal.append(expression[position])
+            position += 1
+        return "".join(literal), position + 1
+
+    end = position
+    while end < len(expression) and expression[end] not in ",()":
+        end += 1
+    token = expression[position:end].strip()
+    if end == len(expression) or expression[end] != "(":
+        if token.startswith("$$"):
+            return get_path(context, token[1:]), end
+        if token.startswith("$"):
+            return get_path(data, token), end
+        return json.loads(token), end
+
+    if token not in _INTRINSICS:
+        raise ValueError(f"unsupported intrinsic function {token}")
+    arguments = []
+    position = end + 1
+    while expression[position] != ")":
+        value, position = _evaluate(expression, position, data, context)
+        arguments.append(value)
+        while expression[position] == " ":
+            position += 1
+        if expression[position] == ",":
+            position += 1
+    return _INTRINSICS[token](*arguments), position + 1
+
+
+def resolve_value(value, data, context):
+    """the value of a `.$` parameter: a path into the state input, the context (`$$.`) or an intrinsic function"""
+    if value.startswith("$$"):
+        return get_path(context, value[1:])
+    if value.startswith("$"):
+        return get_path(data, value)
+    result, position = _evaluate(value, 0, data, context)
+    if value[position:].strip():
+        raise ValueError(f"unexpected {value[position:]} after the intrinsic function {value}")
+    return result
+
+
+def resolve_parameters(parameters, data, context=None):
+    """`Parameters` of a state, keys ending in `.$` are paths into the state input or intrinsic functions"""
+    context = context or {}
+    if isinstance(parameters, dict):
+        return {
+            (key[:-2] if key.endswith(".$") else key):
+                (resolve_value(value, data, context) if key.endswith(".$")
+                 else resolve_parameters(value, data, context))
+            for key, value in parameters.items()
+        }
+    if isinstance(parameters, list):
+        return [resolve_parameters(value, data, context) for value in parameters]
+    return parameters
+
+
+_COMPARISONS = {
+    "StringEquals": lambda a, b: a == b,
+    "NumericEquals": lambda a, b: a == b,
+    "NumericLessThan": lambda a, b: a < b,
+    "NumericLessThanEquals": lambda a, b: a <= b,
+    "NumericGreaterThan": lambda a, b: a > b,
+    "NumericGreaterThanEquals": lambda a, b: a >= b,
+    "BooleanEquals": lambda a, b: a == b,
+}
+
+
+def matches(rule, data):
+    if "And" in rule:
+        return all(matches(inner, data) for inner in rule["And"])
+    if "Or" in rule:
+        return any(matches(inner, data) for inner in rule["Or"])
+    if "Not" in rule:
+        return not matches(rule["Not"], data)
+    for operator, compare in _COMPARISONS.items():
+        if operator in rule:
+            try:
+                value = get_path(data, rule["Variable"])
+            except (KeyError, TypeError):
+                return False
+            return compare(value, rule[operator])
+    raise ValueError(f"unsupported choice rule {sorted(rule)}")
+
+
+def spark_job_args(args):
+    """the arguments of `example.py` in the `spark-submit` arguments of an EMR step"""
+    position = 1 if args and args[0] == "spark-submit" else 0
+    # all spark-submit options we use take a value, the first other argument is the script
+    while position < len(args) and args[position].startswith("--"):
+        position += 2
+    return args[position + 1:]
+
+
+class LocalServices:
+    """
+    The local stand-ins for the resources of the tasks: an EMR step is a local spark run of `example.py`
+    (concurrent steps are concurrent spark applications), the lambdas work on the local output directory
+    """
+
+    def __init__(self, input_data, output_data, spark_submit=("spark-submit", "--master", "local[*]"),
+                 spark_args=()):
+        self.input_data = input_data
+        self.output_data = output_data
+        self.spark_submit = list(spark_submit)
+        self.spark_args = list(spark_args)
+
+    def run_task(self, state_name, resource, parameters):
+        for action, handler in [("elasticmapreduce:createCluster", self.create_cluster),
+                                ("elasticmapreduce:addStep", self.add_step),
+                                ("elasticmapreduce:terminateCluster", self.terminate_cluster)]:
+            if action in resource:
+                return handler(parameters)
+        lambdas = {
+            "SizeClusterLambda": self.size_cluster,
+            "StepConcurrencyLambda": lambda event: {},
+            "RegisterPartitionsLambda": self.register_partitions,
+            "QualityCheckAthenaLambda": self.quality_check,
+        }
+        if state_name not in lambdas:
+            raise ExecutionFailed(f"no local stand-in for task {state_name} ({resource})")
+        return lambdas[state_name](parameters)
+
+    def create_cluster(self, parameters):
+        return {"ClusterId": f"local-{uuid.uuid4().hex[:8]}"}
+
+    def terminate_cluster(self, parameters):
+        return {}
+
+    def add_step(self, parameters):
+        step = parameters["Step"]
+        command = self.spark_submit + [PYSPARK_SCRIPT] + spark_job_args(step["HadoopJarStep"]["Args"]) + [
+            "--input-data", self.input_data, "--output-data", self.output_data,
+        ] + self.spark_args
+        print(f"[{step['Name']}] {' '.join(command)}")
+        completed = subprocess.run(command, stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   universal_newlines=True)
+        if completed.returncode:
+            raise ExecutionFailed(f"step {step['Name']} failed:\n{completed.stdout[-4000:]}")
+        return {"Step": step["Name"]}
+
+    def size_cluster(self, event):
+        def list_source_bytes():
+            return {source: sum(os.path.getsize(path) for path in glob.glob(
+                        os.path.join(self.input_data, source, "**", "*.json"), recursive=True))
+                    for source in cluster_sizing.INPUT_SOURCES}
+
+        return cluster_sizing.size_run(event or {}, list_source_bytes)
+
+    def register_partitions(self, event):
+        # the local glue catalog starts empty, hence the (immediate) crawl creates all tables of the manifests
+        manifests = {}
+        for path in glob.glob(os.path.join(self.output_data, "_partitions", "*.json")):
+            with open(path) as manifest_file:
+                manifests[path] = json.load(manifest_file)
+        crawl_result = [
+            (manifest["table"], [(column["Name"], column["Type"]) for column in manifest["columns"]],
+             [key["Name"] for key in manifest["partition_keys"]], f"{self.output_data}{manifest['table']}/")
+            for manifest in manifests.values()
+        ]
+        glue = LocalGlueClient(DATABASE, crawl_result=crawl_result)
+        result = register_partitions(glue, DATABASE, "local-crawler", list(manifests.values()),
+                                     sleep=lambda seconds: None)
+        for path, manifest in manifests.items():
+            manifest.update(partitions=[], replace_all=False)
+            with open(path, "w") as manifest_file:
+                json.dump(manifest, manifest_file)
+        return result
+
+    def quality_check(self, event):
+        # the athena queries run on duckdb views of the local tables, see `local_query.py`
+        from local_query import LocalDuckDBClient, connect
+        from engine import run_rules
+        from rules import RULES
+
+        connection, views = connect(self.output_data)
+        rules = [rule for rule in RULES if rule.table in views and (rule.reference_table or rule.table) in views]
+        results, _ = run_rules(LocalDuckDBClient(connection), rules, DATABASE, "unused", sleep=lambda seconds: None)
+        failed = [result["rule"] for result in results if not result["passed"]]
+        if failed:
+            raise ExecutionFailed(f"quality check failed: {failed}")
+        return results
+
+
+class LocalExecution:
+    """
+    Interprets a state machine definition: Task, Choice, Parallel (branches run in threads), Pass, Succeed
+    and Fail states with InputPath, Parameters, ResultPath and OutputPath
+    """
+
+    def __init__(self, definition, services):
+        self.definition = definition
+        self.services = services
+        self.timings = []
+        self._lock = threading.Lock()
+        self._started = None
+        # the context object (`$$`) of the execution
+        self.context = {}
+
+    def run(self, execution_input, name=None):
+        self._started = time.perf_counter()
+        self.context = {"Execution": {"Name": name or f"local-{uuid.uuid4().hex[:8]}", "Input": execution_input}}
+        output, critical_path = self._run_states(self.definition, execution_input, branch="")
+        return output, critical_path
+
+    def _record(self, name, state, branch, started):
+        finished = time.perf_counter()
+        timing = {"state": name, "type": state["Type"], "branch": branch,
+                  "started": round(started - self._started, 3), "finished": round(finished - self._started, 3),
+                  "seconds": round(finished - started, 3)}
+        with self._lock:
+            self.timings.append(timing)
+        return timing
+
+    def _run_states(self, machine, data, branch):
+        """
+        Returns:
+            {tuple}: (output of the last state, timings of the states on the critical path)
+        """
+        critical_path = []
+        name = machine["StartAt"]
+        while name:
+            state = machine["States"][name]
+            started = time.perf_counter()
+            state_type = state["Type"]
+
+            if state_type == "Choice":
+                next_name = next((choice["Next"] for choice in state["Choices"] if matches(choice, data)),
+                                 state.get("Default"))
+                if next_name is None:
+                    raise ExecutionFailed(f"no choice of {name} matched")
+                critical_path.append(self._record(name, state, branch, started))
+                name = next_name
+                continue
+            if state_type == "Fail":
+                raise ExecutionFailed(f"{name}: {state.get('Error')} {state.get('Cause', '')}")
+
+            input_path = state.get("InputPath", "$")
+            effective_input = {} if input_path is None else get_path(data, input_path)
+            if "Parameters" in state:
+                effective_input = resolve_parameters(state["Parameters"], effective_input, self.context)
+
+            branch_path = []
+            if state_type == "Task":
+                result = self.services.run_task(name, state["Resource"], effective_input)
+            elif state_type == "Parallel":
+                result, branch_path = self._run_parallel(name, state, effective_input, branch)
+            elif state_type in ("Pass", "Succeed"):
+                result = state.get("Result", effective_input)
+            else:
+                raise ExecutionFailed(f"unsupported state type {state_type} of {name}")
+
+            # `ResultPath: null` (DISCARD in the cdk) keeps the input as it is
+            if state_type != "Succeed":
+                result_path = state.get("ResultPath", "$")
+                data = data if result_path is None else set_path(data, result_path, result)
+                output_path = state.get("OutputPath", "$")
+                data = {} if output_path is None else get_path(data, output_path)
+
+            timing = self._record(name, state, branch, started)
+            # a parallel state lasts as long as its slowest branch, the path continues through that branch
+            critical_path.extend(branch_path or [timing])
+            name = None if state_type == "Succeed" or state.get("End") else state["Next"]
+        return data, critical_path
+
+    def _run_parallel(self, name, state, data, branch):
+        with ThreadPoolExecutor(max_workers=len(state["Branches"])) as executor:
+            futures = [
+                executor.submit(self._run_states, machine, data, f"{branch}{name}[{index}]/")
+                for index, machine in enumerate(state["Branches"])
+            ]
+            results = [future.result() for future in futures]
+        outputs = [output for output, _ in results]
+        slowest = max((path for _, path in results), key=lambda path: sum(timing["seconds"] for timing in path))
+        return outputs, slowest
+
+
+def print_timings(timings):
+    print(f"{'state':<40} {'type':<9} {'started':>9} {'seconds':>9}  branch")
+    for timing in sorted(timings, key=lambda timing: timing["started"]):
+        print(f"{timing['state']:<40} {timing['type']:<9} {timing['started']:>9.3f} {timing['seconds']:>9.3f}  "
+              f"{timing['branch']}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="run the pipeline state machine locally and time its states")
+    parser.add_argument("--input-data", required=True, help="local directory with song_data/ and log_data/")
+    parser.add_argument("--output-data", required=True, help="local directory for the output tables")
+    parser.add_argument("--input", default="{}", help="execution input as json, e.g. '{\"sizeClass\": \"small\"}'")
+    parser.add_argument("--definition", help="state machine definition as json, synthesized from the stack by default")
+    parser.add_argument("--spark-submit", default="spark-submit --master local[*]",
+                        help="command the EMR steps are run with")
+    parser.add_argument("--spark-arg", action="append", default=[], dest="spark_args",
+                        help="additional argument for every spark run, e.g. `--spark-profile=local`")
+    parser.add_argument("--report", help="write the timings as json to this file")
+    args = parser.parse_args()
+
+    if args.definition:
+        with open(args.definition) as definition_file:
+            definition = json.load(definition_file)
+    else:
+        definition = definition_from_stack()
+
+    output_data = os.path.join(os.path.abspath(args.output_data), "")
+    services = LocalServices(os.path.join(os.path.abspath(args.input_data), ""), output_data,
+                             spark_submit=args.spark_submit.split(), spark_args=args.spark_args)
+    execution = LocalExecution(definition, services)
+
+    started = time.perf_counter()
+    try:
+        output, critical_path = execution.run(json.loads(args.input))
+    finally:
+        # the timings up to a failing state are worth a look as well
+        total_seconds = time.perf_counter() - started
+        print_timings(execution.timings)
+    print(f"critical path ({sum(timing['seconds'] for timing in critical_path):.3f}s of {total_seconds:.3f}s): "
+          + " -> ".join(timing["state"] for timing in critical_path))
+
+    if args.report:
+        with open(args.report, "w") as report_file:
+            json.dump({"seconds": round(total_seconds, 3), "timings": execution.timings,
+                       "critical_path": [timing["state"] for timing in critical_path], "output": output},
+                      report_file, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
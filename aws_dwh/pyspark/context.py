@@ -0,0 +1,88 @@
+import threading
+from contextlib import nullcontext
+
+from pyspark import StorageLevel
+
+
+class PipelineContext:
+    """
+    Holds everything the stages of our job share: the spark session, input/output locations
+    and the DataFrames one stage builds and a later stage consumes (e.g. the songs and artists dimensions
+    that are needed to enrich the log events). Instead of writing a table and reading it back from S3
+    a stage can hand over the DataFrame in memory.
+
+    Every cached DataFrame is registered with the number of consumers that still need it and
+    is unpersisted as soon as the last one called `release`.
+    The tasks of a run share the context from several threads, the registry is guarded by a lock.
+    """
+
+    def __init__(self, spark, input_data, output_data, full_refresh=False, song_source="json", report=None):
+        self.spark = spark
+        self.input_data = input_data
+        self.output_data = output_data
+        self.full_refresh = full_refresh
+        # `json` reads the raw song files, `catalog` the staged song catalog (see `song_catalog.py`)
+        self.song_source = song_source
+        # `metrics.RunReport` that collects the metrics of every stage
+        self.report = report
+        self._frames = {}
+        self._consumers = {}
+        self._lock = threading.Lock()
+
+    def cache(self, name, df, consumers, storage_level=StorageLevel.MEMORY_AND_DISK):
+        """
+        Persist `df` and make it available to later stages under `name`
+        Arguments:
+            name {str}: name later stages use to look up the DataFrame
+            df {DataFrame}: the (already pruned and filtered) DataFrame to keep
+            consumers {int}: number of `release` calls after which the DataFrame is unpersisted
+            storage_level {StorageLevel}: spill to disk rather than recompute from the raw json if memory gets tight
+        """
+        with self._lock:
+            if name in self._frames:
+                self._frames[name].unpersist()
+
+            df = df.persist(storage_level)
+            self._frames[name] = df
+            self._consumers[name] = consumers
+        return df
+
+    def stage(self, name, kind):
+        """measure a stage of the job if the run is reported, see `metrics.RunReport.stage`"""
+        if self.report is None:
+            return nullcontext()
+        return self.report.stage(name, kind)
+
+    def get(self, name):
+        """return the DataFrame registered as `name` or None if no stage of this run built it"""
+        with self._lock:
+            return self._frames.get(name)
+
+    def release(self, name):
+        """a consumer of `name` is done with it"""
+        with self._lock:
+            if name not in self._frames:
+                return
+
+            self._consumers[name] -= 1
+            if self._consumers[name] <= 0:
+                self._frames.pop(name).unpersist()
+                del self._consumers[name]
+
+    def release_all(self):
+        """unpersist everything that is still cached, e.g. because a consumer did not run"""
+        with self._lock:
+            for df in self._frames.values():
+                df.unpersist()
+            self._frames.clear()
+            self._consumers.clear()
+
+    def log_cache_usage(self, stage):
+        """print how much memory/disk the cached DataFrames of this job currently occupy"""
+        storage_infos = self.spark.sparkContext._jsc.sc().getRDDStorageInfo()
+        memory_bytes = sum(info.memSize() for info in storage_infos)
+        disk_bytes = sum(info.diskSize() for info in storage_infos)
+        with self._lock:
+            cached = sorted(self._frames)
+        print(f"[{stage}] cache usage: {memory_bytes / 1024 ** 2:.1f} MB memory, "
+              f"{disk_bytes / 1024 ** 2:.1f} MB disk, cached: {cached}")
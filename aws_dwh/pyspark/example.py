@@ -1,7 +1,7 @@
+import argparse
 import configparser
 from datetime import datetime
 import os
-from pyspark.sql import SparkSession
 from pyspark.sql.functions import udf, col
 from pyspark.sql.functions import year, month, dayofmonth, hour, weekofyear, date_format
 
@@ -10,7 +10,24 @@ from pyspark.sql.types import TimestampType, StructType as R, StructField as Fld
 
 from pyspark.sql import functions as F
 from pyspark.sql.functions import expr
-from pyspark.sql.functions import monotonically_increasing_id
+
+import schemas
+import storage
+from context import PipelineContext
+from marts import update_marts
+from lookup import build_song_lookup
+from song_catalog import catalog_path, compact_song_catalog
+from songplays_fact import build_songplays_table, match_songs
+from streaming import process_log_stream
+from tables import TABLES
+from time_dimension import build_calendar_table, build_time_table
+from users_dimension import build_users_table, merge_users, user_change_points
+from writer import compact_table, write_table
+from zone_maps import read_table
+from manifest import ProcessedFilesManifest, partition_directories
+from metrics import RunReport
+from task_graph import Task, run_tasks
+from session import PROFILES, create_spark_session, parse_overrides
 
 #config = configparser.ConfigParser()
 #config.read('dl.cfg')
@@ -19,168 +36,465 @@ from pyspark.sql.functions import monotonically_increasing_id
 #os.environ["AWS_SECRET_ACCESS_KEY"] = config['AWS']['AWS_SECRET_ACCESS_KEY']
 
 
-def create_spark_session():
-    spark = SparkSession \
-        .builder \
-        .config("spark.jars.packages", "org.apache.hadoop:hadoop-aws:2.7.0") \
-        .getOrCreate()
-    return spark
+# the tables each source is processed into, every table can be built on its own (see `--tables`)
+SONG_DATA_TABLES = ["songs", "artists"]
+LOG_DATA_TABLES = ["users", "time", "songplays"]
 
 
-def process_song_data(spark, input_data, output_data):
+def song_data_tasks(context, tables=SONG_DATA_TABLES):
     """
-    This function processes the song data of sparkify and creates
-    facts/dimensions via spark and saves them to our data lake afterwards
+    The tasks that process the song data of sparkify and create
+    facts/dimensions via spark and save them to our data lake afterwards.
+    The songs and artists dimensions stay cached in the context for the songplays task.
 	Arguments:
-	    spark {SparkSession}: Spark session to launch the program
-	    input_data {str}: location (local/s3) where the (root) input song data resides
-	    output_data {str}: location (local/s3) where the (root) output files should be written
+	    context {PipelineContext}: spark session, input/output locations and the DataFrames shared between stages
+	    tables {list}: the tables to build, a subset of `SONG_DATA_TABLES`
+	Returns:
+	    {list}: `task_graph.Task`s reading the song data and writing the selected tables
     """
+    spark = context.spark
+    output_data = context.output_data
+    tables = [table for table in SONG_DATA_TABLES if table in tables]
+    records = {}
+
     # get filepath to song data file
     # song_data = f"{input_data}song_data/A/A/A/*.json"
-    song_data = f"{input_data}song_data/*/*/*/*.json"
-
-    # read song data file
-    songSchema = R([
-        Fld("num_songs", Int()),
-        Fld("artist_id", Str()),
-        Fld("artist_latitude", Str()),
-        Fld("artist_longitude", Str()),
-        Fld("artist_location", Str()),
-        Fld("artist_name", Str()),
-        Fld("song_id", Str()),
-        Fld("title", Str()),
-        Fld("duration", Dbl()),
-        Fld("year", Int()),
-    ])
-
-    # since schema can not infered automatically, we need to specify it beforehand
-    df_song = spark.read.json(song_data, schema=songSchema)
-    df_song.cache()
-
-    # extract columns to create songs table
-    songs_table = df_song.filter(df_song.song_id != '') \
-        .select(['song_id',
-                 'title',
-                 'artist_id',
-                 'year',
-                 'duration']) \
-        .dropDuplicates(['song_id'])
-
-    # write songs table to parquet files partitioned by year and artist
-    output_song_data = f"{output_data}song_data/"
-    songs_table.write.mode('overwrite').partitionBy("year", "artist_id").parquet(output_song_data)
-
-    # extract columns to create artists table
-    artists_table = df_song.filter(df_song.artist_id != '') \
-        .selectExpr(['artist_id',
-                     'artist_name as name',
-                     'artist_location as location',
-                     'artist_latitude as latitude',
-                     'artist_longitude as longitude']) \
-        .dropDuplicates(['artist_id'])
-
-    # write artists table to parquet files
-    output_artist_data = f"{output_data}artist_data/"
-    artists_table.write.mode('overwrite').parquet(output_artist_data)
-
-
-def process_log_data(spark, input_data, output_data):
+    song_data = f"{context.input_data}song_data/*/*/*/*.json"
+
+    def read_song_data():
+        with context.stage("read_song_data", "read"):
+            if context.song_source == "catalog":
+                # the staged catalog already went through our schema, we only pick the columns we need
+                song_schema = schemas.get_schema("song_data", tables=["songs", "artists"])
+                df_song = spark.read.parquet(catalog_path(output_data)).select(song_schema.fieldNames())
+                df_song = context.cache("song_records", df_song, consumers=len(tables))
+            else:
+                # read song data file with the explicit schema of our registry, since it can not be inferred
+                df_song = schemas.read_source(spark, "song_data", song_data, tables=["songs", "artists"])
+                # the pruned records are consumed by the songs and the artists table
+                df_song = context.cache("song_records", df_song, consumers=len(tables))
+                df_song, _ = schemas.split_drift(df_song, "song_data")
+        records["song_data"] = df_song
+
+    def write_songs():
+        df_song = records["song_data"]
+        # extract columns to create songs table
+        songs_table = df_song.filter(df_song.song_id != '') \
+            .select(['song_id',
+                     'title',
+                     'artist_id',
+                     'year',
+                     'duration']) \
+            .dropDuplicates(['song_id'])
+        songs_table = context.cache("songs", songs_table, consumers=1)
+
+        # write songs table to parquet files partitioned by year and clustered by artist
+        with context.stage("write_songs", "write"):
+            write_table(songs_table, "songs", output_data, replace_all=True)
+        context.release("song_records")
+        context.log_cache_usage("songs")
+
+    def write_artists():
+        df_song = records["song_data"]
+        # extract columns to create artists table
+        artists_table = df_song.filter(df_song.artist_id != '') \
+            .selectExpr(['artist_id',
+                         'artist_name as name',
+                         'artist_location as location',
+                         'artist_latitude as latitude',
+                         'artist_longitude as longitude']) \
+            .dropDuplicates(['artist_id'])
+        artists_table = context.cache("artists", artists_table, consumers=1)
+
+        # write artists table to parquet files
+        with context.stage("write_artists", "write"):
+            write_table(artists_table, "artists", output_data, replace_all=True)
+        context.release("song_records")
+        context.log_cache_usage("artists")
+
+    if not tables:
+        return []
+    writes = {"songs": write_songs, "artists": write_artists}
+    return [Task("read_song_data", read_song_data)] + [
+        Task(table, writes[table], ["read_song_data"]) for table in tables
+    ]
+
+
+def _load_log_manifest(spark, output_data, table):
+    """
+    Every log table keeps track of the log files it processed, so the tables can be built by separate steps.
+    Tables without a manifest of their own start from the manifest all log tables used to share.
+    """
+    manifest = ProcessedFilesManifest(spark, output_data, f"log_data/{table}").load()
+    if not manifest.files:
+        manifest.files = ProcessedFilesManifest(spark, output_data, "log_data").load().files
+    return manifest
+
+
+def log_data_tasks(context, tables=LOG_DATA_TABLES):
     """
-    This function processes the log data of sparkify and creates
-    facts/dimensions via spark and saves them to our data lake afterwards
+    The tasks that process the log data of sparkify and create
+    facts/dimensions via spark and save them to our data lake afterwards.
+    By default only log files that are new or changed since the last run (according to the processed-files
+    manifests of the tables) are read and only the affected year/month partitions of `time_data` and `songplays_data`
+    are replaced.
+    With `context.full_refresh` the manifest is ignored, all log files are read and all output tables are rewritten.
+    The songplays task uses the songs and artists of the song tasks if they are part of the same run.
 	Arguments:
-	    spark {SparkSession}: Spark session to launch the program
-	    input_data {str}: location (local/s3) where the (root) input log data resides
-	    output_data {str}: location (local/s3) where the (root) output files should be written
+	    context {PipelineContext}: spark session, input/output locations and the DataFrames shared between stages
+	    tables {list}: the tables to build, a subset of `LOG_DATA_TABLES`
+	Returns:
+	    {list}: `task_graph.Task`s reading the log data and writing the selected tables, each of them updates
+	        its manifest after the write; songplays is followed by the update of its marts (see `marts.py`);
+	        empty if there is nothing to process
     """
+    spark = context.spark
+    output_data = context.output_data
+    full_refresh = context.full_refresh
+    tables = [table for table in LOG_DATA_TABLES if table in tables]
+    records = {}
+    if not tables:
+        return []
+
     # get filepath to log data file
-    log_data = f"{input_data}log_data/*/*/*.json"
-
-    # read log data file
-    df_log = spark.read.json(log_data)
-    df_log.cache()
-
-    # filter by actions for song plays
-    df_log = df_log.filter(df_log.page == 'NextSong')
-
-    # extract columns for users table
-    users_table = df_log.filter(df_log.userId != '') \
-        .selectExpr(['cast(userId as int) user_id',
-                     'firstName as first_name',
-                     'lastName as last_name',
-                     'gender',
-                     'level']) \
-        .dropDuplicates(['user_id'])
-
-    # write users table to parquet files
-    output_users_data = f"{output_data}users_data/"
-    users_table.write.mode('overwrite').parquet(output_users_data)
-
-    # create timestamp column from original timestamp column
-    df_log = df_log.withColumn("parsed_ts", F.from_unixtime(df_log.ts / 1000))
-
-    # extract columns to create time table
-    time_table = df_log.selectExpr("ts as start_time",
-                                   "hour(parsed_ts) as hour",
-                                   "day(parsed_ts) as day",
-                                   "weekofyear(parsed_ts) as week",
-                                   "month(parsed_ts) as month",
-                                   "year(parsed_ts) as year",
-                                   "dayofweek(parsed_ts) as weekday")
-
-    # write time table to parquet files partitioned by year and month
-    output_time_data = f"{output_data}time_data/"
-    time_table.write.mode('overwrite').partitionBy("year", "month").parquet(output_time_data)
-
-    # extract columns from joined song and log datasets to create songplays table
-    # load parquet song data that was written beforehand
-    artist_table_location = "{}artist_data/".format(output_data)
-    song_table_location = "{}song_data/".format(output_data)
-
-    df_artist_table = spark.read.parquet(artist_table_location)
-    df_song_table = spark.read.parquet(song_table_location)
-
-    df_artist_table.createOrReplaceTempView("artist_table")
-    df_song_table.createOrReplaceTempView("song_table")
-
-    df_log.createOrReplaceTempView("log_data")
-    time_table.createOrReplaceTempView("time_table")
-
-    songplays_table = spark.sql("""
-    SELECT
-        t.start_time as start_time,
-        CAST(e.userId AS int) as user_id,
-        e.level,
-        s.song_id, 
-        a.artist_id,
-        CAST(e.sessionId AS int) session_id,
-        e.location,
-        e.userAgent as user_agent,
-        t.year,
-        t.month
-    FROM log_data e, song_table s, artist_table a, time_table t 
-    WHERE a.name = e.artist
-        AND s.title = e.song
-        AND s.duration = e.length
-        AND e.page = 'NextSong'
-        AND t.start_time = e.ts
-    """)
-
-    songplays_table = songplays_table.withColumn("songplay_id", monotonically_increasing_id())
-
-    # write songplays table to parquet files partitioned by year and month
-    output_songplays_data = f"{output_data}songplays_data/"
-    songplays_table.write.mode('overwrite').partitionBy("year", "month").parquet(output_songplays_data)
+    log_data = f"{context.input_data}log_data/*/*/*.json"
+
+    with context.stage("list_log_data", "read"):
+        manifests = {table: _load_log_manifest(spark, output_data, table) for table in tables}
+        current_files = storage.list_files(spark, log_data)
+
+    if full_refresh:
+        for manifest in manifests.values():
+            manifest.reset()
+        log_files = sorted(current_files)
+    else:
+        pending = {table: manifest.pending(current_files) for table, manifest in manifests.items()}
+        tables = [table for table in tables if pending[table]]
+        if not tables:
+            print("no new or changed log files since the last run")
+            return []
+
+        # the log files are read once for all tables, if one table lags behind the others rebuild its months
+        pending_files = sorted({path for table in tables for path in pending[table]})
+
+        # a year/month partition can only be replaced as a whole, hence we read all files of the affected months
+        affected_directories = partition_directories(pending_files)
+        log_files = sorted(
+            path for path in current_files
+            if path.rsplit("/", 1)[0] in affected_directories
+        )
+        print(f"incremental run: {len(pending_files)} new/changed files affect {affected_directories}")
+
+    def read_log_data():
+        # read log data file; only the fields our output tables need are parsed
+        df_log = schemas.read_source(spark, "log_data", log_files, tables=["users", "time", "songplays"])
+
+        # filter by actions for song plays, records that do not fit the schema are kept for the drift count
+        df_log = df_log.filter((df_log.page == 'NextSong') | col(schemas.CORRUPT_RECORD_COLUMN).isNotNull())
+        # only this filtered projection is cached, it is consumed by the users, time and songplays table
+        df_log = context.cache("log_events", df_log, consumers=len(tables))
+        with context.stage("read_log_data", "read"):
+            # counting the drifted records materializes the cached events
+            df_log, _ = schemas.split_drift(df_log, "log_data")
+        records["log_data"] = df_log
+
+    def write_users():
+        # users table keeps the history of the user attributes (type 2), an incremental run merges
+        # the events of this run into the buckets of the affected users
+        change_points = user_change_points(records["log_data"])
+        if full_refresh:
+            users_table = build_users_table(change_points)
+        else:
+            users_table = merge_users(spark, change_points, output_data)
+        with context.stage("write_users", "write"):
+            write_table(users_table, "users", output_data, replace_all=full_refresh)
+        mark_processed("users")
+        context.release("log_events")
+        context.log_cache_usage("users")
+
+    def write_time():
+        # extract columns to create time table, one row per distinct timestamp
+        time_table = build_time_table(records["log_data"])
+
+        # write time table to parquet files partitioned by year and month
+        with context.stage("write_time", "write"):
+            write_table(time_table, "time", output_data, replace_all=full_refresh)
+        mark_processed("time")
+        context.release("log_events")
+        context.log_cache_usage("time")
+
+    def write_songplays():
+        # extract columns from joined song and log datasets to create songplays table
+        # the song tasks of this run hand over their dimensions in memory, otherwise we load what was written before
+        df_artist_table = context.get("artists")
+        if df_artist_table is None:
+            df_artist_table = read_table(spark, output_data, "artists")
+
+        df_song_table = context.get("songs")
+        if df_song_table is None:
+            df_song_table = read_table(spark, output_data, "songs")
+
+        # instead of a 4-way join we look up every event in a small, prebuilt song/artist index
+        song_lookup = build_song_lookup(df_song_table, df_artist_table)
+        songplays_candidates = match_songs(records["log_data"], song_lookup)
+
+        with context.stage("match_songplays", "transform"):
+            match_stats = songplays_candidates.agg(F.count(F.lit(1)).alias("events"),
+                                                   F.count("song_id").alias("matched")).first()
+        match_rate = match_stats.matched / match_stats.events if match_stats.events else 0.0
+        print(f"songplays match rate: {match_stats.matched}/{match_stats.events} events ({match_rate:.2%})")
+
+        songplays_table = build_songplays_table(songplays_candidates)
+
+        # write songplays table to parquet files partitioned by year and month
+        with context.stage("write_songplays", "write"):
+            records["songplays_partitions"] = write_table(songplays_table, "songplays", output_data,
+                                                          replace_all=full_refresh)
+        context.release("log_events")
+        context.release("songs")
+        context.release("artists")
+        context.log_cache_usage("songplays")
+
+    def write_marts():
+        # the marts are aggregated from the songplays partitions this run replaced, all other days stay as they are
+        with context.stage("write_marts", "write"):
+            update_marts(spark, output_data, None if full_refresh else records["songplays_partitions"])
+        # songplays only remembers its files once the marts caught up, a rerun rebuilds both
+        mark_processed("songplays")
+
+    def mark_processed(table):
+        # a table only remembers the files once it has been written successfully
+        manifests[table].mark_processed({path: current_files[path] for path in log_files})
+        manifests[table].save()
+
+    tasks = {
+        "users": Task("users", write_users, ["read_log_data"]),
+        "time": Task("time", write_time, ["read_log_data"]),
+        # the song lookup is built from the cached songs and artists, their writes materialize the cache
+        "songplays": Task("songplays", write_songplays, ["read_log_data", "songs", "artists"]),
+    }
+    marts = [Task("marts", write_marts, ["songplays"])] if "songplays" in tables else []
+    return [Task("read_log_data", read_log_data)] + [tasks[table] for table in tables] + marts
+
+
+def process_song_data(context):
+    """run the song data tasks on their own"""
+    return run_tasks(context.spark, song_data_tasks(context))
+
+
+def process_log_data(context):
+    """run the log data tasks on their own, the songs and artists are read from the output tables"""
+    return run_tasks(context.spark, log_data_tasks(context))
+
+
+class SparkEngine:
+    """runs the stages of our job on spark, see `local_engine.LocalEngine` for the single node counterpart"""
+
+    name = "spark"
+
+    def __init__(self, context, tables=None):
+        self.context = context
+        # build only these tables, all of them by default
+        self.tables = tables or SONG_DATA_TABLES + LOG_DATA_TABLES
+
+    def process_song_data(self):
+        process_song_data(self.context)
+
+    def process_log_data(self):
+        process_log_data(self.context)
+
+    def run(self):
+        """
+        Run the song and the log data tasks as one graph: the writes of all tables that do not depend
+        on each other are submitted concurrently, only songplays waits for songs and artists
+        """
+        tasks = song_data_tasks(self.context, self.tables) + log_data_tasks(self.context, self.tables)
+        timings = run_tasks(self.context.spark, tasks)
+        # e.g. songs and artists if there were no new log events to build songplays from
+        self.context.release_all()
+        if self.context.report is not None:
+            self.context.report.timeline = timings
+        return timings
+
+
+def choose_engine(engine, input_data):
+    """
+    Pick the engine for a run: with `auto` (opt-in, for development) small inputs are processed by the local
+    engine, since starting spark would take longer than the actual processing
+    """
+    if engine != "auto":
+        return engine
 
+    try:
+        import local_engine
+    except ImportError:
+        # pyarrow/pandas are not installed
+        return "spark"
+
+    input_bytes = local_engine.estimate_input_bytes(input_data)
+    if input_bytes is not None and input_bytes <= local_engine.LOCAL_ENGINE_MAX_BYTES:
+        print(f"input of {input_bytes} bytes, using the local engine")
+        return "local"
+    return "spark"
 
-def main():
-    spark = create_spark_session()
-    input_data = "s3a://udacity-dend/"
-    output_data = "s3a://capstone-uda-data/"
 
-    process_song_data(spark, input_data, output_data)
-    process_log_data(spark, input_data, output_data)
+def input_sources(stage, tables=None, song_source="json"):
+    """
+    The raw sources below the input location a stage reads (see `session.INPUT_SOURCES`), the concurrent steps
+    of the cluster only measure their own sources when they tune the spark session
+    """
+    if stage in ("compact", "calendar"):
+        # both only work on our output tables
+        return []
+    if stage == "song-catalog":
+        return ["song_data/"]
+    if stage == "stream":
+        return ["log_data/"]
+
+    tables = set(tables or SONG_DATA_TABLES + LOG_DATA_TABLES)
+    sources = []
+    # the staged song catalog lives next to the output tables, not below the input location
+    if song_source == "json" and tables & set(SONG_DATA_TABLES):
+        sources.append("song_data/")
+    if tables & set(LOG_DATA_TABLES):
+        sources.append("log_data/")
+    return sources
+
+
+def run_compaction(context, tables=None):
+    """
+    Standalone stage that compacts the small files of our existing output tables
+    Arguments:
+        context {PipelineContext}: spark session, input/output locations and the DataFrames shared between stages
+        tables {list}: tables to compact, defaults to all of them
+    """
+    results = [compact_table(context.spark, table, context.output_data) for table in (tables or TABLES)]
+    for result in results:
+        print(f"{result['table']}: {result['files_before']} files before, {result['files_after']} files after")
+    return results
+
+
+def process_calendar(context, start_date, end_date):
+    """
+    Precompute the calendar table for a date range and merge it into the existing one;
+    only the year/month partitions of the range are replaced
+    """
+    calendar_table = build_calendar_table(context.spark, start_date, end_date)
+    write_table(calendar_table, "calendar", context.output_data)
+
+
+def _parse_date(value):
+    return datetime.strptime(value, "%Y-%m-%d").date()
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="sparkify data lake ETL")
+    parser.add_argument("--input-data", default="s3a://udacity-dend/")
+    parser.add_argument("--output-data", default="s3a://capstone-uda-data/")
+    parser.add_argument(
+        "--full-refresh",
+        action="store_true",
+        help="ignore the processed-files manifest and rebuild all tables from the complete log history",
+    )
+    parser.add_argument(
+        "--stage",
+        choices=["etl", "compact", "calendar", "song-catalog", "stream"],
+        default="etl",
+        help="`compact` rewrites partitions of the existing tables that consist of many small files, "
+             "`calendar` merges the calendar of --calendar-start to --calendar-end into the calendar table, "
+             "`song-catalog` bundles new song json files into the staged song catalog, "
+             "`stream` continuously appends the songplays of new log files to songplays_stream_data",
+    )
+    parser.add_argument(
+        "--trigger-once",
+        action="store_true",
+        help="let the `stream` stage process the log files that are there in one micro-batch and stop",
+    )
+    parser.add_argument(
+        "--song-source",
+        choices=["json", "catalog"],
+        default="json",
+        help="read the songs from the raw json files or from the staged song catalog",
+    )
+    parser.add_argument(
+        "--engine",
+        choices=["auto", "spark", "local"],
+        default="spark",
+        help="`local` processes all input with pyarrow/pandas on a single node for development; it rebuilds the "
+             "tables without the manifests, marts, statistics and zone maps of the spark engine. "
+             "`auto` picks it for small inputs",
+    )
+    parser.add_argument(
+        "--tables",
+        type=lambda value: value.split(","),
+        help="comma separated tables the etl stage builds, e.g. `songs,artists`; all of them by default. "
+             "songplays built on its own reads songs and artists from the output tables",
+    )
+    parser.add_argument(
+        "--spark-profile",
+        choices=sorted(PROFILES),
+        help="spark settings profile, chosen by the size of the input data by default",
+    )
+    parser.add_argument(
+        "--input-bytes",
+        type=int,
+        help="size of the input (e.g. as found by the sizing lambda), "
+             "the sources the stage reads are listed to find it by default",
+    )
+    parser.add_argument(
+        "--run-id",
+        help="id of the pipeline run the step belongs to (the execution name of the state machine), the steps of a "
+             "run write their reports to `_reports/<run id>/`; a new one by default",
+    )
+    parser.add_argument(
+        "--spark-conf",
+        action="append",
+        metavar="KEY=VALUE",
+        help="spark setting that overrides the chosen profile, can be given several times",
+    )
+    parser.add_argument("--calendar-start", type=_parse_date)
+    parser.add_argument("--calendar-end", type=_parse_date)
+    args = parser.parse_args()
+    unknown_tables = set(args.tables or []) - set(SONG_DATA_TABLES + LOG_DATA_TABLES)
+    if unknown_tables:
+        parser.error(f"unknown tables {sorted(unknown_tables)}")
+    if args.tables and args.engine == "local":
+        parser.error("the local engine always builds all tables")
+    if args.stage == "calendar" and not (args.calendar_start and args.calendar_end):
+        parser.error("the calendar stage needs --calendar-start and --calendar-end")
+    if args.stage == "calendar" and args.calendar_start > args.calendar_end:
+        parser.error("--calendar-start is after --calendar-end")
+    return args
+
+
+def main():
+    args = parse_args()
+
+    # single tables are built by separate (concurrent) steps on the cluster, see the stack
+    engine = "spark" if args.tables else args.engine
+    if args.stage == "etl" and choose_engine(engine, args.input_data) == "local":
+        from local_engine import LocalEngine
+        LocalEngine(args.input_data, args.output_data).run()
+        return
+
+    spark, _ = create_spark_session(args.input_data, overrides=parse_overrides(args.spark_conf),
+                                    profile=args.spark_profile, input_bytes=args.input_bytes,
+                                    sources=input_sources(args.stage, args.tables, args.song_source))
+    report = RunReport(spark, args.output_data, run_id=args.run_id, part="-".join(args.tables or [args.stage]))
+    context = PipelineContext(spark, args.input_data, args.output_data, full_refresh=args.full_refresh,
+                              song_source=args.song_source, report=report)
+
+    if args.stage == "compact":
+        run_compaction(context)
+    elif args.stage == "calendar":
+        process_calendar(context, args.calendar_start, args.calendar_end)
+    elif args.stage == "song-catalog":
+        compact_song_catalog(spark, args.input_data, args.output_data, full_refresh=args.full_refresh)
+    elif args.stage == "stream":
+        process_log_stream(context, trigger_once=args.trigger_once)
+    else:
+        SparkEngine(context, tables=args.tables).run()
+        report.save()
 
     spark.stop()
 
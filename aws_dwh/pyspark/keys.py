@@ -0,0 +1,24 @@
+import hashlib
+
+from pyspark.sql import functions as F
+
+# a songplay is identified by the event it was derived from
+SONGPLAY_KEY_COLUMNS = ["userId", "sessionId", "itemInSession", "ts"]
+
+# 15 hex digits of the hash are 60 bits, the key is always a positive long
+_HEX_DIGITS = 15
+
+
+def hash_key(*columns):
+    """
+    Deterministic surrogate key of a row: the first 60 bits of the sha256 of the `|` separated key columns.
+    The same input always gets the same key, so reruns of the job produce the same ids.
+    """
+    joined = F.concat_ws("|", *[F.col(column).cast("string") for column in columns])
+    return F.conv(F.substring(F.sha2(joined, 256), 1, _HEX_DIGITS), 16, 10).cast("long")
+
+
+def hash_key_value(*values):
+    """counterpart of `hash_key` for plain python values, `concat_ws` skips nulls"""
+    joined = "|".join(str(value) for value in values if value is not None)
+    return int(hashlib.sha256(joined.encode("utf-8")).hexdigest()[:_HEX_DIGITS], 16)
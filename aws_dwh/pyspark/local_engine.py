@@ -0,0 +1,388 @@
+"""
+Single node engine for small loads (e.g. a single day of log data), based on pyarrow and pandas.
+It produces the same five parquet tables with the same schemas and partitioning as the spark job,
+but without the start-up cost of a spark session (and an EMR cluster).
+"""
+import json
+import os
+import uuid
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.json as pa_json
+import pyarrow.parquet as pq
+from pyarrow import fs as pa_fs
+
+import schemas
+from keys import SONGPLAY_KEY_COLUMNS, hash_key_value
+from lookup import DURATION_TOLERANCE
+from partition_manifest import manifest_path, merge_partitions
+from tables import TABLES, table_path
+from users_dimension import USER_ATTRIBUTES, USER_BUCKETS
+
+# inputs up to this size are processed by the local engine when the engine is chosen automatically
+LOCAL_ENGINE_MAX_BYTES = 256 * 1024 ** 2
+
+_ARROW_TYPES = {
+    "StringType": pa.string(),
+    "DoubleType": pa.float64(),
+    "IntegerType": pa.int32(),
+    "LongType": pa.int64(),
+}
+
+# types of the glue catalog, as spark names them in `DataType.simpleString`
+_HIVE_TYPES = {
+    pa.string(): "string",
+    pa.float64(): "double",
+    pa.int32(): "int",
+    pa.int64(): "bigint",
+    pa.bool_(): "boolean",
+}
+
+
+def _resolve(uri):
+    """pyarrow does not know the hadoop `s3a://` scheme and, unlike spark, needs absolute local paths"""
+    if uri.startswith("s3a://"):
+        uri = "s3://" + uri[len("s3a://"):]
+    elif "://" not in uri:
+        uri = os.path.abspath(uri)
+    return pa_fs.FileSystem.from_uri(uri)
+
+
+def estimate_input_bytes(input_data):
+    """
+    Total size of the json files below `input_data`
+    Returns:
+        {int}: size in bytes, None if the location can not be listed without spark
+    """
+    try:
+        filesystem, root = _resolve(input_data)
+        infos = filesystem.get_file_info(pa_fs.FileSelector(root, recursive=True))
+    except (OSError, pa.ArrowException):
+        return None
+    return sum(info.size for info in infos if info.type == pa_fs.FileType.File and info.path.endswith(".json"))
+
+
+def _arrow_schema(source, tables):
+    spark_schema = schemas.get_schema(source, tables=tables)
+    return pa.schema([(field.name, _ARROW_TYPES[type(field.dataType).__name__]) for field in spark_schema.fields])
+
+
+def _read_json(input_data, prefix, source, tables):
+    filesystem, root = _resolve(f"{input_data}{prefix}")
+    paths = sorted(
+        info.path for info in filesystem.get_file_info(pa_fs.FileSelector(root, recursive=True))
+        if info.type == pa_fs.FileType.File and info.path.endswith(".json")
+    )
+
+    schema = _arrow_schema(source, tables)
+    # spark reads a json number into a string field as its text (e.g. the coordinates of the song data), arrow
+    # rejects it, hence string fields are read with the type arrow infers and cast to strings afterwards
+    parse_options = pa_json.ParseOptions(
+        explicit_schema=pa.schema([field for field in schema if field.type != pa.string()]),
+        unexpected_field_behavior="infer",
+    )
+    batches = []
+    for path in paths:
+        with filesystem.open_input_file(path) as stream:
+            batch = pa_json.read_json(stream, parse_options=parse_options)
+        batches.append(pa.table([
+            batch.column(field.name).cast(field.type) if field.name in batch.column_names
+            else pa.nulls(batch.num_rows, field.type)
+            for field in schema
+        ], schema=schema))
+
+    if not batches:
+        return schema.empty_table().to_pandas()
+    return pa.concat_tables(batches).to_pandas()
+
+
+def _read_table(output_data, table):
+    filesystem, root = _resolve(table_path(output_data, table))
+    df = pq.read_table(root, filesystem=filesystem).to_pandas()
+    # hive partition values are read as categoricals
+    for column in TABLES[table].partition_by:
+        df[column] = df[column].astype(object)
+    return df
+
+
+def _drop_statistics(output_data, table):
+    """
+    we do not keep statistics or zone maps, an outdated sidecar of a previous spark run must not be used anymore;
+    without a zone map index the spark readers list the table as usual
+    """
+    for sidecar in ("_stats", "_zone_maps"):
+        filesystem, path = _resolve(f"{output_data}{sidecar}/{TABLES[table].location.strip('/')}.json")
+        if filesystem.get_file_info(path).type == pa_fs.FileType.File:
+            filesystem.delete_file(path)
+
+
+def _write_partition_manifest(output_data, table, schema, partitions, replace_all=False):
+    """counterpart of `partition_manifest.write_partition_manifest`"""
+    partition_by = TABLES[table].partition_by
+    fields = [(field.name, _HIVE_TYPES[field.type]) for field in schema]
+    filesystem, path = _resolve(manifest_path(output_data, table))
+
+    document = {}
+    if filesystem.get_file_info(path).type == pa_fs.FileType.File:
+        with filesystem.open_input_stream(path) as stream:
+            document = json.loads(stream.read())
+    document = merge_partitions(
+        document,
+        table,
+        [(name, type_) for name, type_ in fields if name not in partition_by],
+        [(name, dict(fields)[name]) for name in partition_by],
+        partitions,
+        replace_all=replace_all,
+    )
+
+    filesystem.create_dir(path.rpartition("/")[0])
+    with filesystem.open_output_stream(path) as stream:
+        stream.write(json.dumps(document, indent=2, sort_keys=True).encode("utf-8"))
+
+
+def _write_table(df, table, output_data, schema, replace_all=False):
+    """
+    Counterpart of `writer.write_table`: new files are written before the files they replace are deleted,
+    and only the partitions present in `df` are replaced unless `replace_all` is set
+    """
+    spec = TABLES[table]
+    layout = spec.layout
+    filesystem, root = _resolve(table_path(output_data, table))
+    # the local engine writes one file per partition, i.e. a single cluster sorted like the files of the spark job
+    sort_by = [column for column in layout.sort_by if column in df.columns]
+    if sort_by:
+        df = df.sort_values(sort_by, kind="stable")
+    arrow_table = pa.Table.from_pandas(df, schema=schema, preserve_index=False)
+
+    existing_files = [
+        info.path for info in filesystem.get_file_info(pa_fs.FileSelector(root, recursive=True, allow_not_found=True))
+        if info.type == pa_fs.FileType.File and info.path.endswith(".parquet")
+    ]
+
+    written_files = []
+    pq.write_to_dataset(
+        arrow_table,
+        root_path=root,
+        partition_cols=spec.partition_by or None,
+        filesystem=filesystem,
+        basename_template=f"part-{{i}}-{uuid.uuid4()}.{layout.compression}.parquet",
+        file_visitor=lambda written_file: written_files.append(written_file.path),
+        existing_data_behavior="overwrite_or_ignore",
+        compression=layout.compression,
+        use_dictionary=layout.dictionary,
+    )
+
+    partitions = sorted({path[len(root):].strip("/").rpartition("/")[0] for path in written_files})
+    for path in existing_files:
+        if path not in written_files and (replace_all or path[len(root):].strip("/").rpartition("/")[0] in partitions):
+            filesystem.delete_file(path)
+    _drop_statistics(output_data, table)
+    _write_partition_manifest(output_data, table, schema, partitions, replace_all=replace_all)
+
+    print(f"{table}: replaced {'all partitions' if replace_all else 'partitions'} {partitions}")
+    return partitions
+
+
+SONGS_SCHEMA = pa.schema([("song_id", pa.string()), ("title", pa.string()), ("artist_id", pa.string()),
+                          ("duration", pa.float64()), ("year", pa.int32())])
+ARTISTS_SCHEMA = pa.schema([("artist_id", pa.string()), ("name", pa.string()), ("location", pa.string()),
+                            ("latitude", pa.string()), ("longitude", pa.string())])
+USERS_SCHEMA = pa.schema([("user_id", pa.int32()), ("first_name", pa.string()), ("last_name", pa.string()),
+                          ("gender", pa.string()), ("level", pa.string()), ("valid_from", pa.int64()),
+                          ("valid_to", pa.int64()), ("is_current", pa.bool_()), ("user_bucket", pa.int32())])
+TIME_SCHEMA = pa.schema([("start_time", pa.int64()), ("hour", pa.int32()), ("day", pa.int32()),
+                         ("week", pa.int32()), ("weekday", pa.int32()), ("year", pa.int32()), ("month", pa.int32())])
+SONGPLAYS_SCHEMA = pa.schema([("start_time", pa.int64()), ("user_id", pa.int32()), ("level", pa.string()),
+                              ("song_id", pa.string()), ("artist_id", pa.string()), ("session_id", pa.int32()),
+                              ("location", pa.string()), ("user_agent", pa.string()), ("songplay_id", pa.int64()),
+                              ("year", pa.int32()), ("month", pa.int32())])
+
+
+def build_songs_and_artists(df_song):
+    songs = df_song[df_song.song_id != ""] \
+        .drop_duplicates("song_id")[["song_id", "title", "artist_id", "duration", "year"]]
+
+    artists = df_song[df_song.artist_id != ""] \
+        .drop_duplicates("artist_id") \
+        .rename(columns={"artist_name": "name",
+                         "artist_location": "location",
+                         "artist_latitude": "latitude",
+                         "artist_longitude": "longitude"})[["artist_id", "name", "location", "latitude", "longitude"]]
+    return songs, artists
+
+
+def process_song_data(input_data, output_data):
+    """
+    Local counterpart of `example.process_song_data`
+	Arguments:
+	    input_data {str}: location (local/s3) where the (root) input song data resides
+	    output_data {str}: location (local/s3) where the (root) output files should be written
+    """
+    df_song = _read_json(input_data, "song_data", "song_data", tables=["songs", "artists"])
+    songs, artists = build_songs_and_artists(df_song)
+
+    _write_table(songs, "songs", output_data, SONGS_SCHEMA, replace_all=True)
+    _write_table(artists, "artists", output_data, ARTISTS_SCHEMA, replace_all=True)
+    return songs, artists
+
+
+def _time_attributes(start_time):
+    """same attributes as `time_dimension.with_time_attributes`, computed vectorized on the epoch millis"""
+    parsed_ts = pd.to_datetime(start_time, unit="ms")
+    return pd.DataFrame({
+        "start_time": start_time.values,
+        "hour": parsed_ts.dt.hour.values,
+        "day": parsed_ts.dt.day.values,
+        "week": parsed_ts.dt.isocalendar().week.values,
+        # spark counts the days of the week from 1 (sunday) to 7 (saturday)
+        "weekday": ((parsed_ts.dt.dayofweek + 1) % 7 + 1).values,
+        "year": parsed_ts.dt.year.values,
+        "month": parsed_ts.dt.month.values,
+    }).astype({column: "int32" for column in ["hour", "day", "week", "weekday", "year", "month"]})
+
+
+def _user_change_points(df_log):
+    """counterpart of `users_dimension.user_change_points`"""
+    events = df_log[df_log.userId.fillna("") != ""]
+    return pd.DataFrame({
+        "user_id": events.userId.astype("int32").values,
+        "valid_from": events.ts.values,
+        "first_name": events.firstName.values,
+        "last_name": events.lastName.values,
+        "gender": events.gender.values,
+        "level": events.level.values,
+    })
+
+
+def _build_users(change_points):
+    """counterpart of `users_dimension.build_users_table`"""
+    # one deterministic winner per user and millisecond, the same one spark picks
+    change_points = change_points \
+        .sort_values(["user_id", "valid_from"] + USER_ATTRIBUTES, ascending=[True, True] + [False] * 4,
+                     na_position="last") \
+        .drop_duplicates(["user_id", "valid_from"])
+
+    attributes = change_points[USER_ATTRIBUTES]
+    previous = change_points.groupby("user_id")[USER_ATTRIBUTES].shift()
+    unchanged = ((previous == attributes) | (previous.isna() & attributes.isna())).all(axis=1)
+    first = change_points.user_id != change_points.user_id.shift()
+    versions = change_points[first | ~unchanged]
+
+    valid_to = versions.groupby("user_id").valid_from.shift(-1).astype("Int64")
+    return versions.assign(
+        valid_to=valid_to,
+        is_current=valid_to.isna().values,
+        user_bucket=(versions.user_id % USER_BUCKETS).astype("int32"),
+    )[["user_id"] + USER_ATTRIBUTES + ["valid_from", "valid_to", "is_current", "user_bucket"]]
+
+
+def _merge_users(output_data, change_points):
+    """counterpart of `users_dimension.merge_users`"""
+    filesystem, users_root = _resolve(table_path(output_data, "users"))
+    if filesystem.get_file_info(users_root).type != pa_fs.FileType.Directory:
+        return _build_users(change_points)
+
+    existing_users = _read_table(output_data, "users")
+    if "valid_from" not in existing_users.columns:
+        raise ValueError(f"{table_path(output_data, 'users')} has no validity ranges yet, "
+                         f"run the spark job with --full-refresh once")
+    affected_buckets = set(change_points.user_id % USER_BUCKETS)
+    existing_points = existing_users[existing_users.user_bucket.isin(affected_buckets)][
+        ["user_id", "valid_from"] + USER_ATTRIBUTES
+    ]
+    return _build_users(pd.concat([change_points, existing_points.astype({"user_id": "int32"})]))
+
+
+def _lookup_keys(df, title, artist_name, duration):
+    return df.assign(
+        title_key=df[title].str.strip().str.lower(),
+        artist_key=df[artist_name].str.strip().str.lower(),
+        # spark rounds half up
+        duration_key=np.floor(df[duration] / DURATION_TOLERANCE + 0.5),
+    )
+
+
+def process_log_data(input_data, output_data, songs=None, artists=None):
+    """
+    Local counterpart of `example.process_log_data`. All log files below `input_data` are processed
+    and the year/month partitions they cover are replaced.
+	Arguments:
+	    input_data {str}: location (local/s3) where the (root) input log data resides
+	    output_data {str}: location (local/s3) where the (root) output files should be written
+	    songs {DataFrame}: songs dimension of this run, read from `output_data` if not given
+	    artists {DataFrame}: artists dimension of this run, read from `output_data` if not given
+    """
+    df_log = _read_json(input_data, "log_data", "log_data", tables=["users", "time", "songplays"])
+    df_log = df_log[df_log.page == "NextSong"]
+
+    # users table (type 2), merged into the buckets of the affected users
+    users = _merge_users(output_data, _user_change_points(df_log))
+    _write_table(users, "users", output_data, USERS_SCHEMA)
+
+    # time table, one row per distinct timestamp
+    time = _time_attributes(pd.Series(df_log.ts.unique(), dtype="int64"))
+    _write_table(time, "time", output_data, TIME_SCHEMA)
+
+    # songplays table
+    if songs is None:
+        songs = _read_table(output_data, "songs")
+    if artists is None:
+        artists = _read_table(output_data, "artists")
+
+    keys = ["title_key", "artist_key", "duration_key"]
+    song_lookup = _lookup_keys(songs[["song_id", "title", "artist_id", "duration"]]
+                               .merge(artists[["artist_id", "name"]], on="artist_id"),
+                               title="title", artist_name="name", duration="duration") \
+        .drop_duplicates(keys)[keys + ["song_id", "artist_id"]]
+
+    candidates = _lookup_keys(df_log, title="song", artist_name="artist", duration="length") \
+        .merge(song_lookup, on=keys, how="left")
+    matched = candidates.song_id.notna().sum()
+    match_rate = matched / len(candidates) if len(candidates) else 0.0
+    print(f"songplays match rate: {matched}/{len(candidates)} events ({match_rate:.2%})")
+
+    songplays = candidates[candidates.song_id.notna()]
+    # same key values as spark hashes them: integers without a fraction, nulls left out
+    songplay_keys = songplays[SONGPLAY_KEY_COLUMNS] \
+        .astype({"sessionId": "Int64", "itemInSession": "Int64", "ts": "Int64"}) \
+        .astype(object)
+    songplay_keys = songplay_keys.where(songplay_keys.notna(), None)
+    parsed_ts = pd.to_datetime(songplays.ts, unit="ms")
+    songplays = pd.DataFrame({
+        "start_time": songplays.ts.values,
+        "user_id": songplays.userId.astype("int32").values,
+        "level": songplays.level.values,
+        "song_id": songplays.song_id.values,
+        "artist_id": songplays.artist_id.values,
+        "session_id": songplays.sessionId.astype("int32").values,
+        "location": songplays.location.values,
+        "user_agent": songplays.userAgent.values,
+        "songplay_id": [hash_key_value(*key) for key in songplay_keys.itertuples(index=False)],
+        "year": parsed_ts.dt.year.astype("int32").values,
+        "month": parsed_ts.dt.month.astype("int32").values,
+    })
+    _write_table(songplays, "songplays", output_data, SONGPLAYS_SCHEMA)
+
+
+class LocalEngine:
+    """runs the stages of our job with the local engine, the dimensions of the song stage are kept in memory"""
+
+    name = "local"
+
+    def __init__(self, input_data, output_data):
+        self.input_data = input_data
+        self.output_data = output_data
+        self.songs = None
+        self.artists = None
+
+    def process_song_data(self):
+        self.songs, self.artists = process_song_data(self.input_data, self.output_data)
+
+    def process_log_data(self):
+        process_log_data(self.input_data, self.output_data, songs=self.songs, artists=self.artists)
+
+    def run(self):
+        self.process_song_data()
+        self.process_log_data()
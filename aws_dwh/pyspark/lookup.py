@@ -0,0 +1,36 @@
+from pyspark.sql import functions as F
+from pyspark.sql.functions import col
+
+# durations in the log events and in the song catalog differ slightly,
+# hence we match them after rounding to this tolerance (in seconds)
+DURATION_TOLERANCE = 1.0
+
+SONG_LOOKUP_KEYS = ["title_key", "artist_key", "duration_key"]
+
+
+def song_lookup_keys(df, title, artist_name, duration, duration_tolerance=DURATION_TOLERANCE):
+    """
+    add the normalized (title, artist name, rounded duration) keys we use to match log events against songs
+    """
+    return df \
+        .withColumn("title_key", F.lower(F.trim(col(title)))) \
+        .withColumn("artist_key", F.lower(F.trim(col(artist_name)))) \
+        .withColumn("duration_key", F.round(col(duration) / duration_tolerance).cast("long"))
+
+
+def build_song_lookup(df_song_table, df_artist_table, duration_tolerance=DURATION_TOLERANCE):
+    """
+    Build a small lookup index that maps normalized song keys to song and artist ids.
+    The index is meant to be broadcast to the executors when log events are enriched.
+    Arguments:
+        df_song_table {DataFrame}: songs dimension (song_id, title, artist_id, year, duration)
+        df_artist_table {DataFrame}: artists dimension (artist_id, name, location, latitude, longitude)
+        duration_tolerance {float}: durations are rounded to multiples of this value (in seconds)
+    """
+    songs_with_artist = df_song_table.select("song_id", "title", "artist_id", "duration") \
+        .join(df_artist_table.select("artist_id", "name"), on="artist_id")
+
+    return song_lookup_keys(songs_with_artist, title="title", artist_name="name", duration="duration",
+                             duration_tolerance=duration_tolerance) \
+        .select(SONG_LOOKUP_KEYS + ["song_id", "artist_id"]) \
+        .dropDuplicates(SONG_LOOKUP_KEYS)
@@ -0,0 +1,55 @@
+from datetime import datetime
+
+import storage
+
+
+class ProcessedFilesManifest:
+    """
+    Keeps track of the source files that have already been processed by the job.
+    The manifest is a small json document next to our output tables, e.g.
+    `s3a://capstone-uda-data/_manifests/log_data.json`, and maps every processed file
+    to the size and modification time it had when we read it. This way we are able to tell
+    which files are new or have been changed since the last run.
+    """
+
+    def __init__(self, spark, output_data, source):
+        self.spark = spark
+        self.location = f"{output_data}_manifests/{source}.json"
+        self.files = {}
+
+    def load(self):
+        document = storage.read_json(self.spark, self.location, default={})
+        self.files = document.get("files", {})
+        return self
+
+    def pending(self, current_files):
+        """
+        Arguments:
+            current_files {dict}: listing as returned by `storage.list_files`
+        Returns:
+            {list}: paths that are either unknown to the manifest or changed since they were processed
+        """
+        return sorted(
+            path for path, status in current_files.items()
+            if self.files.get(path) != status
+        )
+
+    def mark_processed(self, files):
+        self.files.update(files)
+
+    def reset(self):
+        self.files = {}
+
+    def save(self):
+        storage.write_json(self.spark, self.location, {
+            "updated_at": datetime.utcnow().isoformat(),
+            "files": self.files,
+        })
+
+
+def partition_directories(paths):
+    """
+    our raw log data is laid out as `log_data/<year>/<month>/<file>.json`, hence the parent directory
+    of a file corresponds to exactly one year/month partition of the output tables
+    """
+    return sorted({path.rsplit("/", 1)[0] for path in paths})
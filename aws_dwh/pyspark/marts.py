@@ -0,0 +1,81 @@
+from pyspark.sql import functions as F
+from pyspark.sql.functions import col
+
+from writer import write_table
+from zone_maps import read_table
+
+
+def _with_day(df_songplays):
+    parsed_ts = (col("start_time") / 1000).cast("timestamp")
+    return df_songplays \
+        .withColumn("date", F.to_date(parsed_ts)) \
+        .withColumn("hour", F.hour(parsed_ts))
+
+
+def build_song_plays_daily(df_songplays, df_song_table, df_artist_table):
+    """plays per day and song, with the song title and the artist name, so dashboards need no join"""
+    songs = df_song_table.select("song_id", "title")
+    artists = df_artist_table.select("artist_id", col("name").alias("artist_name"))
+    return _with_day(df_songplays) \
+        .groupBy("year", "month", "date", "song_id", "artist_id") \
+        .agg(F.count(F.lit(1)).alias("plays"),
+             F.countDistinct("user_id").alias("listeners")) \
+        .join(F.broadcast(songs), on="song_id", how="left") \
+        .join(F.broadcast(artists), on="artist_id", how="left") \
+        .select("date", "song_id", "title", "artist_id", "artist_name", "plays", "listeners", "year", "month")
+
+
+def build_user_plays_daily(df_songplays, df_song_table=None, df_artist_table=None):
+    """plays and sessions per day and user, `level` is the level the user had at the last play of the day"""
+    return _with_day(df_songplays) \
+        .groupBy("year", "month", "date", "user_id") \
+        .agg(F.count(F.lit(1)).alias("plays"),
+             F.countDistinct("session_id").alias("sessions"),
+             F.countDistinct("song_id").alias("songs"),
+             F.max(F.struct("start_time", "level")).getField("level").alias("level")) \
+        .select("date", "user_id", "level", "plays", "sessions", "songs", "year", "month")
+
+
+def build_plays_by_hour_level(df_songplays, df_song_table=None, df_artist_table=None):
+    """plays per day, hour of the day and subscription level"""
+    return _with_day(df_songplays) \
+        .groupBy("year", "month", "date", "hour", "level") \
+        .agg(F.count(F.lit(1)).alias("plays"),
+             F.countDistinct("user_id").alias("users")) \
+        .select("date", "hour", "level", "plays", "users", "year", "month")
+
+
+# mart table -> builder, every builder is called with the songplays, songs and artists (it may ignore the latter)
+MARTS = {
+    "song_plays_daily": build_song_plays_daily,
+    "user_plays_daily": build_user_plays_daily,
+    "plays_by_hour_level": build_plays_by_hour_level,
+}
+
+
+def update_marts(spark, output_data, partitions=None, df_song_table=None, df_artist_table=None):
+    """
+    Recompute the marts for the given songplays partitions from the written songplays table and replace exactly
+    these partitions of the marts; all other days stay as they are. Without partitions the marts are rebuilt.
+    Arguments:
+        partitions {list}: songplays partition directories like `year=2018/month=11`, None for all of them
+        df_song_table {DataFrame}: songs dimension, read from `output_data` if not given
+        df_artist_table {DataFrame}: artists dimension, read from `output_data` if not given
+    Returns:
+        {dict}: mart -> replaced partitions
+    """
+    if partitions is not None and not partitions:
+        return {}
+    # only the partitions that changed are read
+    df_songplays = read_table(spark, output_data, "songplays", partitions=partitions)
+
+    if df_song_table is None:
+        df_song_table = read_table(spark, output_data, "songs")
+    if df_artist_table is None:
+        df_artist_table = read_table(spark, output_data, "artists")
+
+    return {
+        mart: write_table(build(df_songplays, df_song_table, df_artist_table), mart, output_data,
+                          replace_all=partitions is None)
+        for mart, build in MARTS.items()
+    }
@@ -0,0 +1,133 @@
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.error import URLError
+from urllib.request import urlopen
+
+import storage
+from task_graph import pinned_threads
+
+# metrics spark aggregates per stage, summed up over all stages of one of our job stages
+_STAGE_METRICS = {
+    "inputRecords": "input_rows",
+    "inputBytes": "input_bytes",
+    "outputRecords": "output_rows",
+    "outputBytes": "output_bytes",
+    "shuffleReadBytes": "shuffle_read_bytes",
+    "shuffleWriteBytes": "shuffle_write_bytes",
+    "memoryBytesSpilled": "memory_spilled_bytes",
+    "diskBytesSpilled": "disk_spilled_bytes",
+}
+
+
+def _status(spark, endpoint):
+    """
+    Query the status api of the running application. Its content is collected by spark's own
+    status listener, which keeps the per stage and per task metrics of all jobs.
+    """
+    sc = spark.sparkContext
+    with urlopen(f"{sc.uiWebUrl}/api/v1/applications/{sc.applicationId}/{endpoint}", timeout=10) as response:
+        return json.loads(response.read().decode("utf-8"))
+
+
+def job_group_metrics(spark, job_group):
+    """
+    Aggregate the metrics of all spark stages that ran in `job_group`
+    Returns:
+        {dict}: rows, bytes, shuffle and spill metrics as well as the task skew, i.e. the ratio between the
+            slowest and the median task run time of the most skewed spark stage
+    """
+    stage_ids = {
+        stage_id for job in _status(spark, "jobs") if job.get("jobGroup") == job_group for stage_id in job["stageIds"]
+    }
+    stages = [stage for stage in _status(spark, "stages") if stage["stageId"] in stage_ids]
+
+    metrics = {name: sum(stage.get(key, 0) for stage in stages) for key, name in _STAGE_METRICS.items()}
+    metrics["spark_stages"] = len(stages)
+
+    task_skew = 1.0
+    for stage in stages:
+        if stage.get("numCompleteTasks", 0) < 2:
+            continue
+        summary = _status(spark, f"stages/{stage['stageId']}/{stage['attemptId']}/taskSummary?quantiles=0.5,1.0")
+        median_run_time, max_run_time = summary["executorRunTime"]
+        if median_run_time:
+            task_skew = max(task_skew, max_run_time / median_run_time)
+    metrics["task_skew"] = round(task_skew, 2)
+    return metrics
+
+
+def report_path(output_data, run_id, part):
+    return f"{output_data}_reports/{run_id}/{part}.json"
+
+
+class RunReport:
+    """
+    Collects metrics for every stage (read, transform, write) of a run of our job
+    and writes them as one structured json report next to our output tables: `_reports/<run id>/<part>.json`.
+    The concurrent steps of a pipeline run share the run id and write one part each, e.g. the tables they build.
+    """
+
+    def __init__(self, spark, output_data, run_id=None, part="etl"):
+        self.spark = spark
+        self.output_data = output_data
+        self.run_id = run_id or f"{datetime.utcnow():%Y%m%dT%H%M%S}-{uuid.uuid4().hex[:8]}"
+        self.part = part
+        self.started_at = datetime.utcnow()
+        self.stages = []
+        # start/end of every task of the run, relative to the start of the task graph (see `task_graph.run_tasks`)
+        self.timeline = {}
+
+    def measurable(self):
+        """
+        Whether the jobs of a stage are the jobs of its job group: the stage runs on the main thread
+        or every thread has its own local properties (see `task_graph.pinned_threads`)
+        """
+        return threading.current_thread() is threading.main_thread() or pinned_threads(self.spark)
+
+    @contextmanager
+    def stage(self, name, kind):
+        """
+        Measure everything spark executes within the block
+        Arguments:
+            name {str}: name of the stage, e.g. `write_songs`
+            kind {str}: `read`, `transform` or `write`
+        """
+        job_group = f"{self.run_id}:{name}"
+        sc = self.spark.sparkContext
+        sc.setJobGroup(job_group, name)
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - started
+            sc.setLocalProperty("spark.jobGroup.id", None)
+
+            record = {"name": name, "kind": kind, "duration_seconds": round(duration, 3)}
+            if not self.measurable():
+                # the jobs of the stage may have run in the job group of another thread's stage and vice versa
+                print(f"not collecting metrics of stage {name}: python threads are not pinned to jvm threads")
+            else:
+                try:
+                    record.update(job_group_metrics(self.spark, job_group))
+                except (URLError, OSError, KeyError, ValueError) as e:
+                    # e.g. the spark ui is disabled, we still report the duration
+                    print(f"could not collect metrics of stage {name}: {e}")
+            self.stages.append(record)
+            print(f"stage {name}: {record}")
+
+    def save(self):
+        report = {
+            "run_id": self.run_id,
+            "part": self.part,
+            "application_id": self.spark.sparkContext.applicationId,
+            "started_at": self.started_at.isoformat(),
+            "finished_at": datetime.utcnow().isoformat(),
+            "stages": self.stages,
+            "timeline": self.timeline,
+        }
+        storage.write_json(self.spark, report_path(self.output_data, self.run_id, self.part), report)
+        return report
@@ -0,0 +1,61 @@
+from datetime import datetime
+
+import storage
+from tables import TABLES
+
+
+def manifest_path(output_data, table):
+    """named like the glue table, e.g. `_partitions/songplays_data.json`"""
+    return f"{output_data}_partitions/{TABLES[table].location.strip('/')}.json"
+
+
+def partition_values(directory):
+    """`year=2018/month=11` -> ["2018", "11"]"""
+    return [part.split("=", 1)[1] for part in directory.split("/")]
+
+
+def merge_partitions(document, table, columns, partition_keys, partitions, replace_all=False):
+    """
+    Add the partitions of a write to the partitions that still wait for their registration in glue
+    Arguments:
+        document {dict}: current manifest of the table, empty if there is none yet
+        columns {list}: (name, hive type) of the data columns
+        partition_keys {list}: (name, hive type) of the partition columns
+        partitions {list}: written partition directories like `year=2018/month=11`
+        replace_all {bool}: the write replaced the whole table, `partitions` are all partitions it has now
+    Returns:
+        {dict}: the new manifest
+    """
+    pending = set() if replace_all else {tuple(values) for values in document.get("partitions", [])}
+    pending.update(tuple(partition_values(directory)) for directory in partitions if directory)
+    return {
+        "table": TABLES[table].location.strip("/"),
+        "updated_at": datetime.utcnow().isoformat(),
+        "columns": [{"Name": name, "Type": type_} for name, type_ in columns],
+        "partition_keys": [{"Name": name, "Type": type_} for name, type_ in partition_keys],
+        "partitions": sorted(list(values) for values in pending),
+        # partitions that are registered but not part of the manifest anymore are dropped by the registration
+        "replace_all": replace_all or document.get("replace_all", False),
+    }
+
+
+def write_partition_manifest(spark, output_data, table, schema, partitions, replace_all=False):
+    """
+    Record the schema and the partitions a write produced, the `register_partitions` lambda registers
+    exactly these partitions in the glue catalog instead of crawling the whole bucket
+    Arguments:
+        schema {StructType}: schema of the written DataFrame
+        partitions {list}: partition directories as returned by `writer._commit`
+    """
+    partition_by = TABLES[table].partition_by
+    fields = {field.name: field.dataType.simpleString() for field in schema.fields}
+    path = manifest_path(output_data, table)
+    document = merge_partitions(
+        storage.read_json(spark, path, default={}),
+        table,
+        [(name, type_) for name, type_ in fields.items() if name not in partition_by],
+        [(name, fields[name]) for name in partition_by],
+        partitions,
+        replace_all=replace_all,
+    )
+    storage.write_json(spark, path, document)
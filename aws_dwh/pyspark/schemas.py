@@ -0,0 +1,112 @@
+from pyspark.sql.functions import col
+from pyspark.sql.types import StructType as R, StructField as Fld, DoubleType as Dbl, StringType as Str, \
+    IntegerType as Int, LongType as Long
+
+# records that do not fit the schema end up in this column instead of failing the whole read
+CORRUPT_RECORD_COLUMN = "_corrupt_record"
+
+# every change of a source schema gets a new version, so older data can still be read with the schema it was written in
+SCHEMAS = {
+    "song_data": {
+        1: R([
+            Fld("num_songs", Int()),
+            Fld("artist_id", Str()),
+            Fld("artist_latitude", Str()),
+            Fld("artist_longitude", Str()),
+            Fld("artist_location", Str()),
+            Fld("artist_name", Str()),
+            Fld("song_id", Str()),
+            Fld("title", Str()),
+            Fld("duration", Dbl()),
+            Fld("year", Int()),
+        ]),
+    },
+    "log_data": {
+        # types correspond to what spark used to infer from the raw events
+        1: R([
+            Fld("artist", Str()),
+            Fld("auth", Str()),
+            Fld("firstName", Str()),
+            Fld("gender", Str()),
+            Fld("itemInSession", Long()),
+            Fld("lastName", Str()),
+            Fld("length", Dbl()),
+            Fld("level", Str()),
+            Fld("location", Str()),
+            Fld("method", Str()),
+            Fld("page", Str()),
+            Fld("registration", Dbl()),
+            Fld("sessionId", Long()),
+            Fld("song", Str()),
+            Fld("status", Long()),
+            Fld("ts", Long()),
+            Fld("userAgent", Str()),
+            Fld("userId", Str()),
+        ]),
+    },
+}
+
+# source fields each of our output tables is built from
+TABLE_COLUMNS = {
+    "song_data": {
+        "songs": ["song_id", "title", "artist_id", "year", "duration"],
+        "artists": ["artist_id", "artist_name", "artist_location", "artist_latitude", "artist_longitude"],
+    },
+    "log_data": {
+        "users": ["page", "ts", "userId", "firstName", "lastName", "gender", "level"],
+        "time": ["page", "ts"],
+        "songplays": ["page", "ts", "userId", "level", "song", "artist", "length", "sessionId", "itemInSession",
+                      "location", "userAgent"],
+    },
+}
+
+
+def latest_version(source):
+    return max(SCHEMAS[source])
+
+
+def get_schema(source, version=None, tables=None):
+    """
+    Return the schema of one of our sources
+    Arguments:
+        source {str}: `song_data` or `log_data`
+        version {int}: schema version, defaults to the latest one
+        tables {list}: output tables that will be built; the schema is pruned to the fields these tables need,
+            so that the json reader does not parse anything else
+    """
+    schema = SCHEMAS[source][version or latest_version(source)]
+    if tables is None:
+        return schema
+
+    required = {column for table in tables for column in TABLE_COLUMNS[source][table]}
+    return R([field for field in schema.fields if field.name in required])
+
+
+def read_source(spark, source, paths, version=None, tables=None):
+    """
+    Read json source files with an explicit (pruned) schema, which saves spark the extra pass
+    over all files it needs for schema inference.
+    Records that do not fit the schema are kept in `CORRUPT_RECORD_COLUMN`, see `split_drift`.
+    """
+    schema = get_schema(source, version=version, tables=tables)
+    schema = R(schema.fields + [Fld(CORRUPT_RECORD_COLUMN, Str())])
+
+    return spark.read \
+        .option("mode", "PERMISSIVE") \
+        .option("columnNameOfCorruptRecord", CORRUPT_RECORD_COLUMN) \
+        .json(paths, schema=schema)
+
+
+def split_drift(df, source):
+    """
+    Count the records that did not fit the schema and drop them.
+    `df` must be cached: spark does not allow to query the corrupt record column of a raw json read
+    on its own, and counting on the cached data does not scan the source files a second time.
+    Returns:
+        {tuple}: (DataFrame without drifted records, number of drifted records)
+    """
+    drifted = df.filter(col(CORRUPT_RECORD_COLUMN).isNotNull()).count()
+    if drifted:
+        print(f"schema drift: {drifted} records of {source} do not fit the expected schema")
+
+    return df.filter(col(CORRUPT_RECORD_COLUMN).isNull()).drop(CORRUPT_RECORD_COLUMN), drifted
@@ -0,0 +1,130 @@
+import math
+
+from pyspark.sql import SparkSession
+
+import storage
+
+# settings spark only picks up when the session is created, the same for every profile
+BASE_SETTINGS = {
+    "spark.jars.packages": "org.apache.hadoop:hadoop-aws:2.7.0",
+    "spark.sql.session.timeZone": "UTC",
+    "spark.serializer": "org.apache.spark.serializer.KryoSerializer",
+    # independent table writes are submitted concurrently, each one in its own pool (see `task_graph.py`)
+    "spark.scheduler.mode": "FAIR",
+    # stream uploads to s3 in parts instead of buffering whole files on local disk
+    "spark.hadoop.fs.s3a.fast.upload": "true",
+    "spark.hadoop.fs.s3a.fast.upload.buffer": "bytebuffer",
+    "spark.hadoop.fs.s3a.multipart.size": str(64 * 1024 ** 2),
+    "spark.hadoop.fs.s3a.connection.maximum": "200",
+    # tasks commit their files directly instead of renaming them once more when the job commits
+    "spark.hadoop.mapreduce.fileoutputcommitter.algorithm.version": "2",
+    "spark.sql.parquet.fs.optimized.committer.optimization-enabled": "true",
+}
+
+# sql settings per profile, they are applied to the running session once we know how big the input is.
+# The cluster runs spark 3.2 (see `EMR_RELEASE_LABEL` of the stack), its adaptive execution coalesces small post
+# shuffle partitions and splits the skewed partitions of a sort merge join.
+PROFILES = {
+    "local": {
+        "spark.sql.adaptive.enabled": "true",
+        "spark.sql.autoBroadcastJoinThreshold": str(10 * 1024 ** 2),
+        "spark.sql.files.maxPartitionBytes": str(32 * 1024 ** 2),
+    },
+    "small-emr": {
+        "spark.sql.adaptive.enabled": "true",
+        "spark.sql.adaptive.advisoryPartitionSizeInBytes": str(64 * 1024 ** 2),
+        "spark.sql.adaptive.coalescePartitions.enabled": "true",
+        # songs are partitioned and joined by artist, and a few artists have a lot of songs
+        "spark.sql.adaptive.skewJoin.enabled": "true",
+        "spark.sql.autoBroadcastJoinThreshold": str(64 * 1024 ** 2),
+        "spark.sql.files.maxPartitionBytes": str(128 * 1024 ** 2),
+    },
+    "large-emr": {
+        "spark.sql.adaptive.enabled": "true",
+        "spark.sql.adaptive.advisoryPartitionSizeInBytes": str(128 * 1024 ** 2),
+        "spark.sql.adaptive.coalescePartitions.enabled": "true",
+        "spark.sql.adaptive.skewJoin.enabled": "true",
+        "spark.sql.adaptive.skewJoin.skewedPartitionFactor": "5",
+        "spark.sql.autoBroadcastJoinThreshold": str(128 * 1024 ** 2),
+        "spark.sql.files.maxPartitionBytes": str(256 * 1024 ** 2),
+    },
+}
+
+# inputs up to this size run with the `small-emr` profile on a cluster
+SMALL_EMR_MAX_BYTES = 50 * 1024 ** 3
+
+# the number of shuffle partitions follows the input size within the bounds of the profile
+SHUFFLE_PARTITION_BYTES = 128 * 1024 ** 2
+SHUFFLE_PARTITION_BOUNDS = {
+    "local": (4, 32),
+    "small-emr": (32, 400),
+    "large-emr": (400, 4000),
+}
+
+# the raw sources our job reads
+INPUT_SOURCES = ["song_data/", "log_data/"]
+
+
+def estimate_input_bytes(spark, input_data, sources=INPUT_SOURCES):
+    """total size of `sources` below `input_data`, a recursive listing that takes a while on s3"""
+    return sum(storage.directory_size(spark, f"{input_data}{source}") for source in sources)
+
+
+def choose_profile(spark, input_bytes):
+    if spark.sparkContext.master.startswith("local"):
+        return "local"
+    return "small-emr" if input_bytes <= SMALL_EMR_MAX_BYTES else "large-emr"
+
+
+def profile_settings(profile, input_bytes):
+    """the sql settings of `profile` including the number of shuffle partitions for `input_bytes`"""
+    lower, upper = SHUFFLE_PARTITION_BOUNDS[profile]
+    shuffle_partitions = min(upper, max(lower, math.ceil(input_bytes / SHUFFLE_PARTITION_BYTES)))
+    return dict(PROFILES[profile], **{"spark.sql.shuffle.partitions": str(shuffle_partitions)})
+
+
+def parse_overrides(values):
+    """`["KEY=VALUE", ...]` as given on the command line -> dict"""
+    overrides = {}
+    for value in values or []:
+        key, separator, setting = value.partition("=")
+        if not separator or not key:
+            raise ValueError(f"spark settings are given as KEY=VALUE, got {value!r}")
+        overrides[key.strip()] = setting.strip()
+    return overrides
+
+
+def create_spark_session(input_data, overrides=None, profile=None, sources=INPUT_SOURCES, input_bytes=None):
+    """
+    Create the spark session and tune it to the size of the input: the sources the job reads below `input_data`
+    are measured, unless the caller knows their size already, and the sql settings of the matching profile
+    (`local`, `small-emr` or `large-emr`) are applied.
+    Arguments:
+        input_data {str}: location (local/s3) of the raw sources
+        overrides {dict}: spark settings that take precedence over the base settings and the profile
+        profile {str}: use this profile instead of choosing one by the input size
+        sources {list}: sources below `input_data` the job reads, only these are measured
+        input_bytes {int}: size of the input, skips measuring the sources
+    Returns:
+        {tuple}: (spark session, name of the chosen profile)
+    """
+    overrides = overrides or {}
+    builder = SparkSession.builder
+    for key, value in dict(BASE_SETTINGS, **overrides).items():
+        builder = builder.config(key, value)
+    spark = builder.getOrCreate()
+
+    if input_bytes is None:
+        input_bytes = estimate_input_bytes(spark, input_data, sources)
+    profile = profile or choose_profile(spark, input_bytes)
+    settings = profile_settings(profile, input_bytes)
+    for key, value in settings.items():
+        if key not in overrides:
+            spark.conf.set(key, value)
+
+    effective = {**BASE_SETTINGS, **settings, **overrides}
+    print(f"spark profile {profile} for {input_bytes} bytes of input"
+          f"{f', overrides {sorted(overrides)}' if overrides else ''}:")
+    for key in sorted(effective):
+        print(f"  {key}={effective[key]}")
+    return spark, profile
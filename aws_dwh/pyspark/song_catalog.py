@@ -0,0 +1,86 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+from pyspark.sql import functions as F
+
+import schemas
+import storage
+from manifest import ProcessedFilesManifest
+
+# the raw song data has one tiny json file per song; the staged catalog bundles them into files of about this size
+CATALOG_FILE_BYTES = 128 * 1024 ** 2
+
+# json songs are a lot bigger than their columnar representation
+JSON_TO_PARQUET_RATIO = 0.2
+
+LISTING_THREADS = 16
+
+
+def catalog_path(output_data):
+    return f"{output_data}_catalog/song_data/"
+
+
+def list_song_files(spark, input_data, threads=LISTING_THREADS):
+    """
+    List `song_data/*/*/*/*.json` in parallel: every first level directory is globbed in its own thread,
+    instead of walking the whole tree with a single (sequential) glob
+    Returns:
+        {dict}: path -> {"size": bytes, "modified": epoch millis}
+    """
+    top_level_directories = storage.list_directories(spark, f"{input_data}song_data/*")
+
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        listings = pool.map(lambda directory: storage.list_files(spark, f"{directory}/*/*/*.json"),
+                            top_level_directories)
+
+    files = {}
+    for listing in listings:
+        files.update(listing)
+    return files
+
+
+def compact_song_catalog(spark, input_data, output_data, full_refresh=False):
+    """
+    Pre-stage for `process_song_data`: bundle the small song json files into a few parquet files.
+    A listing index (our processed-files manifest) remembers which source files are in the catalog,
+    hence later runs only read and append new files. If a file changed since it was staged, or `full_refresh`
+    is set, the whole catalog is rebuilt.
+    Arguments:
+        spark {SparkSession}: active spark session
+        input_data {str}: location (local/s3) where the (root) input song data resides
+        output_data {str}: location (local/s3) where the (root) output files are written
+        full_refresh {bool}: ignore the index and rebuild the catalog from all source files
+    Returns:
+        {int}: number of source files that were added to the catalog
+    """
+    index = ProcessedFilesManifest(spark, output_data, "song_catalog").load()
+    song_files = list_song_files(spark, input_data)
+
+    pending_files = index.pending(song_files)
+    if not full_refresh and any(path in index.files for path in pending_files):
+        print("song files changed since they were staged, rebuilding the song catalog")
+        full_refresh = True
+
+    if full_refresh:
+        index.reset()
+        pending_files = sorted(song_files)
+
+    if not pending_files:
+        print("song catalog is up to date")
+        return 0
+
+    source_bytes = sum(song_files[path]["size"] for path in pending_files)
+    num_files = max(1, math.ceil(source_bytes * JSON_TO_PARQUET_RATIO / CATALOG_FILE_BYTES))
+
+    df_song = spark.read.json(pending_files, schema=schemas.get_schema("song_data")) \
+        .withColumn("source_file", F.input_file_name())
+
+    df_song.coalesce(num_files) \
+        .write \
+        .mode("overwrite" if full_refresh else "append") \
+        .parquet(catalog_path(output_data))
+
+    index.mark_processed({path: song_files[path] for path in pending_files})
+    index.save()
+    print(f"staged {len(pending_files)} song files ({source_bytes} bytes) into {num_files} catalog files")
+    return len(pending_files)
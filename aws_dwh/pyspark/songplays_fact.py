@@ -0,0 +1,37 @@
+from pyspark.sql import functions as F
+from pyspark.sql.functions import col
+
+from keys import SONGPLAY_KEY_COLUMNS, hash_key
+from lookup import SONG_LOOKUP_KEYS, song_lookup_keys
+
+
+def match_songs(df_log, song_lookup):
+    """
+    Look up every log event in the small, prebuilt song/artist index (see `lookup.build_song_lookup`),
+    which is shipped to every executor, so the (large) log data never has to be shuffled.
+    Events without a matching song keep null ids.
+    """
+    return song_lookup_keys(df_log, title="song", artist_name="artist", duration="length") \
+        .join(F.broadcast(song_lookup), on=SONG_LOOKUP_KEYS, how="left")
+
+
+def build_songplays_table(df_matched):
+    """
+    songplays fact of the matched events, used by the batch (`example.py`) and the streaming job (`streaming.py`)
+    `start_time` is just the original `ts`, hence there is no need to join the time table;
+    the id is derived from the event, a rerun of the same events produces the same ids
+    """
+    return df_matched.filter(col("song_id").isNotNull()) \
+        .withColumn("parsed_ts", (col("ts") / 1000).cast("timestamp")) \
+        .withColumn("songplay_id", hash_key(*SONGPLAY_KEY_COLUMNS)) \
+        .selectExpr("ts as start_time",
+                    "cast(userId as int) as user_id",
+                    "level",
+                    "song_id",
+                    "artist_id",
+                    "cast(sessionId as int) as session_id",
+                    "location",
+                    "userAgent as user_agent",
+                    "songplay_id",
+                    "year(parsed_ts) as year",
+                    "month(parsed_ts) as month")
@@ -0,0 +1,134 @@
+import json
+
+
+def _file_system(spark, path):
+    """
+    Resolve the hadoop FileSystem that is responsible for `path`, so the same code works for
+    local paths as well as for s3a:// locations on EMR
+    """
+    jvm = spark.sparkContext._jvm
+    hadoop_path = jvm.org.apache.hadoop.fs.Path(path)
+    fs = hadoop_path.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration())
+    return fs, hadoop_path
+
+
+def qualify(spark, path):
+    """fully qualified form of `path` (scheme, authority, no trailing slash) as used in file listings"""
+    fs, hadoop_path = _file_system(spark, path)
+    return fs.makeQualified(hadoop_path).toString().rstrip("/")
+
+
+def list_files(spark, pattern):
+    """
+    List all files matching a glob pattern
+    Arguments:
+        spark {SparkSession}: active spark session
+        pattern {str}: glob pattern like `s3a://bucket/log_data/*/*/*.json`
+    Returns:
+        {dict}: path -> {"size": bytes, "modified": epoch millis}
+    """
+    fs, hadoop_path = _file_system(spark, pattern)
+    statuses = fs.globStatus(hadoop_path) or []
+
+    files = {}
+    for status in statuses:
+        if status.isFile():
+            files[status.getPath().toString()] = {
+                "size": status.getLen(),
+                "modified": status.getModificationTime(),
+            }
+    return files
+
+
+def list_directories(spark, pattern):
+    """list all directories matching a glob pattern"""
+    fs, hadoop_path = _file_system(spark, pattern)
+    statuses = fs.globStatus(hadoop_path) or []
+    return sorted(status.getPath().toString() for status in statuses if status.isDirectory())
+
+
+def exists(spark, path):
+    fs, hadoop_path = _file_system(spark, path)
+    return fs.exists(hadoop_path)
+
+
+def directory_size(spark, path):
+    """total size in bytes of all files below `path`, 0 if it does not exist"""
+    if not exists(spark, path):
+        return 0
+    fs, hadoop_path = _file_system(spark, path)
+    return fs.getContentSummary(hadoop_path).getLength()
+
+
+def read_json(spark, path, default=None):
+    """read a (small) json document like a manifest via the driver"""
+    if not exists(spark, path):
+        return default
+
+    fs, hadoop_path = _file_system(spark, path)
+    stream = fs.open(hadoop_path)
+    try:
+        reader = spark.sparkContext._jvm.java.io.BufferedReader(
+            spark.sparkContext._jvm.java.io.InputStreamReader(stream, "UTF-8")
+        )
+        lines = []
+        line = reader.readLine()
+        while line is not None:
+            lines.append(line)
+            line = reader.readLine()
+    finally:
+        stream.close()
+
+    return json.loads("\n".join(lines))
+
+
+def write_json(spark, path, document):
+    """write a (small) json document via the driver, replacing the file if it already exists"""
+    fs, hadoop_path = _file_system(spark, path)
+    stream = fs.create(hadoop_path, True)
+    try:
+        stream.write(bytearray(json.dumps(document, indent=2, sort_keys=True), "utf-8"))
+    finally:
+        stream.close()
+
+
+def list_data_files(spark, path):
+    """
+    Recursively list the data files below `path`, skipping bookkeeping files and directories
+    that start with `_` or `.` (like `_SUCCESS` or `_staging/`) the same way spark readers do
+    Returns:
+        {dict}: path -> {"size": bytes, "modified": epoch millis}
+    """
+    if not exists(spark, path):
+        return {}
+
+    fs, hadoop_path = _file_system(spark, path)
+    root = qualify(spark, path)
+    iterator = fs.listFiles(hadoop_path, True)
+
+    files = {}
+    while iterator.hasNext():
+        status = iterator.next()
+        file_path = status.getPath().toString()
+        relative_parts = file_path[len(root):].strip("/").split("/")
+        if any(part.startswith(("_", ".")) for part in relative_parts):
+            continue
+        files[file_path] = {
+            "size": status.getLen(),
+            "modified": status.getModificationTime(),
+        }
+    return files
+
+
+def delete(spark, path, recursive=True):
+    fs, hadoop_path = _file_system(spark, path)
+    return fs.delete(hadoop_path, recursive)
+
+
+def move(spark, source, destination):
+    """move a single file, on S3 this is a copy followed by a delete"""
+    fs, source_path = _file_system(spark, source)
+    _, destination_path = _file_system(spark, destination)
+    fs.mkdirs(destination_path.getParent())
+    if not fs.rename(source_path, destination_path):
+        raise IOError(f"could not move {source} to {destination}")
@@ -0,0 +1,105 @@
+"""
+Streaming counterpart of `process_log_data` for the songplays: new log files are picked up as soon as they land
+in `log_data/` and their `NextSong` events are appended to `songplays_stream_data/` within a micro-batch.
+"""
+import time
+
+from pyspark.sql.functions import col
+
+import schemas
+from lookup import build_song_lookup
+from songplays_fact import build_songplays_table, match_songs
+from zone_maps import read_table
+
+# the stream is written next to the batch table, the batch job stays the source of truth for `songplays_data`
+STREAM_LOCATION = "songplays_stream_data/"
+
+# new log files are looked for at this interval
+TRIGGER_SECONDS = 60
+
+# the song/artist lookup is rebuilt from the output tables at this interval
+LOOKUP_REFRESH_SECONDS = 15 * 60
+
+# bounds the size of a micro-batch, e.g. after the stream was stopped for a while
+MAX_FILES_PER_TRIGGER = 1000
+
+
+def checkpoint_path(output_data, query_name="songplays_stream"):
+    return f"{output_data}_checkpoints/{query_name}/"
+
+
+def read_log_stream(spark, input_data, max_files_per_trigger=MAX_FILES_PER_TRIGGER):
+    """
+    The log files as a stream of `NextSong` events. A file source needs the schema upfront, we use the
+    explicit log schema pruned to the fields the songplays need; records that do not fit it are dropped.
+    """
+    schema = schemas.get_schema("log_data", tables=["songplays"])
+    df_log = spark.readStream \
+        .schema(schema) \
+        .option("maxFilesPerTrigger", max_files_per_trigger) \
+        .json(f"{input_data}log_data/*/*/")
+    return df_log.filter((col("page") == "NextSong") & col("ts").isNotNull())
+
+
+def load_song_lookup(spark, output_data):
+    """the song/artist lookup built from the songs and artists tables, cached until the next refresh"""
+    df_song_table = read_table(spark, output_data, "songs")
+    df_artist_table = read_table(spark, output_data, "artists")
+    song_lookup = build_song_lookup(df_song_table, df_artist_table).cache()
+    print(f"song lookup with {song_lookup.count()} songs")
+    return song_lookup
+
+
+def start_songplays_stream(spark, input_data, output_data, song_lookup, trigger_once=False,
+                           trigger_seconds=TRIGGER_SECONDS):
+    """
+    Start the streaming query that appends the songplays of new log files to `songplays_stream_data/`.
+    The file sink together with the checkpoint writes every micro-batch exactly once: files of a batch only
+    become part of the table once the batch is committed to `_spark_metadata`, which spark readers respect,
+    and a restarted query continues with the first batch that was not committed.
+    """
+    songplays = build_songplays_table(match_songs(read_log_stream(spark, input_data), song_lookup))
+    writer = songplays.writeStream \
+        .queryName("songplays_stream") \
+        .format("parquet") \
+        .option("checkpointLocation", checkpoint_path(output_data)) \
+        .partitionBy("year", "month") \
+        .outputMode("append")
+    writer = writer.trigger(once=True) if trigger_once else writer.trigger(processingTime=f"{trigger_seconds} seconds")
+    return writer.start(f"{output_data}{STREAM_LOCATION}")
+
+
+def process_log_stream(context, trigger_once=False, trigger_seconds=TRIGGER_SECONDS,
+                       refresh_seconds=LOOKUP_REFRESH_SECONDS):
+    """
+    Run the songplays stream until it is stopped (or, with `trigger_once`, until all files that are there
+    have been processed, e.g. for a local test run against a local directory).
+    A stream-static join keeps the lookup it was started with, hence the query is stopped every
+    `refresh_seconds`, the lookup is rebuilt with the songs and artists the batch job added in the meantime
+    and the query continues from its checkpoint.
+    Arguments:
+        context {PipelineContext}: spark session and input/output locations
+        trigger_once {bool}: process what is there in one micro-batch and return
+        trigger_seconds {int}: interval at which new log files are looked for
+        refresh_seconds {int}: interval at which the song/artist lookup is rebuilt
+    """
+    spark = context.spark
+    while True:
+        song_lookup = load_song_lookup(spark, context.output_data)
+        query = start_songplays_stream(spark, context.input_data, context.output_data, song_lookup,
+                                       trigger_once=trigger_once, trigger_seconds=trigger_seconds)
+        started = time.monotonic()
+        try:
+            terminated = query.awaitTermination(None if trigger_once else refresh_seconds)
+        finally:
+            if query.isActive:
+                query.stop()
+            song_lookup.unpersist()
+
+        progress = query.lastProgress
+        if progress:
+            print(f"songplays stream: batch {progress['batchId']}, {progress['numInputRows']} events "
+                  f"after {time.monotonic() - started:.0f}s")
+        if trigger_once or terminated:
+            # a query that terminated on its own failed (`awaitTermination` raises) or was stopped from outside
+            return
@@ -0,0 +1,98 @@
+from datetime import datetime
+
+from pyspark.sql import functions as F
+from pyspark.sql.types import AtomicType, BinaryType, BooleanType
+
+import storage
+from tables import TABLES
+
+# spark writes null partition values into this directory name
+_NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+
+def stats_path(output_data, table):
+    """the sidecar is named like the glue table, e.g. `_stats/songplays_data.json`"""
+    return f"{output_data}_stats/{TABLES[table].location.strip('/')}.json"
+
+
+def json_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    return str(value)
+
+
+def _partition_directory(row, partition_by):
+    return "/".join(
+        f"{column}={_NULL_PARTITION if row[column] is None else row[column]}" for column in partition_by
+    )
+
+
+def collect_statistics(df, table):
+    """
+    Per partition statistics of the data we are about to write: row count, null counts per column,
+    min/max of all orderable columns as well as exact and estimated distinct counts of the table keys.
+    `df` should be the cached DataFrame that is written, so the statistics are computed from the cached data
+    instead of scanning the written files (or the sources) again.
+    Returns:
+        {dict}: partition directory ("" for unpartitioned tables) -> statistics
+    """
+    spec = TABLES[table]
+    data_fields = [field for field in df.schema.fields if field.name not in spec.partition_by]
+
+    orderable = {
+        field.name for field in data_fields
+        if isinstance(field.dataType, AtomicType) and not isinstance(field.dataType, (BinaryType, BooleanType))
+    }
+
+    aggregations = [F.count(F.lit(1)).alias("row_count")]
+    for field in data_fields:
+        aggregations.append(F.sum(F.col(field.name).isNull().cast("long")).alias(f"{field.name}__nulls"))
+        if field.name in orderable:
+            aggregations.append(F.min(field.name).alias(f"{field.name}__min"))
+            aggregations.append(F.max(field.name).alias(f"{field.name}__max"))
+    for key in spec.keys:
+        aggregations.append(F.countDistinct(key).alias(f"{key}__distinct"))
+        aggregations.append(F.approx_count_distinct(key).alias(f"{key}__distinct_estimate"))
+
+    grouped = df.groupBy(*spec.partition_by) if spec.partition_by else df.groupBy()
+    statistics = {}
+    for row in grouped.agg(*aggregations).collect():
+        columns = {}
+        for field in data_fields:
+            column_statistics = {"nulls": row[f"{field.name}__nulls"] or 0}
+            if field.name in orderable:
+                column_statistics["min"] = json_value(row[f"{field.name}__min"])
+                column_statistics["max"] = json_value(row[f"{field.name}__max"])
+            if field.name in spec.keys:
+                column_statistics["distinct"] = row[f"{field.name}__distinct"]
+                column_statistics["distinct_estimate"] = row[f"{field.name}__distinct_estimate"]
+            columns[field.name] = column_statistics
+        statistics[_partition_directory(row, spec.partition_by)] = {"row_count": row["row_count"], "columns": columns}
+    return statistics
+
+
+def write_statistics(spark, output_data, table, statistics, replace_all=False):
+    """
+    Merge the statistics of the written partitions into the sidecar of the table.
+    The sidecar is `complete`, i.e. describes every partition of the table, only if it was started by a write
+    that covered the whole table and all later writes were merged into it. A table written without a sidecar
+    (e.g. by the local engine, or before the statistics existed) gets an incomplete one, which readers must not
+    answer questions about the whole table from, until the next write with `replace_all`.
+    Arguments:
+        statistics {dict}: as returned by `collect_statistics`
+        replace_all {bool}: the write covers the whole table (it replaced all of it or the table had no data),
+            statistics of other partitions are dropped
+    """
+    path = stats_path(output_data, table)
+    sidecar = {} if replace_all else storage.read_json(spark, path, default={})
+    partitions = sidecar.get("partitions", {})
+    partitions.update(statistics)
+
+    storage.write_json(spark, path, {
+        "table": table,
+        "updated_at": datetime.utcnow().isoformat(),
+        "complete": replace_all or sidecar.get("complete", False),
+        "partition_by": TABLES[table].partition_by,
+        "keys": TABLES[table].keys,
+        "partitions": partitions,
+    })
@@ -0,0 +1,52 @@
+from collections import namedtuple
+
+# how the rows of a table are laid out in its parquet files, chosen for the predicates our queries use
+#   sort_by: rows are sorted by these columns within every file, the parquet min/max statistics of the row groups
+#       then let Athena (and spark) skip row groups that cannot match a filter on them
+#   cluster_by: the rows of a partition are split into files that cover disjoint ranges of these columns, a filter
+#       on them skips whole files (the ranges are computed by spark, no metastore buckets, see `writer.py`)
+#   clusters: minimum number of files the ranges are spread over
+#   row_group_bytes: parquet row group size, None for the parquet default (one row group per file of our size)
+#   compression: parquet compression codec
+#   dictionary: dictionary encode the columns (parquet falls back to plain encoding for high cardinality columns)
+Layout = namedtuple(
+    "Layout",
+    ["sort_by", "cluster_by", "clusters", "row_group_bytes", "compression", "dictionary"],
+    defaults=[[], [], 1, None, "snappy", True],
+)
+
+DEFAULT_LAYOUT = Layout()
+
+# physical layout of one of our output tables
+#   keys: columns that identify a row, the writer keeps (distinct) statistics about them
+TableSpec = namedtuple(
+    "TableSpec", ["name", "location", "partition_by", "keys", "layout"], defaults=[[], DEFAULT_LAYOUT]
+)
+
+TABLES = {
+    # a directory per artist would hold a file of a few songs, which compaction could not merge; the files of a
+    # year cover disjoint artist ranges instead
+    "songs": TableSpec("songs", "song_data/", ["year"], ["song_id"],
+                       Layout(sort_by=["artist_id", "song_id"], cluster_by=["artist_id"])),
+    "artists": TableSpec("artists", "artist_data/", [], ["artist_id"], Layout(sort_by=["artist_id"])),
+    "users": TableSpec("users", "users_data/", ["user_bucket"], ["user_id"],
+                       Layout(sort_by=["user_id", "valid_from"])),
+    "time": TableSpec("time", "time_data/", ["year", "month"], ["start_time"], Layout(sort_by=["start_time"])),
+    # the files of a month cover disjoint user ranges, the row groups within a file are sorted by song and time
+    "songplays": TableSpec("songplays", "songplays_data/", ["year", "month"], ["songplay_id"],
+                           Layout(sort_by=["song_id", "start_time"], cluster_by=["user_id"], clusters=8,
+                                  row_group_bytes=16 * 1024 ** 2)),
+    "calendar": TableSpec("calendar", "calendar_data/", ["year", "month"], ["start_time"],
+                          Layout(sort_by=["start_time"])),
+    # pre-joined aggregates of songplays for dashboards, see `marts.py`
+    "song_plays_daily": TableSpec("song_plays_daily", "mart_song_plays_daily/", ["year", "month"],
+                                  layout=Layout(sort_by=["date", "song_id"])),
+    "user_plays_daily": TableSpec("user_plays_daily", "mart_user_plays_daily/", ["year", "month"],
+                                  layout=Layout(sort_by=["date", "user_id"])),
+    "plays_by_hour_level": TableSpec("plays_by_hour_level", "mart_plays_by_hour_level/", ["year", "month"],
+                                     layout=Layout(sort_by=["date", "hour", "level"])),
+}
+
+
+def table_path(output_data, table):
+    return f"{output_data}{TABLES[table].location}"
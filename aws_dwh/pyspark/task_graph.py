@@ -0,0 +1,85 @@
+import time
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+# One unit of work of our job, e.g. the write of a table. `run` is called without arguments once all tasks
+# in `depends_on` finished; dependencies on tasks that are not part of the graph are considered met.
+Task = namedtuple("Task", ["name", "run", "depends_on"], defaults=[()])
+
+# the driver submits at most this many tasks at once, every one of them is a separate spark job
+MAX_CONCURRENT_TASKS = 4
+
+# local properties of the calling thread the jobs of the tasks run with as well, e.g. the job group of a benchmark
+# stage whose metrics are collected by the group; spark does not pass them on to the threads of our pool
+INHERITED_PROPERTIES = ["spark.jobGroup.id", "spark.job.description", "spark.job.interruptOnCancel"]
+
+
+def pinned_threads(spark):
+    """
+    Whether every python thread of the driver runs its calls on a jvm thread of its own (pyspark's pinned thread
+    mode, on by default from spark 3.2 on). Only then the local properties a thread sets, e.g. its scheduler pool
+    and job group, are the ones of the jobs it starts; otherwise the python threads share the jvm threads of py4j.
+    """
+    try:
+        from py4j.clientserver import ClientServer
+    except ImportError:
+        return False
+    return isinstance(getattr(spark.sparkContext, "_gateway", None), ClientServer)
+
+
+def run_tasks(spark, tasks, max_workers=MAX_CONCURRENT_TASKS):
+    """
+    Run the tasks from a thread pool, every task as soon as its dependencies finished.
+    Each task runs in its own pool of spark's fair scheduler, so the jobs of a small dimension write get their
+    share of the executors next to a large write instead of queueing behind it; the jobs keep the job group
+    of the caller. This needs the pinned thread mode (see `pinned_threads`), without it pools and job groups of the
+    tasks are best-effort.
+    The first failing task fails the run, tasks that already run are finished but no new ones are started.
+    Returns:
+        {dict}: task -> {"started", "finished", "seconds"}, seconds relative to the start of the run
+    """
+    tasks = {task.name: task for task in tasks}
+    dependencies = {name: {dependency for dependency in task.depends_on if dependency in tasks}
+                    for name, task in tasks.items()}
+    sc = spark.sparkContext
+    if max_workers > 1 and not pinned_threads(spark):
+        print("pyspark does not pin python threads to jvm threads (PYSPARK_PIN_THREAD), "
+              "the scheduler pools and job groups of the tasks are best-effort")
+    inherited = {key: sc.getLocalProperty(key) for key in INHERITED_PROPERTIES}
+    run_started = time.perf_counter()
+    timings = {}
+
+    def execute(task):
+        properties = {**inherited, "spark.scheduler.pool": task.name}
+        for key, value in properties.items():
+            sc.setLocalProperty(key, value)
+        started = time.perf_counter()
+        try:
+            task.run()
+        finally:
+            finished = time.perf_counter()
+            for key in properties:
+                sc.setLocalProperty(key, None)
+            timings[task.name] = {"started": round(started - run_started, 3),
+                                  "finished": round(finished - run_started, 3),
+                                  "seconds": round(finished - started, 3)}
+
+    done = set()
+    running = {}
+    with ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="task") as executor:
+        while len(done) < len(tasks):
+            for name, task_dependencies in dependencies.items():
+                if name not in done and name not in running.values() and task_dependencies <= done:
+                    running[executor.submit(execute, tasks[name])] = name
+            if not running:
+                raise ValueError(f"cyclic dependencies between {sorted(set(tasks) - done)}")
+
+            finished, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name = running.pop(future)
+                future.result()
+                done.add(name)
+
+    for name, timing in sorted(timings.items(), key=lambda item: item[1]["started"]):
+        print(f"task {name}: {timing['started']:.1f}s - {timing['finished']:.1f}s ({timing['seconds']:.1f}s)")
+    return timings
@@ -0,0 +1,62 @@
+from datetime import date
+
+from pyspark.sql import functions as F
+from pyspark.sql.functions import col
+
+
+def with_time_attributes(df, ts_column="start_time"):
+    """
+    Derive all calendar attributes of the time dimension from an epoch millis column.
+    The millis are converted to a timestamp exactly once and every attribute is a native spark expression
+    on top of it, so everything is computed in one generated-code pass (no string formatting/re-parsing, no udfs).
+    Arguments:
+        df {DataFrame}: DataFrame with an epoch millis column
+        ts_column {str}: name of that column, it is kept as `start_time`
+    """
+    parsed_ts = (col(ts_column) / 1000).cast("timestamp")
+    return df \
+        .withColumn("_parsed_ts", parsed_ts) \
+        .select(col(ts_column).alias("start_time"),
+                F.hour("_parsed_ts").alias("hour"),
+                F.dayofmonth("_parsed_ts").alias("day"),
+                F.weekofyear("_parsed_ts").alias("week"),
+                F.month("_parsed_ts").alias("month"),
+                F.year("_parsed_ts").alias("year"),
+                F.dayofweek("_parsed_ts").alias("weekday"))
+
+
+def build_time_table(df_events, ts_column="ts"):
+    """
+    Time dimension with one row per distinct timestamp of the given events
+    """
+    return with_time_attributes(df_events.select(ts_column).distinct(), ts_column=ts_column)
+
+
+def _month_start(day):
+    return date(day.year, day.month, 1)
+
+
+def _next_month_start(day):
+    return date(day.year + day.month // 12, day.month % 12 + 1, 1)
+
+
+def _epoch_millis(day):
+    return (day - date(1970, 1, 1)).days * 24 * 3600 * 1000
+
+
+def build_calendar_table(spark, start_date, end_date, step_seconds=3600):
+    """
+    Precomputed calendar with the same columns as the time dimension, one row every `step_seconds`.
+    The range is widened to whole months, so the result can be merged into an existing calendar
+    by replacing exactly the year/month partitions it covers.
+    Arguments:
+        spark {SparkSession}: active spark session
+        start_date {date}: first day of the calendar
+        end_date {date}: last day of the calendar (inclusive)
+        step_seconds {int}: resolution of the calendar
+    """
+    start_millis = _epoch_millis(_month_start(start_date))
+    end_millis = _epoch_millis(_next_month_start(end_date))
+
+    timestamps = spark.range(start_millis, end_millis, step_seconds * 1000).withColumnRenamed("id", "start_time")
+    return with_time_attributes(timestamps)
@@ -0,0 +1,83 @@
+from pyspark.sql import Window
+from pyspark.sql import functions as F
+from pyspark.sql.functions import col
+
+import storage
+from tables import table_path
+from writer import finish_pending_commit
+from zone_maps import read_table
+
+# attributes of a user we keep the history of, a new version starts whenever one of them changes
+USER_ATTRIBUTES = ["first_name", "last_name", "gender", "level"]
+
+# users_data is partitioned by `pmod(user_id, USER_BUCKETS)`, a merge only rewrites the buckets of the affected users
+USER_BUCKETS = 16
+
+
+def user_bucket(user_id_column="user_id"):
+    return F.pmod(col(user_id_column), F.lit(USER_BUCKETS)).cast("int")
+
+
+def user_change_points(df_events):
+    """
+    Every event is a (potential) change point of its user: the attributes the user had at `ts`
+    """
+    return df_events.filter(col("userId") != '') \
+        .selectExpr("cast(userId as int) user_id",
+                    "ts as valid_from",
+                    "firstName as first_name",
+                    "lastName as last_name",
+                    "gender",
+                    "level")
+
+
+def build_users_table(change_points):
+    """
+    Type 2 users dimension: one row per user and version with its validity range [valid_from, valid_to) in
+    epoch millis, `valid_to` is null and `is_current` set for the current version.
+    A change point only starts a new version if the attributes differ from the preceding one, hence adding change
+    points that are already covered (e.g. the versions written by a previous run) does not change the result.
+    """
+    attributes = F.struct(*USER_ATTRIBUTES)
+    by_user = Window.partitionBy("user_id").orderBy("valid_from")
+
+    # several events of a user at the same millisecond: one deterministic winner
+    change_points = change_points \
+        .withColumn("_rank", F.row_number().over(
+            Window.partitionBy("user_id", "valid_from").orderBy(*[col(c).desc_nulls_last() for c in USER_ATTRIBUTES])
+        )) \
+        .filter(col("_rank") == 1)
+
+    versions = change_points \
+        .withColumn("_previous", F.lag(attributes).over(by_user)) \
+        .filter(col("_previous").isNull() | ~col("_previous").eqNullSafe(attributes))
+
+    return versions \
+        .withColumn("valid_to", F.lead("valid_from").over(by_user)) \
+        .select("user_id", *USER_ATTRIBUTES, "valid_from", "valid_to",
+                col("valid_to").isNull().alias("is_current"),
+                user_bucket().alias("user_bucket"))
+
+
+def merge_users(spark, change_points, output_data):
+    """
+    Merge the change points of this run into the existing users dimension. Only the buckets of the users that
+    show up in `change_points` are rebuilt (from their existing versions and the new change points),
+    which the writer then replaces; all other buckets stay untouched and are not even read.
+    """
+    output_users_data = table_path(output_data, "users")
+    # the existing versions must not be read from a table that is still half way through a commit
+    finish_pending_commit(spark, output_data, "users")
+    if not storage.exists(spark, output_users_data):
+        return build_users_table(change_points)
+
+    affected_buckets = [row.user_bucket for row in
+                        change_points.select(user_bucket().alias("user_bucket")).distinct().collect()]
+    existing_users = read_table(spark, output_data, "users",
+                                partitions=[f"user_bucket={bucket}" for bucket in affected_buckets])
+    if "valid_from" not in existing_users.columns:
+        raise ValueError(f"{output_users_data} has no validity ranges yet, run the job with --full-refresh once")
+
+    existing_points = existing_users.select("user_id", "valid_from", *USER_ATTRIBUTES)
+    # the writer stages the new files before the existing ones are replaced, so we can read them until then
+    return build_users_table(change_points.unionByName(existing_points))
@@ -0,0 +1,291 @@
+import math
+import uuid
+
+from pyspark import StorageLevel
+from pyspark.sql.types import StructType
+
+import storage
+from partition_manifest import write_partition_manifest
+from table_stats import collect_statistics, write_statistics
+from tables import TABLES, table_path
+from zone_maps import collect_zone_maps, write_zone_maps
+
+# parquet files of roughly this size keep both Athena scans and the glue crawler fast
+TARGET_FILE_BYTES = 128 * 1024 ** 2
+
+# spark estimates the in-memory size of a plan (or knows the size of cached data),
+# snappy compressed parquet is a lot smaller than that
+PARQUET_COMPRESSION_RATIO = 0.25
+
+# the size estimate of a plan spark knows nothing about (e.g. after an aggregation) is Long.MaxValue
+_UNKNOWN_SIZE = 2 ** 63 - 1
+
+
+def estimate_output_bytes(df):
+    """
+    Estimate the size of `df` once written as parquet, based on the statistics of the optimized plan.
+    For a plan that reads a materialized cache these are the actual bytes of the cached data.
+    Returns:
+        {int}: estimated bytes or None if spark could not come up with an estimate
+    """
+    size_in_bytes = df._jdf.queryExecution().optimizedPlan().stats().sizeInBytes()
+    # a scala BigInt, newer py4j versions convert it to a python int already
+    size_in_bytes = int(size_in_bytes if isinstance(size_in_bytes, int) else size_in_bytes.toString())
+    if size_in_bytes >= _UNKNOWN_SIZE:
+        return None
+    return int(size_in_bytes * PARQUET_COMPRESSION_RATIO)
+
+
+def plan_file_count(estimated_bytes, target_file_bytes=TARGET_FILE_BYTES):
+    if estimated_bytes is None:
+        return None
+    return max(1, math.ceil(estimated_bytes / target_file_bytes))
+
+
+def plan_records_per_file(row_count, estimated_bytes, target_file_bytes=TARGET_FILE_BYTES):
+    """rows that make up a file of about `target_file_bytes`, None if there is nothing to split by"""
+    if estimated_bytes is None or not row_count:
+        return None
+    return max(1, math.ceil(row_count * target_file_bytes / max(estimated_bytes, 1)))
+
+
+def _repartition(df, partition_by, num_files):
+    if num_files is None:
+        # without an estimate we at least make sure one task writes all files of a partition directory
+        return df.repartition(*partition_by) if partition_by else df
+
+    if partition_by:
+        # all rows of a partition end up in the same task, `maxRecordsPerFile` splits them into files
+        # of about the target size (see `parquet_writer`)
+        return df.repartition(num_files, *partition_by)
+
+    if num_files < df.rdd.getNumPartitions():
+        return df.coalesce(num_files)
+    return df.repartition(num_files)
+
+
+def _apply_layout(df, partition_by, num_files, layout):
+    """
+    Distribute and order the rows as `layout` asks for (see `tables.Layout`)
+    The clusters are ranges of `cluster_by` computed by spark from a sample, Athena does not know about spark's
+    own buckets (and they need a metastore table), but it skips files whose min/max statistics do not match.
+    """
+    if layout.cluster_by:
+        # the partition columns come first, so a range never spans more than a few partition directories
+        df = df.repartitionByRange(max(num_files or 1, layout.clusters), *partition_by, *layout.cluster_by)
+    else:
+        df = _repartition(df, partition_by, num_files)
+
+    if layout.sort_by:
+        # leading with the partition columns, the parquet writer keeps our order instead of sorting again;
+        # the clusters already separate the files, within a file the rows are ordered by `sort_by` alone
+        df = df.sortWithinPartitions(*partition_by, *layout.sort_by)
+    return df
+
+
+def parquet_writer(df, partition_by, layout, max_records_per_file=None):
+    """`DataFrameWriter` with the compression and encoding of `layout`, the options end up in the parquet writer"""
+    writer = df.write.mode('overwrite') \
+        .option("compression", layout.compression) \
+        .option("parquet.enable.dictionary", str(layout.dictionary).lower())
+    if max_records_per_file:
+        # a task rolls over to a new file after that many rows, also within a single partition directory
+        writer = writer.option("maxRecordsPerFile", str(max_records_per_file))
+    if layout.row_group_bytes:
+        writer = writer.option("parquet.block.size", str(layout.row_group_bytes))
+    if partition_by:
+        writer = writer.partitionBy(*partition_by)
+    return writer
+
+
+def _relative_directory(root, path):
+    """partition directory of a file relative to the table root, e.g. `year=2018/month=11` ("" if unpartitioned)"""
+    relative_path = path[len(root):].strip("/")
+    return relative_path.rsplit("/", 1)[0] if "/" in relative_path else ""
+
+
+def pending_commit_path(output_data, table):
+    """named like the glue table, e.g. `_staging/songplays_data.json`"""
+    return f"{output_data}_staging/{TABLES[table].location.strip('/')}.json"
+
+
+def _plan_commit(spark, staging_location, location, replace_all=False):
+    """
+    The files a commit moves from the staging area into the table and the files they replace.
+    Only partitions that are present in the staged data are replaced, unless `replace_all` is set.
+    Returns:
+        {dict}: staged files -> their destination, replaced files and the replaced partition directories
+    """
+    staging_root = storage.qualify(spark, staging_location)
+    table_root = storage.qualify(spark, location)
+    staged_files = storage.list_data_files(spark, staging_location)
+    existing_files = storage.list_data_files(spark, location)
+
+    partitions = sorted({_relative_directory(staging_root, path) for path in staged_files})
+    return {
+        "staging": staging_location,
+        "moves": {path: table_root + path[len(staging_root):] for path in sorted(staged_files)},
+        "replaced": sorted(
+            path for path in existing_files
+            if replace_all or _relative_directory(table_root, path) in partitions
+        ),
+        "partitions": partitions,
+    }
+
+
+def _finish_commit(spark, output_data, commit):
+    """
+    Carry out a commit recorded by `write_table`: move the staged files into the table, drop the files they replace
+    and merge the statistics, zone maps and partitions of the write into the bookkeeping of the table.
+    Every step can be repeated, a commit that was interrupted half way is finished by running it again, and two
+    steps may finish the same commit at once (e.g. a reader of the table next to the write).
+    """
+    table = commit["table"]
+    for source, destination in commit["moves"].items():
+        if not storage.exists(spark, source):
+            continue
+        if storage.exists(spark, destination):
+            # a move on S3 is a copy (of the whole object) followed by a delete, an interrupted one or the move of
+            # another finisher left the copy already; the names of staged files are unique to their write
+            storage.delete(spark, source, recursive=False)
+            continue
+        try:
+            storage.move(spark, source, destination)
+        except IOError:
+            if storage.exists(spark, source) or not storage.exists(spark, destination):
+                raise
+    for path in commit["replaced"]:
+        if storage.exists(spark, path):
+            storage.delete(spark, path, recursive=False)
+    storage.delete(spark, commit["staging"])
+
+    schema = StructType.fromJson(commit["schema"])
+    partitions = commit["partitions"]
+    write_statistics(spark, output_data, table, commit["statistics"], replace_all=commit["covers_table"])
+    write_zone_maps(spark, output_data, table, schema, commit["zone_maps"], partitions,
+                    replace_all=commit["covers_table"])
+    write_partition_manifest(spark, output_data, table, schema, partitions, replace_all=commit["replace_all"])
+    storage.delete(spark, pending_commit_path(output_data, table), recursive=False)
+    print(f"{table}: replaced {'all partitions' if commit['replace_all'] else 'partitions'} "
+          f"{partitions or ['(table)']}")
+    return partitions
+
+
+def finish_pending_commit(spark, output_data, table):
+    """
+    Finish the commit of an earlier write of `table` that did not get to the end (e.g. the step was killed),
+    a table must not keep the files of both sides of a commit
+    Returns:
+        {list}: the partition directories the pending commit replaced, None if there was none
+    """
+    commit = storage.read_json(spark, pending_commit_path(output_data, table))
+    if commit is None:
+        return None
+    print(f"{table}: finishing the pending commit of an earlier write")
+    return _finish_commit(spark, output_data, commit)
+
+
+def write_table(df, table, output_data, target_file_bytes=TARGET_FILE_BYTES, replace_all=False):
+    """
+    Write one of our output tables as parquet, sized to files of about `target_file_bytes` and laid out
+    (sorted, clustered, encoded) according to the layout of the table.
+    The data is written to a staging area first and afterwards replaces only the partitions
+    it contains, all other partitions of the table stay untouched.
+    The commit moves the new files into the table before it deletes the files they replace. In between, readers
+    listing a replaced partition see both, on S3 that window lasts as long as copying the new files takes.
+    The commit is recorded under `_staging/` beforehand, a write that is interrupted during its commit is
+    finished by the next write of the table (see `finish_pending_commit`).
+    Statistics of the written partitions (see `table_stats.py`) are kept in a sidecar next to the table,
+    the written files are indexed by their key ranges (see `zone_maps.py`)
+    and the partitions are recorded for their registration in glue (see `partition_manifest.py`).
+    Arguments:
+        df {DataFrame}: content of the table
+        table {str}: name of the table as registered in `tables.TABLES`
+        output_data {str}: location (local/s3) where the (root) output files should be written
+        target_file_bytes {int}: desired size of a single parquet file
+        replace_all {bool}: replace the whole table, also partitions that are not part of `df`
+    Returns:
+        {list}: the replaced partition directories
+    """
+    spec = TABLES[table]
+    location = table_path(output_data, table)
+    staging_location = f"{output_data}_staging/{uuid.uuid4().hex}/{spec.location}"
+    spark = df.sql_ctx.sparkSession
+    finish_pending_commit(spark, output_data, table)
+
+    # the plan estimate of joined or aggregated data is off by orders of magnitude, the size of the cached
+    # data is not; the cache also serves the write and the statistics (instead of reading the written files)
+    persist = not df.storageLevel.useMemory and not df.storageLevel.useDisk
+    if persist:
+        df = df.persist(StorageLevel.MEMORY_AND_DISK)
+    row_count = df.count()
+    # a fresh plan on the materialized cache, the plan of `df` may have computed its statistics before
+    estimated_bytes = estimate_output_bytes(df.select("*")) if row_count else 0
+    num_files = plan_file_count(estimated_bytes, target_file_bytes)
+    records_per_file = plan_records_per_file(row_count, estimated_bytes, target_file_bytes)
+    print(f"writing {table}: {row_count} rows, estimated {estimated_bytes} bytes -> "
+          f"{num_files or 'unknown number of'} files of {records_per_file or 'any number of'} rows")
+
+    parquet_writer(_apply_layout(df, spec.partition_by, num_files, spec.layout), spec.partition_by, spec.layout,
+                   max_records_per_file=records_per_file).parquet(staging_location)
+    statistics = collect_statistics(df, table)
+    if persist:
+        df.unpersist()
+
+    # the zone maps need the file names, hence they are computed from the staged files (only their key columns)
+    staged_files = list(storage.list_data_files(spark, staging_location))
+    zone_maps = collect_zone_maps(
+        spark.read.schema(df.schema).option("basePath", staging_location).parquet(*staged_files),
+        table, staging_location,
+    ) if staged_files else {}
+
+    commit = _plan_commit(spark, staging_location, location, replace_all=replace_all)
+    commit.update({
+        "table": table,
+        "replace_all": replace_all,
+        # the first write of a table covers all of it, just like a write that replaces all partitions,
+        # partial statistics and zone maps are marked as such
+        "covers_table": replace_all or not storage.exists(spark, location),
+        "schema": df.schema.jsonValue(),
+        "statistics": statistics,
+        "zone_maps": zone_maps,
+    })
+    # from here on the write is done, if the commit gets interrupted the next write of the table finishes it
+    storage.write_json(spark, pending_commit_path(output_data, table), commit)
+    return _finish_commit(spark, output_data, commit)
+
+
+def compact_table(spark, table, output_data, target_file_bytes=TARGET_FILE_BYTES, min_files=2):
+    """
+    Rewrite partitions of an existing table that consist of many small files into right sized files
+    Arguments:
+        spark {SparkSession}: active spark session
+        table {str}: name of the table as registered in `tables.TABLES`
+        output_data {str}: location (local/s3) where the (root) output files were written
+        target_file_bytes {int}: desired size of a single parquet file
+        min_files {int}: partitions with less files are left alone
+    Returns:
+        {dict}: file counts before and after the compaction
+    """
+    location = table_path(output_data, table)
+    finish_pending_commit(spark, output_data, table)
+    files = storage.list_data_files(spark, location)
+
+    directories = {}
+    for path, status in files.items():
+        directories.setdefault(path.rsplit("/", 1)[0], []).append(status["size"])
+
+    # a partition is worth compacting if it has several files that are smaller than what we aim for
+    candidates = sorted(
+        directory for directory, sizes in directories.items()
+        if len(sizes) >= min_files and sum(sizes) / len(sizes) < target_file_bytes / 2
+    )
+
+    if candidates:
+        # with `basePath` spark keeps the partition columns of the selected directories
+        df = spark.read.option("basePath", location).parquet(*candidates)
+        write_table(df, table, output_data, target_file_bytes=target_file_bytes)
+
+    files_after = len(storage.list_data_files(spark, location))
+    print(f"compacted {table}: {len(candidates)} partitions, {len(files)} -> {files_after} files")
+    return {"table": table, "partitions": len(candidates), "files_before": len(files), "files_after": files_after}
@@ -0,0 +1,182 @@
+from datetime import datetime
+from urllib.parse import unquote
+
+from pyspark.sql import functions as F
+from pyspark.sql.types import AtomicType, BinaryType, BooleanType, StructType
+
+import storage
+from table_stats import json_value
+from tables import TABLES, table_path
+
+
+def index_path(output_data, table):
+    """the index is named like the glue table, e.g. `_zone_maps/songplays_data.json`"""
+    return f"{output_data}_zone_maps/{TABLES[table].location.strip('/')}.json"
+
+
+def zone_map_columns(table):
+    """the columns readers filter on: the keys of the table and the columns its layout sorts/clusters by"""
+    spec = TABLES[table]
+    columns = []
+    for column in spec.keys + spec.layout.cluster_by + spec.layout.sort_by:
+        if column not in columns and column not in spec.partition_by:
+            columns.append(column)
+    return columns
+
+
+def collect_zone_maps(df_written, table, written_location):
+    """
+    Per file row count and null count, min and max of the zone map columns, plus the distinct count of the keys.
+    Only these columns of the files are read, which is a fraction of the write they belong to.
+    Arguments:
+        df_written {DataFrame}: the files that were written, read as parquet
+        written_location {str}: location the files were written to, the index keeps paths relative to it
+    Returns:
+        {dict}: file path relative to the table root -> zone map
+    """
+    spec = TABLES[table]
+    fields = {field.name: field for field in df_written.schema.fields}
+    columns = [column for column in zone_map_columns(table) if column in fields]
+    orderable = {
+        column for column in columns
+        if isinstance(fields[column].dataType, AtomicType)
+        and not isinstance(fields[column].dataType, (BinaryType, BooleanType))
+    }
+
+    aggregations = [F.count(F.lit(1)).alias("row_count")]
+    for column in columns:
+        aggregations.append(F.sum(F.col(column).isNull().cast("long")).alias(f"{column}__nulls"))
+        if column in orderable:
+            aggregations.append(F.min(column).alias(f"{column}__min"))
+            aggregations.append(F.max(column).alias(f"{column}__max"))
+        if column in spec.keys:
+            aggregations.append(F.countDistinct(column).alias(f"{column}__distinct"))
+
+    zone_maps = {}
+    rows = df_written.groupBy(F.input_file_name().alias("path")).agg(*aggregations).collect()
+    for row in rows:
+        zone_map = {}
+        for column in columns:
+            zone_map[column] = {"nulls": row[f"{column}__nulls"] or 0}
+            if column in orderable:
+                zone_map[column]["min"] = json_value(row[f"{column}__min"])
+                zone_map[column]["max"] = json_value(row[f"{column}__max"])
+            if column in spec.keys:
+                zone_map[column]["distinct"] = row[f"{column}__distinct"]
+        # `input_file_name` is an (url encoded) uri, its scheme/authority need not match `written_location`
+        relative_path = unquote(row.path).split(written_location.split("://", 1)[-1], 1)[1].strip("/")
+        zone_maps[relative_path] = {
+            "partition": relative_path.rsplit("/", 1)[0] if "/" in relative_path else "",
+            "row_count": row.row_count,
+            "columns": zone_map,
+        }
+    return zone_maps
+
+
+def covered_partitions(index):
+    """the partition directories an index describes, for indexes without the list the ones of their files"""
+    return set(index.get("partitions", [])) | {zone_map["partition"] for zone_map in index.get("files", {}).values()}
+
+
+def write_zone_maps(spark, output_data, table, schema, zone_maps, partitions, replace_all=False):
+    """
+    Replace the entries of the rewritten partitions (all of them with `replace_all`) in the index of the table.
+    The index records the partitions it describes: a partition is covered once a write replaced it, and the
+    index is `complete` if it was started by a write that covered the whole table. A table written without an
+    index (e.g. by the local engine, or before the index existed) hence gets an incomplete one, `read_table`
+    lists the partitions it does not cover.
+    Arguments:
+        schema {StructType}: schema of the table, lets readers skip the footer of the first file as well
+        zone_maps {dict}: as returned by `collect_zone_maps`
+        partitions {list}: partition directories the write replaced
+        replace_all {bool}: the write covers the whole table (it replaced all of it or the table had no data)
+    """
+    path = index_path(output_data, table)
+    index = {} if replace_all else storage.read_json(spark, path, default={})
+    files = {
+        name: zone_map for name, zone_map in index.get("files", {}).items()
+        if zone_map["partition"] not in partitions
+    }
+    files.update(zone_maps)
+
+    storage.write_json(spark, path, {
+        "table": table,
+        "updated_at": datetime.utcnow().isoformat(),
+        "complete": replace_all or index.get("complete", False),
+        "partitions": sorted(covered_partitions(index) | set(partitions)),
+        "columns": zone_map_columns(table),
+        "schema": schema.jsonValue(),
+        "files": files,
+    })
+
+
+def prune_files(index, partitions=None):
+    """
+    The files of the index that hold rows of the given partitions
+    Arguments:
+        index {dict}: zone map index of a table
+        partitions {list}: partition directories like `year=2018/month=11`, None for all of them
+    Returns:
+        {list}: relative paths of the files that have to be read
+    """
+    return sorted(
+        name for name, zone_map in index["files"].items() if partitions is None or zone_map["partition"] in partitions
+    )
+
+
+def _uncovered_paths(spark, location, index, partitions):
+    """
+    Paths of the table outside of the partitions an incomplete index covers, partition directories if
+    `partitions` are given and the data files found by listing the table otherwise
+    """
+    covered = covered_partitions(index)
+    if partitions is not None:
+        return [f"{location}{partition}" for partition in partitions
+                if partition not in covered and storage.exists(spark, f"{location}{partition}")]
+
+    root = storage.qualify(spark, location)
+    paths = []
+    for path in storage.list_data_files(spark, location):
+        relative_path = path[len(root):].strip("/")
+        if (relative_path.rsplit("/", 1)[0] if "/" in relative_path else "") not in covered:
+            paths.append(path)
+    return sorted(paths)
+
+
+def read_table(spark, output_data, table, partitions=None):
+    """
+    Read one of our output tables, only the files of the given partitions. With an index the files are picked
+    from it, so spark neither lists the table nor opens the footers of other files; without one (e.g. a table
+    of the local engine) the table is listed as usual, and so are the partitions an incomplete index does not cover.
+    A commit of the table that an earlier step did not finish is finished first, the index describes the table
+    as it is after the commit.
+    Arguments:
+        partitions {list}: partition directories like `year=2018/month=11`, None for all of them
+    """
+    # the writer indexes the files it writes, hence the import at runtime
+    from writer import finish_pending_commit
+    finish_pending_commit(spark, output_data, table)
+
+    location = table_path(output_data, table)
+    index = storage.read_json(spark, index_path(output_data, table))
+    if index is None:
+        if partitions is None:
+            return spark.read.parquet(location)
+        paths = [f"{location}{partition}" for partition in partitions
+                 if storage.exists(spark, f"{location}{partition}")]
+        if not paths:
+            return spark.read.parquet(location).limit(0)
+        return spark.read.option("basePath", location).parquet(*paths)
+
+    paths = [f"{location}{name}" for name in prune_files(index, partitions=partitions)]
+    print(f"{table}: reading {len(paths)} of {len(index['files'])} files according to the zone maps")
+    if not index.get("complete"):
+        uncovered = _uncovered_paths(spark, location, index, partitions)
+        print(f"{table}: reading {len(uncovered)} paths the zone maps do not cover")
+        paths += uncovered
+
+    schema = StructType.fromJson(index["schema"])
+    if not paths:
+        return spark.createDataFrame([], schema)
+    # `basePath` keeps the partition columns of the selected files
+    return spark.read.schema(schema).option("basePath", location).parquet(*paths)
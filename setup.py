@@ -25,9 +25,21 @@ setuptools.setup(
         "aws-cdk.aws_sns==1.32.2",
         "aws-cdk.aws_sns_subscriptions==1.32.2",
         "aws-cdk.aws_s3==1.32.2",
+        "aws-cdk.aws_s3_assets==1.32.2",
+        "aws-cdk.aws_stepfunctions==1.32.2",
+        "aws-cdk.aws_stepfunctions_tasks==1.32.2",
+        "aws-cdk.aws_glue==1.32.2",
+        "aws-cdk.aws_lambda==1.32.2",
     ],
 
-    python_requires=">=3.6",
+    extras_require={
+        # the single node engine of the pyspark job, see `pyspark/local_engine.py`
+        "local": ["pyarrow>=2.0", "pandas"],
+        # running the pyspark job (and its tests) outside of EMR
+        "spark": ["pyspark>=3.2"],
+    },
+
+    python_requires=">=3.7",
 
     classifiers=[
         "Development Status :: 4 - Beta",
@@ -38,7 +50,6 @@ setuptools.setup(
 
         "Programming Language :: JavaScript",
         "Programming Language :: Python :: 3 :: Only",
-        "Programming Language :: Python :: 3.6",
         "Programming Language :: Python :: 3.7",
         "Programming Language :: Python :: 3.8",
 
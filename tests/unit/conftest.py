@@ -0,0 +1,40 @@
+import os
+import sys
+
+import pytest
+
+AWS_DWH_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__)))), "aws_dwh")
+
+# the spark job and the lambdas import their modules flat, like they are deployed
+for directory in [
+    os.path.join(AWS_DWH_DIR, "pyspark"),
+    os.path.join(AWS_DWH_DIR, "lambdas", "quality_check"),
+    os.path.join(AWS_DWH_DIR, "lambdas", "register_partitions"),
+]:
+    if directory not in sys.path:
+        sys.path.insert(0, directory)
+
+
+@pytest.fixture(scope="session")
+def input_data():
+    """the sample data of the repository"""
+    return os.path.join(AWS_DWH_DIR, "data") + "/"
+
+
+@pytest.fixture(scope="session")
+def spark():
+    """a local spark session, the tests using it are skipped without pyspark or a java runtime"""
+    pyspark_sql = pytest.importorskip("pyspark.sql")
+    try:
+        session = pyspark_sql.SparkSession \
+            .builder \
+            .master("local[2]") \
+            .config("spark.sql.session.timeZone", "UTC") \
+            .config("spark.sql.shuffle.partitions", "4") \
+            .config("spark.ui.enabled", "false") \
+            .getOrCreate()
+    except Exception as e:
+        pytest.skip(f"no local spark session: {e}")
+    session.sparkContext.setLogLevel("ERROR")
+    yield session
+    session.stop()
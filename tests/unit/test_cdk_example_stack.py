@@ -0,0 +1,158 @@
+import pytest
+
+from aws_dwh import cluster_sizing
+
+GIB = cluster_sizing.GIB
+
+
+@pytest.fixture(scope="module")
+def definition():
+    pytest.importorskip("aws_cdk.aws_stepfunctions_tasks")
+    from aws_dwh.local_runner import definition_from_stack
+    return definition_from_stack()
+
+
+def _fleets(definition, size_class):
+    state = definition["States"][f"CreateCluster-{size_class}"]
+    return {fleet["InstanceFleetType"]: fleet for fleet in state["Parameters"]["Instances"]["InstanceFleets"]}
+
+
+@pytest.mark.parametrize("input_bytes, expected", [
+    (None, cluster_sizing.DEFAULT_SIZE_CLASS),
+    (0, "small"),
+    (5 * GIB, "small"),
+    (5 * GIB + 1, "medium"),
+    (100 * GIB, "medium"),
+    (100 * GIB + 1, "large"),
+    (10 * 1024 * GIB, "large"),
+])
+def test_size_class(input_bytes, expected):
+    assert cluster_sizing.size_class(input_bytes) == expected
+
+
+def test_get_size_class_unknown():
+    with pytest.raises(ValueError):
+        cluster_sizing.get_size_class("huge")
+
+
+def test_size_run():
+    def list_source_bytes():
+        return {"song_data": 4 * GIB, "log_data": 2 * GIB}
+
+    assert cluster_sizing.size_run({}, list_source_bytes) == {
+        "sizeClass": "medium", "inputBytes": 6 * GIB, "sourceBytes": {"song_data": 4 * GIB, "log_data": 2 * GIB},
+    }
+    # the steps need the size of their sources even if the size class is given
+    assert cluster_sizing.size_run({"sizeClass": "large"}, list_source_bytes)["sourceBytes"]["log_data"] == 2 * GIB
+    sizing = cluster_sizing.size_run({"sourceBytes": {"song_data": 1, "log_data": 2}}, lambda: pytest.fail("listed"))
+    assert sizing == {"sizeClass": "small", "inputBytes": 3, "sourceBytes": {"song_data": 1, "log_data": 2}}
+
+
+@pytest.mark.parametrize("event", [{"sizeClass": "huge"}, {"sourceBytes": {"song_data": 1}}])
+def test_size_run_invalid_input(event):
+    with pytest.raises(ValueError):
+        cluster_sizing.size_run(event, lambda: {"song_data": 1, "log_data": 2})
+
+
+def test_choice_branches_per_size_class(definition):
+    choice = definition["States"]["ChooseClusterSize"]
+    assert choice["Type"] == "Choice"
+    branches = {rule["StringEquals"]: rule["Next"] for rule in choice["Choices"]}
+    assert all(rule["Variable"] == "$.sizing.sizeClass" for rule in choice["Choices"])
+    assert branches == {size.name: f"CreateCluster-{size.name}" for size in cluster_sizing.SIZE_CLASSES}
+    assert choice["Default"] == f"CreateCluster-{cluster_sizing.DEFAULT_SIZE_CLASS}"
+    assert definition["States"]["SizeClusterLambda"]["Next"] == "ChooseClusterSize"
+
+
+@pytest.mark.parametrize("cluster_size", cluster_sizing.SIZE_CLASSES, ids=lambda size: size.name)
+def test_fleets_per_size_class(definition, cluster_size):
+    fleets = _fleets(definition, cluster_size.name)
+
+    master = fleets["MASTER"]
+    assert master["TargetOnDemandCapacity"] == 1
+    assert "TargetSpotCapacity" not in master
+    assert {config["WeightedCapacity"] for config in master["InstanceTypeConfigs"]} == {1}
+
+    core = fleets["CORE"]
+    assert core["TargetOnDemandCapacity"] == cluster_size.core_units
+    assert "TargetSpotCapacity" not in core
+
+    if cluster_size.task_spot_units:
+        task = fleets["TASK"]
+        assert task["TargetSpotCapacity"] == cluster_size.task_spot_units
+        assert task["LaunchSpecifications"]["SpotSpecification"]["TimeoutAction"] == "SWITCH_TO_ON_DEMAND"
+    else:
+        assert "TASK" not in fleets
+
+
+def test_create_cluster_tasks_continue_with_the_steps(definition):
+    for cluster_size in cluster_sizing.SIZE_CLASSES:
+        state = definition["States"][f"CreateCluster-{cluster_size.name}"]
+        assert state["Next"] == "StepConcurrencyLambda"
+        # the steps still need the sizing of the run
+        assert state["ResultPath"] == "$.cluster"
+        assert "OutputPath" not in state
+
+
+def test_clusters_run_spark_3(definition):
+    # the adaptive skew join settings of `session.PROFILES` and pinned python threads need spark 3.2 (emr 6.6)
+    from aws_dwh.emr_stack import EMR_RELEASE_LABEL
+    major, minor = (int(part) for part in EMR_RELEASE_LABEL[len("emr-"):].split(".")[:2])
+    assert (major, minor) >= (6, 6)
+    for cluster_size in cluster_sizing.SIZE_CLASSES:
+        state = definition["States"][f"CreateCluster-{cluster_size.name}"]
+        assert state["Parameters"]["ReleaseLabel"] == EMR_RELEASE_LABEL
+
+
+@pytest.mark.parametrize("tables, source", [
+    ("songs,artists", "song_data"), ("songplays", "log_data"), ("users", "log_data"), ("time", "log_data"),
+])
+def test_steps_get_the_size_of_their_source(definition, tables, source):
+    from aws_dwh.local_runner import resolve_parameters, spark_job_args
+
+    branches = definition["States"]["BuildTables"]["Branches"]
+    states = {name: state for branch in branches for name, state in branch["States"].items()}
+    step_name = "".join(table.capitalize() for table in tables.split(","))
+    step = states[f"RunSpark{step_name}"]
+    assert step["Parameters"]["Step"]["HadoopJarStep"]["Args.$"] == "$.stepArgs.args"
+
+    args_state = states[f"SparkArgs{step_name}"]
+    assert args_state["Next"] == f"RunSpark{step_name}"
+    assert args_state["ResultPath"] == "$.stepArgs"
+    sizing = {"sizeClass": "small", "inputBytes": 3, "sourceBytes": {"song_data": 1, "log_data": 2}}
+    args = resolve_parameters(args_state["Parameters"], {"sizing": sizing}, {"Execution": {"Name": "run-1"}})["args"]
+    assert args[:5] == ["spark-submit", "--deploy-mode", "cluster", "--master", "yarn"]
+    assert spark_job_args(args) == [
+        "--tables", tables, "--input-bytes", str(sizing["sourceBytes"][source]), "--run-id", "run-1",
+    ]
+
+
+def test_steps_of_a_run(definition, tmp_path):
+    from aws_dwh.local_runner import LocalExecution, LocalServices, spark_job_args
+
+    class Services(LocalServices):
+        def __init__(self):
+            super().__init__(str(tmp_path), str(tmp_path))
+            self.steps = {}
+
+        def add_step(self, parameters):
+            args = spark_job_args(parameters["Step"]["HadoopJarStep"]["Args"])
+            self.steps[args[1]] = (parameters["ClusterId"], args[2:])
+            return {}
+
+        def register_partitions(self, event):
+            return {}
+
+        def quality_check(self, event):
+            return {}
+
+    services = Services()
+    LocalExecution(definition, services).run({"sourceBytes": {"song_data": 10, "log_data": 20}}, name="run-1")
+    cluster_ids = {cluster_id for cluster_id, _ in services.steps.values()}
+    assert len(cluster_ids) == 1 and None not in cluster_ids
+    assert {tables: args for tables, (_, args) in services.steps.items()} == {
+        "songs,artists": ["--input-bytes", "10", "--run-id", "run-1"],
+        "songplays": ["--input-bytes", "20", "--run-id", "run-1"],
+        "users": ["--input-bytes", "20", "--run-id", "run-1"],
+        "time": ["--input-bytes", "20", "--run-id", "run-1"],
+    }
@@ -0,0 +1,60 @@
+import pytest
+
+pytest.importorskip("pyspark")
+pytest.importorskip("pyarrow")
+
+import storage  # noqa: E402
+from context import PipelineContext  # noqa: E402
+from example import LOG_DATA_TABLES, SONG_DATA_TABLES, SparkEngine  # noqa: E402
+from local_engine import LocalEngine  # noqa: E402
+from tables import TABLES, table_path  # noqa: E402
+
+ENGINE_TABLES = SONG_DATA_TABLES + LOG_DATA_TABLES
+
+
+@pytest.fixture(scope="module")
+def outputs(spark, input_data, tmp_path_factory):
+    """the tables of both engines, built from the sample data"""
+    local_output = f"{tmp_path_factory.mktemp('local')}/"
+    LocalEngine(input_data, local_output).run()
+    spark_output = f"{tmp_path_factory.mktemp('spark')}/"
+    SparkEngine(PipelineContext(spark, input_data, spark_output, full_refresh=True)).run()
+    return local_output, spark_output
+
+
+def _partition_directories(spark, output_data, table):
+    location = table_path(output_data, table)
+    root = storage.qualify(spark, location)
+    return sorted({
+        "/".join(path[len(root):].strip("/").split("/")[:-1]) for path in storage.list_data_files(spark, location)
+    })
+
+
+@pytest.mark.parametrize("table", ENGINE_TABLES)
+def test_schema(spark, outputs, table):
+    local_output, spark_output = outputs
+    local_df, spark_df = (spark.read.parquet(table_path(output, table)) for output in outputs)
+    assert [(field.name, field.dataType.simpleString()) for field in local_df.schema.fields] == \
+        [(field.name, field.dataType.simpleString()) for field in spark_df.schema.fields]
+
+
+@pytest.mark.parametrize("table", ENGINE_TABLES)
+def test_partitioning(spark, outputs, table):
+    local_output, spark_output = outputs
+    local_partitions = _partition_directories(spark, local_output, table)
+    assert local_partitions == _partition_directories(spark, spark_output, table)
+    if TABLES[table].partition_by:
+        assert all(
+            [part.split("=")[0] for part in directory.split("/")] == TABLES[table].partition_by
+            for directory in local_partitions
+        )
+
+
+@pytest.mark.parametrize("table", ENGINE_TABLES)
+def test_rows(spark, outputs, table):
+    local_df, spark_df = (spark.read.parquet(table_path(output, table)) for output in outputs)
+    columns = sorted(spark_df.columns)
+    local_rows = sorted((tuple(row) for row in local_df.select(*columns).collect()), key=repr)
+    spark_rows = sorted((tuple(row) for row in spark_df.select(*columns).collect()), key=repr)
+    assert local_rows
+    assert local_rows == spark_rows
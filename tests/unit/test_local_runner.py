@@ -0,0 +1,31 @@
+import pytest
+
+from aws_dwh.local_runner import resolve_parameters, resolve_value
+
+DATA = {"sizing": {"sourceBytes": {"log_data": 42}}, "tables": "time"}
+CONTEXT = {"Execution": {"Name": "run-1"}}
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("$.tables", "time"),
+    ("$$.Execution.Name", "run-1"),
+    ("States.Array('a', 'b,c', $.tables)", ["a", "b,c", "time"]),
+    ("States.Format('{}', $.sizing.sourceBytes.log_data)", "42"),
+    ("States.Format('{}-{}', $$.Execution.Name, 'it\\'s')", "run-1-it's"),
+    ("States.Array('--input-bytes', States.Format('{}', $.sizing.sourceBytes.log_data), 7)",
+     ["--input-bytes", "42", 7]),
+])
+def test_resolve_value(value, expected):
+    assert resolve_value(value, DATA, CONTEXT) == expected
+
+
+@pytest.mark.parametrize("value", ["States.Hash('a')", "States.Format('{}')", "States.Array('a') 'b'"])
+def test_unsupported_values(value):
+    with pytest.raises(ValueError):
+        resolve_value(value, DATA, CONTEXT)
+
+
+def test_resolve_parameters():
+    parameters = {"Step": {"Name": "static", "Args.$": "States.Array($$.Execution.Name)"}, "Tables.$": "$.tables"}
+    assert resolve_parameters(parameters, DATA, CONTEXT) == {"Step": {"Name": "static", "Args": ["run-1"]},
+                                                             "Tables": "time"}
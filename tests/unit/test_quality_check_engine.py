@@ -0,0 +1,135 @@
+import pytest
+
+import engine
+import rules
+from local_athena import LocalAthenaClient
+
+DATABASE = "dwh_udacity_capstone"
+OUTPUT_LOCATION = "s3://unused/"
+
+
+class SlowAthenaClient(LocalAthenaClient):
+    """reports every query as running for the first `running_polls` polls, like athena does"""
+
+    def __init__(self, database, running_polls):
+        super().__init__(database)
+        self.running_polls = running_polls
+        self.polls = {}
+        self.started = []
+
+    def start_query_execution(self, QueryString, QueryExecutionContext=None, ResultConfiguration=None):
+        self.started.append(QueryString)
+        return super().start_query_execution(QueryString, QueryExecutionContext, ResultConfiguration)
+
+    def get_query_execution(self, QueryExecutionId):
+        self.polls[QueryExecutionId] = self.polls.get(QueryExecutionId, 0) + 1
+        if self.polls[QueryExecutionId] <= self.running_polls:
+            return {"QueryExecution": {"QueryExecutionId": QueryExecutionId, "Status": {"State": "RUNNING"}}}
+        return super().get_query_execution(QueryExecutionId)
+
+
+def _load(client):
+    client.load_table("song_data", [
+        {"song_id": "S1", "title": "a"},
+        {"song_id": "S2", "title": None},
+        {"song_id": "S2", "title": "b"},
+    ])
+    client.load_table("users_data", [
+        {"user_id": 1, "level": "free", "valid_from": 1, "is_current": 0},
+        {"user_id": 1, "level": "paid", "valid_from": 2, "is_current": 1},
+        {"user_id": 2, "level": "free", "valid_from": 1, "is_current": 1},
+    ])
+    client.load_table("songplays_data", [
+        {"songplay_id": "P1", "song_id": "S1", "user_id": 1},
+        {"songplay_id": "P2", "song_id": "S9", "user_id": 3},
+        {"songplay_id": "P3", "song_id": None, "user_id": 2},
+    ])
+
+
+TEST_RULES = [
+    rules.not_null("song_data", "song_id"),
+    rules.not_null("song_data", "title"),
+    rules.unique("song_data", "song_id"),
+    rules.row_count_delta("song_data"),
+    rules.unique("users_data", "user_id", where="is_current"),
+    rules.row_count_delta("users_data"),
+    rules.references("songplays_data", "song_id", "song_data", "song_id"),
+    rules.references("songplays_data", "user_id", "users_data", "user_id"),
+]
+
+
+def _by_rule(results):
+    return {result["rule"]: result for result in results}
+
+
+def test_compile_queries_folds_the_rules_of_a_table():
+    queries = engine.compile_queries(TEST_RULES, DATABASE)
+    assert [query.name for query in queries] == ["song_data", "users_data", "songplays_data_references"]
+
+    song_data = queries[0]
+    # row count plus not_null, not_null and unique, the row count delta needs no column of its own
+    assert list(song_data.columns.values()) == [None] + TEST_RULES[:3]
+    assert song_data.sql.count(f'FROM "{DATABASE}"."song_data"') == 1
+
+    references = queries[2]
+    assert "row_count" not in references.columns
+    assert list(references.columns.values()) == TEST_RULES[6:]
+
+
+def test_run_rules():
+    client = LocalAthenaClient(DATABASE)
+    _load(client)
+
+    results, row_counts = engine.run_rules(client, TEST_RULES, DATABASE, OUTPUT_LOCATION,
+                                           previous_row_counts={"song_data": 10, "users_data": 3},
+                                           sleep=lambda seconds: None)
+    results = _by_rule(results)
+
+    assert row_counts == {"song_data": 3, "users_data": 3}
+    assert results["song_data.song_id not null"]["passed"]
+    assert results["song_data.title not null"]["violations"] == 1
+    assert results["song_data.song_id unique"]["violations"] == 1
+    # only the current version of a user counts
+    assert results["users_data.user_id unique where is_current"]["passed"]
+    assert results["songplays_data.song_id references song_data.song_id"]["violations"] == 1
+    assert results["songplays_data.user_id references users_data.user_id"]["violations"] == 1
+    assert not results["song_data row count delta"]["passed"]
+    assert results["users_data row count delta"]["passed"]
+
+
+def test_run_rules_without_previous_row_counts_passes_the_deltas():
+    client = LocalAthenaClient(DATABASE)
+    _load(client)
+    results, _ = engine.run_rules(client, TEST_RULES, DATABASE, OUTPUT_LOCATION, sleep=lambda seconds: None)
+    assert all(result["passed"] for result in results if result["kind"] == "row_count_delta")
+
+
+def test_run_queries_starts_all_queries_and_backs_off():
+    client = SlowAthenaClient(DATABASE, running_polls=5)
+    _load(client)
+    queries = engine.compile_queries(TEST_RULES, DATABASE)
+    waits = []
+
+    results = engine.run_queries(client, queries, DATABASE, OUTPUT_LOCATION, sleep=waits.append)
+
+    assert len(client.started) == len(queries)
+    assert sorted(results) == sorted(query.name for query in queries)
+    assert waits == [0.5, 1.0, 2.0, 4.0, 5.0]
+
+
+def test_run_queries_times_out():
+    client = SlowAthenaClient(DATABASE, running_polls=1000)
+    _load(client)
+    queries = engine.compile_queries(TEST_RULES, DATABASE)
+    waits = []
+
+    with pytest.raises(engine.QueryFailed, match="did not finish"):
+        engine.run_queries(client, queries, DATABASE, OUTPUT_LOCATION, timeout=20, sleep=waits.append)
+    assert sum(waits) >= 20
+
+
+def test_run_rules_fails_on_a_failed_query():
+    client = LocalAthenaClient(DATABASE)
+    # no tables, every query fails
+    with pytest.raises(engine.QueryFailed, match="FAILED"):
+        engine.run_rules(client, TEST_RULES, DATABASE, OUTPUT_LOCATION, sleep=lambda seconds: None)
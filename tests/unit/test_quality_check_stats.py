@@ -0,0 +1,95 @@
+import io
+import json
+
+import rules
+from stats import ZONE_MAPS_PREFIX, evaluate_with_stats, load_sidecars
+
+
+class FakeS3:
+    class exceptions:
+        class NoSuchKey(Exception):
+            pass
+
+    def __init__(self, objects):
+        self.objects = objects
+
+    def get_object(self, Bucket, Key):
+        if Key not in self.objects:
+            raise self.exceptions.NoSuchKey(Key)
+        return {"Body": io.BytesIO(json.dumps(self.objects[Key]).encode("utf-8"))}
+
+
+def _sidecar(partitions, partition_by=(), complete=True):
+    return {"complete": complete, "partition_by": list(partition_by), "keys": ["artist_id"], "partitions": partitions}
+
+
+ARTISTS = _sidecar({
+    "": {"row_count": 3, "columns": {"artist_id": {"nulls": 0, "min": "A1", "max": "A3", "distinct": 3},
+                                     "name": {"nulls": 1, "min": "a", "max": "b"}}},
+})
+
+
+def test_load_sidecars_skips_missing_and_incomplete_sidecars():
+    s3 = FakeS3({
+        "_stats/artist_data.json": ARTISTS,
+        # e.g. merged into after the local engine dropped the sidecar
+        "_stats/song_data.json": _sidecar({}, complete=False),
+        "_stats/users_data.json": {key: value for key, value in ARTISTS.items() if key != "complete"},
+    })
+    sidecars = load_sidecars(s3, "bucket", ["artist_data", "song_data", "users_data", "time_data"])
+    assert list(sidecars) == ["artist_data"]
+
+
+def test_load_zone_maps():
+    s3 = FakeS3({f"{ZONE_MAPS_PREFIX}artist_data.json": {"complete": True, "files": {}}})
+    assert list(load_sidecars(s3, "bucket", ["artist_data"], prefix=ZONE_MAPS_PREFIX)) == ["artist_data"]
+
+
+def test_evaluate_with_stats():
+    test_rules = [
+        rules.not_null("artist_data", "artist_id"),
+        rules.not_null("artist_data", "name"),
+        rules.unique("artist_data", "artist_id"),
+        rules.row_count_delta("artist_data"),
+        rules.not_null("song_data", "song_id"),
+        rules.row_count_delta("song_data"),
+    ]
+    results, remaining, row_counts = evaluate_with_stats(test_rules, {"artist_data": ARTISTS})
+
+    assert {result["rule"]: result["violations"] for result in results} == {
+        "artist_data.artist_id not null": 0,
+        "artist_data.name not null": 1,
+        "artist_data.artist_id unique": 0,
+    }
+    assert remaining == test_rules[4:]
+    assert row_counts == {"artist_data": 3}
+
+
+def test_unique_of_a_partitioned_table_by_zone_maps():
+    sidecar = _sidecar({
+        "year=2018": {"row_count": 2, "columns": {"artist_id": {"nulls": 0, "distinct": 2}}},
+        "year=2019": {"row_count": 2, "columns": {"artist_id": {"nulls": 0, "distinct": 2}}},
+    }, partition_by=["year"])
+
+    def _index(ranges):
+        return {"complete": True, "files": {
+            f"year={year}/part-0.parquet": {"partition": f"year={year}", "row_count": 2, "columns": {
+                "artist_id": {"nulls": 0, "min": low, "max": high, "distinct": 2}}}
+            for year, (low, high) in ranges.items()
+        }}
+
+    rule = rules.unique("artist_data", "artist_id")
+    # distinct counts of partitions can not be added up
+    results, remaining, _ = evaluate_with_stats([rule], {"artist_data": sidecar})
+    assert remaining == [rule]
+
+    results, remaining, _ = evaluate_with_stats(
+        [rule], {"artist_data": sidecar}, zone_maps={"artist_data": _index({2018: ("A1", "A2"), 2019: ("A3", "A4")})}
+    )
+    assert remaining == [] and results[0]["passed"]
+
+    # overlapping key ranges need athena
+    results, remaining, _ = evaluate_with_stats(
+        [rule], {"artist_data": sidecar}, zone_maps={"artist_data": _index({2018: ("A1", "A3"), 2019: ("A3", "A4")})}
+    )
+    assert remaining == [rule]
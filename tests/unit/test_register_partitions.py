@@ -0,0 +1,120 @@
+import registration
+from local_glue import LocalGlueClient
+
+DATABASE = "dwh_udacity_capstone"
+COLUMNS = [("songplay_id", "string"), ("start_time", "bigint")]
+PARTITION_KEYS = ["year", "month"]
+LOCATION = "s3://bucket/songplays_data/"
+
+
+def _manifest(partitions, columns=COLUMNS, partition_keys=PARTITION_KEYS, replace_all=False):
+    return {
+        "table": "songplays_data",
+        "columns": [{"Name": name, "Type": type_} for name, type_ in columns],
+        "partition_keys": [{"Name": name, "Type": "int"} for name in partition_keys],
+        "partitions": [list(values) for values in partitions],
+        "replace_all": replace_all,
+    }
+
+
+def _months(count, first_year=2000):
+    return [(str(first_year + month // 12), str(month % 12 + 1)) for month in range(count)]
+
+
+class RecordingGlueClient(LocalGlueClient):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.create_batches = []
+        self.delete_batches = []
+
+    def batch_create_partition(self, DatabaseName, TableName, PartitionInputList):
+        self.create_batches.append(len(PartitionInputList))
+        return super().batch_create_partition(DatabaseName, TableName, PartitionInputList)
+
+    def batch_delete_partition(self, DatabaseName, TableName, PartitionsToDelete):
+        self.delete_batches.append(len(PartitionsToDelete))
+        return super().batch_delete_partition(DatabaseName, TableName, PartitionsToDelete)
+
+
+def _client():
+    client = RecordingGlueClient(DATABASE)
+    client.create_table("songplays_data", COLUMNS, PARTITION_KEYS, LOCATION)
+    return client
+
+
+def test_partitions_are_created_in_batches():
+    client = _client()
+    result = registration.register_partitions(client, DATABASE, "crawler", [_manifest(_months(250))],
+                                              sleep=lambda seconds: None)
+
+    assert result == {"crawled": [], "registered": {"songplays_data": {"created": 250, "deleted": 0}}}
+    assert client.create_batches == [100, 100, 50]
+    assert len(client.partitions["songplays_data"]) == 250
+    assert client.crawls == 0
+    partition = client.partitions["songplays_data"][("2000", "1")]
+    assert partition["StorageDescriptor"]["Location"] == f"{LOCATION}year=2000/month=1/"
+
+
+def test_existing_partitions_are_not_counted():
+    client = _client()
+    registration.register_partitions(client, DATABASE, "crawler", [_manifest(_months(3))])
+    result = registration.register_partitions(client, DATABASE, "crawler", [_manifest(_months(5))])
+    assert result["registered"]["songplays_data"] == {"created": 2, "deleted": 0}
+
+
+def test_replace_all_deletes_stale_partitions():
+    client = _client()
+    registration.register_partitions(client, DATABASE, "crawler", [_manifest(_months(60))])
+
+    result = registration.register_partitions(
+        client, DATABASE, "crawler", [_manifest(_months(60)[30:], replace_all=True)]
+    )
+
+    assert result["registered"]["songplays_data"] == {"created": 0, "deleted": 30}
+    assert client.delete_batches == [25, 5]
+    assert sorted(client.partitions["songplays_data"]) == sorted(_months(60)[30:])
+
+
+def test_incremental_manifest_keeps_other_partitions():
+    client = _client()
+    registration.register_partitions(client, DATABASE, "crawler", [_manifest(_months(10))])
+    registration.register_partitions(client, DATABASE, "crawler", [_manifest(_months(10)[:1])])
+    assert client.delete_batches == []
+    assert len(client.partitions["songplays_data"]) == 10
+
+
+def test_crawler_runs_when_the_schema_changed():
+    new_columns = COLUMNS + [("session_id", "int")]
+    client = RecordingGlueClient(DATABASE, crawl_result=[("songplays_data", new_columns, PARTITION_KEYS, LOCATION)])
+    client.create_table("songplays_data", COLUMNS, PARTITION_KEYS, LOCATION)
+    waits = []
+
+    result = registration.register_partitions(client, DATABASE, "crawler",
+                                              [_manifest(_months(3), columns=new_columns)], sleep=waits.append)
+
+    # the crawler registers the partitions of the tables it crawled itself
+    assert result == {"crawled": ["songplays_data"], "registered": {}}
+    assert client.crawls == 1
+    assert client.create_batches == []
+
+    # afterwards the catalog matches the manifest again
+    result = registration.register_partitions(client, DATABASE, "crawler",
+                                              [_manifest(_months(3), columns=new_columns)])
+    assert result["crawled"] == []
+    assert client.crawls == 1
+
+
+def test_crawler_runs_for_a_new_table():
+    client = RecordingGlueClient(DATABASE, crawl_result=[("songplays_data", COLUMNS, PARTITION_KEYS, LOCATION)])
+    result = registration.register_partitions(client, DATABASE, "crawler", [_manifest(_months(3))])
+    assert result["crawled"] == ["songplays_data"]
+    assert client.crawls == 1
+
+
+def test_schema_changed():
+    client = _client()
+    table = client.tables["songplays_data"]
+    assert not registration.schema_changed(table, _manifest([]))
+    assert registration.schema_changed(table, _manifest([], columns=COLUMNS[:1]))
+    assert registration.schema_changed(table, _manifest([], partition_keys=["year"]))
+    assert registration.schema_changed(None, _manifest([]))
@@ -0,0 +1,43 @@
+import os
+import sys
+
+import pytest
+
+pytest.importorskip("pyspark")
+
+from example import choose_engine, input_sources, parse_args  # noqa: E402
+from session import estimate_input_bytes  # noqa: E402
+
+
+@pytest.mark.parametrize("stage, tables, song_source, expected", [
+    ("etl", None, "json", ["song_data/", "log_data/"]),
+    ("etl", ["songs"], "json", ["song_data/"]),
+    ("etl", ["songs", "artists"], "catalog", []),
+    ("etl", ["songplays"], "json", ["log_data/"]),
+    ("etl", ["artists", "time"], "json", ["song_data/", "log_data/"]),
+    ("song-catalog", None, "json", ["song_data/"]),
+    ("stream", None, "json", ["log_data/"]),
+    ("compact", None, "json", []),
+    ("calendar", None, "json", []),
+])
+def test_input_sources(stage, tables, song_source, expected):
+    assert input_sources(stage, tables, song_source) == expected
+
+
+def _size(directory):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, _, names in os.walk(directory) for name in names)
+
+
+def test_estimate_input_bytes_of_the_sources(spark, input_data):
+    song_bytes = _size(f"{input_data}song_data")
+    log_bytes = _size(f"{input_data}log_data")
+    assert estimate_input_bytes(spark, input_data, ["song_data/"]) == song_bytes
+    assert estimate_input_bytes(spark, input_data) == song_bytes + log_bytes
+    assert estimate_input_bytes(spark, input_data, []) == 0
+
+
+def test_the_spark_engine_is_the_default(monkeypatch, input_data):
+    # the local engine does not keep the manifests, marts, statistics and zone maps up to date
+    monkeypatch.setattr(sys, "argv", ["example.py"])
+    assert parse_args().engine == "spark"
+    assert choose_engine("spark", input_data) == "spark"
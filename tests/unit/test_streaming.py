@@ -0,0 +1,60 @@
+import json
+
+import pytest
+
+pytest.importorskip("pyspark")
+
+from context import PipelineContext  # noqa: E402
+from streaming import STREAM_LOCATION, process_log_stream  # noqa: E402
+from writer import write_table  # noqa: E402
+
+# 2018-11-01 and 2018-11-02
+FIRST_DAY = 1541030400000
+SECOND_DAY = FIRST_DAY + 24 * 3600 * 1000
+
+
+def _event(user_id, item_in_session, ts, song="Intro", artist="The XX", length=128.4, page="NextSong"):
+    return {"artist": artist, "auth": "Logged In", "firstName": "Walter", "gender": "M",
+            "itemInSession": item_in_session, "lastName": "Frye", "length": length, "level": "free",
+            "location": "San Francisco-Oakland-Hayward, CA", "method": "PUT", "page": page,
+            "registration": 1540919166796.0, "sessionId": 38, "song": song, "status": 200, "ts": ts,
+            "userAgent": "Mozilla/5.0", "userId": str(user_id)}
+
+
+def _write_log_file(input_data, name, events):
+    directory = input_data / "log_data" / "2018" / "11"
+    directory.mkdir(parents=True, exist_ok=True)
+    with open(directory / name, "w") as log_file:
+        log_file.write("\n".join(json.dumps(event) for event in events))
+
+
+def _songplays(spark, output_data):
+    rows = spark.read.parquet(f"{output_data}{STREAM_LOCATION}").select("user_id", "song_id", "start_time").collect()
+    return sorted(tuple(row) for row in rows)
+
+
+def test_trigger_once_appends_the_songplays_of_new_log_files(spark, tmp_path):
+    input_data = tmp_path / "input"
+    output_data = f"{tmp_path}/output/"
+    write_table(spark.createDataFrame([("SO1", "Intro", "AR1", 128.0, 2009)],
+                                      "song_id string, title string, artist_id string, duration double, year int"),
+                "songs", output_data)
+    write_table(spark.createDataFrame([("AR1", "The XX", "London", None, None)],
+                                      "artist_id string, name string, location string, latitude double, "
+                                      "longitude double"),
+                "artists", output_data)
+    context = PipelineContext(spark, f"{input_data}/", output_data)
+
+    _write_log_file(input_data, "2018-11-01-events.json", [
+        _event(1, 0, FIRST_DAY),
+        # neither a song that is played nor one that is known
+        _event(1, 1, FIRST_DAY + 1000, page="Home"),
+        _event(2, 0, FIRST_DAY + 2000, song="Unknown"),
+    ])
+    process_log_stream(context, trigger_once=True)
+    assert _songplays(spark, output_data) == [(1, "SO1", FIRST_DAY)]
+
+    # the next run only picks up the new file, the processed one is in the checkpoint
+    _write_log_file(input_data, "2018-11-02-events.json", [_event(3, 0, SECOND_DAY)])
+    process_log_stream(context, trigger_once=True)
+    assert _songplays(spark, output_data) == [(1, "SO1", FIRST_DAY), (3, "SO1", SECOND_DAY)]
@@ -0,0 +1,108 @@
+import pytest
+
+pytest.importorskip("pyspark")
+
+from keys import SONGPLAY_KEY_COLUMNS, hash_key, hash_key_value  # noqa: E402
+from lookup import build_song_lookup  # noqa: E402
+from songplays_fact import build_songplays_table, match_songs  # noqa: E402
+from tables import table_path  # noqa: E402
+from users_dimension import build_users_table, merge_users  # noqa: E402
+from writer import write_table  # noqa: E402
+
+LOG_SCHEMA = "userId string, sessionId long, itemInSession long, ts long, firstName string, lastName string, " \
+             "gender string, level string, song string, artist string, length double, location string, " \
+             "userAgent string"
+
+USER_POINTS_SCHEMA = "user_id int, valid_from long, first_name string, last_name string, gender string, level string"
+
+
+def _event(user_id, session_id, item, ts, level="free", song="Song A"):
+    return (user_id, session_id, item, ts, "Ann", "Lee", "F", level, song, "Artist A", 200.0, "Town", "agent")
+
+
+@pytest.fixture
+def song_lookup(spark):
+    songs = spark.createDataFrame([("S1", "Song A", "AR1", 2000, 200.0), ("S2", "Song B", "AR1", 2001, 180.0)],
+                                  "song_id string, title string, artist_id string, year int, duration double")
+    artists = spark.createDataFrame([("AR1", "Artist A", "Town", None, None)],
+                                    "artist_id string, name string, location string, latitude string, "
+                                    "longitude string")
+    return build_song_lookup(songs, artists)
+
+
+def _songplay_ids(df_log, song_lookup):
+    songplays = build_songplays_table(match_songs(df_log, song_lookup))
+    return {(row.user_id, row.session_id, row.start_time): row.songplay_id for row in songplays.collect()}
+
+
+def test_hash_key_matches_hash_key_value(spark):
+    rows = [("7", 1, 0, 1541903636796), ("7", 1, 1, None), (None, 2, 3, 1541903636796)]
+    df = spark.createDataFrame(rows, "userId string, sessionId long, itemInSession long, ts long")
+    keys = [row.key for row in df.select(hash_key(*SONGPLAY_KEY_COLUMNS).alias("key")).collect()]
+    assert keys == [hash_key_value(*row) for row in rows]
+    assert all(0 < key < 2 ** 63 for key in keys)
+
+
+def test_songplay_ids_of_a_rerun(spark, song_lookup):
+    events = [_event("7", 1, item, 1541903636796 + item * 1000) for item in range(20)] + \
+             [_event("8", 2, 0, 1541903636796), _event("8", 2, 1, 1541903637796, song="Unknown")]
+    df_log = spark.createDataFrame(events, LOG_SCHEMA)
+
+    ids = _songplay_ids(df_log, song_lookup)
+    assert len(ids) == 21 and len(set(ids.values())) == 21
+
+    # a rerun reads the events in another order and from other partitions
+    rerun = spark.createDataFrame(list(reversed(events)), LOG_SCHEMA).repartition(3)
+    assert _songplay_ids(rerun, song_lookup) == ids
+    # the local engine derives the same ids
+    assert ids[(7, 1, 1541903636796)] == hash_key_value("7", 1, 0, 1541903636796)
+
+
+def _users(df):
+    return sorted(tuple(row) for row in df.select("user_id", "valid_from", "valid_to", "first_name", "last_name",
+                                                  "gender", "level", "is_current", "user_bucket").collect())
+
+
+def test_build_users_table_from_its_own_versions(spark):
+    points = spark.createDataFrame([
+        (7, 1000, "Ann", "Lee", "F", "free"),
+        (7, 2000, "Ann", "Lee", "F", "free"),
+        (7, 3000, "Ann", "Lee", "F", "paid"),
+        (7, 4000, "Ann", "Lee", "F", "paid"),
+        (8, 1500, "Bob", "Ray", "M", "free"),
+    ], USER_POINTS_SCHEMA)
+    users = build_users_table(points)
+    assert _users(users) == [
+        (7, 1000, 3000, "Ann", "Lee", "F", "free", False, 7),
+        (7, 3000, None, "Ann", "Lee", "F", "paid", True, 7),
+        (8, 1500, None, "Bob", "Ray", "M", "free", True, 8),
+    ]
+
+    # the versions of a previous run together with the same events again
+    existing_points = users.select("user_id", "valid_from", "first_name", "last_name", "gender", "level")
+    assert _users(build_users_table(points.unionByName(existing_points))) == _users(users)
+
+
+def test_merge_the_same_events_twice(spark, tmp_path):
+    output_data = f"{tmp_path}/"
+    points = spark.createDataFrame([
+        (7, 1000, "Ann", "Lee", "F", "free"),
+        (7, 3000, "Ann", "Lee", "F", "paid"),
+        (23, 1500, "Bob", "Ray", "M", "free"),
+    ], USER_POINTS_SCHEMA)
+
+    write_table(merge_users(spark, points, output_data), "users", output_data)
+    first = _users(spark.read.parquet(table_path(output_data, "users")))
+
+    write_table(merge_users(spark, points, output_data), "users", output_data)
+    assert _users(spark.read.parquet(table_path(output_data, "users"))) == first
+
+    # a later change of one user closes its current version, the other users stay as they are
+    later = spark.createDataFrame([(7, 5000, "Ann", "Lee", "F", "free")], USER_POINTS_SCHEMA)
+    write_table(merge_users(spark, later, output_data), "users", output_data)
+    assert _users(spark.read.parquet(table_path(output_data, "users"))) == [
+        (7, 1000, 3000, "Ann", "Lee", "F", "free", False, 7),
+        (7, 3000, 5000, "Ann", "Lee", "F", "paid", False, 7),
+        (7, 5000, None, "Ann", "Lee", "F", "free", True, 7),
+        (23, 1500, None, "Bob", "Ray", "M", "free", True, 7),
+    ]
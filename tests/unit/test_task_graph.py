@@ -0,0 +1,140 @@
+import threading
+
+import pytest
+
+import storage
+from metrics import RunReport, report_path
+from task_graph import Task, pinned_threads, run_tasks
+
+
+class FakeSparkContext:
+    """local properties per thread, like spark keeps them"""
+
+    def __init__(self):
+        self._local = threading.local()
+
+    def _properties(self):
+        if not hasattr(self._local, "properties"):
+            self._local.properties = {}
+        return self._local.properties
+
+    def setLocalProperty(self, key, value):
+        if value is None:
+            self._properties().pop(key, None)
+        else:
+            self._properties()[key] = value
+
+    def getLocalProperty(self, key):
+        return self._properties().get(key)
+
+    def setJobGroup(self, group_id, description):
+        self.setLocalProperty("spark.jobGroup.id", group_id)
+
+
+class FakeSpark:
+    def __init__(self):
+        self.sparkContext = FakeSparkContext()
+
+
+def test_tasks_run_after_their_dependencies():
+    spark = FakeSpark()
+    finished = []
+    properties = {}
+
+    def task(name):
+        def run():
+            properties[name] = (spark.sparkContext.getLocalProperty("spark.scheduler.pool"),
+                                spark.sparkContext.getLocalProperty("spark.jobGroup.id"))
+            finished.append(name)
+        return run
+
+    spark.sparkContext.setLocalProperty("spark.jobGroup.id", "benchmark")
+    timings = run_tasks(spark, [
+        Task("songplays", task("songplays"), depends_on=["songs", "artists"]),
+        Task("songs", task("songs")),
+        Task("artists", task("artists")),
+        Task("time", task("time"), depends_on=["not_part_of_the_run"]),
+    ])
+
+    assert sorted(timings) == ["artists", "songplays", "songs", "time"]
+    assert finished.index("songplays") > max(finished.index("songs"), finished.index("artists"))
+    # every task runs in its own scheduler pool and in the job group of the caller
+    assert properties == {name: (name, "benchmark") for name in timings}
+
+
+def test_cyclic_dependencies():
+    with pytest.raises(ValueError, match="cyclic"):
+        run_tasks(FakeSpark(), [Task("a", lambda: None, depends_on=["b"]), Task("b", lambda: None, depends_on=["a"])])
+
+
+def test_a_failing_task_fails_the_run():
+    def fail():
+        raise RuntimeError("write failed")
+
+    started = []
+    with pytest.raises(RuntimeError, match="write failed"):
+        run_tasks(FakeSpark(), [Task("a", fail), Task("b", lambda: started.append("b"), depends_on=["a"])])
+    assert started == []
+
+
+def test_jobs_of_the_tasks_are_part_of_the_job_group(spark):
+    spark.sparkContext.setJobGroup("task_graph_test", "jobs of the task graph test")
+    try:
+        run_tasks(spark, [
+            Task(name, lambda: spark.range(1000).repartition(4).count()) for name in ["first", "second"]
+        ])
+    finally:
+        spark.sparkContext.setLocalProperty("spark.jobGroup.id", None)
+
+    # `metrics.job_group_metrics` collects the metrics of a benchmark stage by these jobs
+    assert len(spark.sparkContext.statusTracker().getJobIdsForGroup("task_graph_test")) >= 2
+
+
+def test_unpinned_threads_are_reported(capsys):
+    run_tasks(FakeSpark(), [Task("a", lambda: None)])
+    assert "best-effort" in capsys.readouterr().out
+
+
+def test_spark_pins_the_threads_of_the_pool(spark):
+    assert pinned_threads(spark)
+
+
+def test_stages_of_the_tasks_are_their_job_groups(spark, tmp_path):
+    report = RunReport(spark, f"{tmp_path}/")
+
+    def count(name):
+        def run():
+            with report.stage(name, "transform"):
+                spark.range(1000).repartition(4).count()
+        return run
+
+    run_tasks(spark, [Task(name, count(name)) for name in ["first", "second"]])
+    # `metrics.job_group_metrics` aggregates the jobs of the group of a stage, i.e. exactly the jobs of its thread
+    tracker = spark.sparkContext.statusTracker()
+    for name in ["first", "second"]:
+        job_ids = tracker.getJobIdsForGroup(f"{report.run_id}:{name}")
+        assert job_ids
+        assert all(tracker.getJobInfo(job_id).status == "SUCCEEDED" for job_id in job_ids)
+
+
+def test_stages_of_unpinned_threads_only_report_their_duration(capsys):
+    report = RunReport(FakeSpark(), "unused/", run_id="run")
+
+    def stage():
+        with report.stage("write_songs", "write"):
+            pass
+
+    run_tasks(report.spark, [Task("songs", stage)])
+    assert list(report.stages[0]) == ["name", "kind", "duration_seconds"]
+    assert "not collecting metrics of stage write_songs" in capsys.readouterr().out
+
+
+def test_concurrent_steps_of_a_run_write_their_own_part(spark, tmp_path):
+    output_data = f"{tmp_path}/"
+    for part in ["songs-artists", "users"]:
+        RunReport(spark, output_data, run_id="run-1", part=part).save()
+
+    assert sorted(path.name for path in (tmp_path / "_reports" / "run-1").glob("*.json")) == [
+        "songs-artists.json", "users.json",
+    ]
+    assert storage.read_json(spark, report_path(output_data, "run-1", "users"))["part"] == "users"
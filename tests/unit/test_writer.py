@@ -0,0 +1,185 @@
+import shutil
+
+import pytest
+
+pytest.importorskip("pyspark")
+
+from pyspark.sql import functions as F  # noqa: E402
+
+import storage  # noqa: E402
+import writer  # noqa: E402
+from table_stats import stats_path  # noqa: E402
+from tables import table_path  # noqa: E402
+from writer import (  # noqa: E402
+    TARGET_FILE_BYTES, compact_table, finish_pending_commit, pending_commit_path, plan_file_count, plan_records_per_file,
+    write_table,
+)
+from zone_maps import read_table  # noqa: E402
+
+
+def test_plan_records_per_file():
+    assert plan_records_per_file(1000, 10 * 1024, target_file_bytes=1024) == 100
+    assert plan_records_per_file(1000, 512, target_file_bytes=1024) == 2000
+    assert plan_records_per_file(10, 10 ** 9, target_file_bytes=1024) == 1
+    assert plan_records_per_file(0, 0) is None
+    assert plan_records_per_file(1000, None) is None
+    assert plan_file_count(None) is None
+    assert plan_file_count(0) == 1
+
+
+def _time_table(spark, rows):
+    # a minute apart from 2018-11-01 on, all in the same month
+    start_time = (F.col("id") * 60 + 1541030400).cast("timestamp")
+    return spark.range(rows).select(start_time.alias("start_time")).select(
+        "start_time",
+        F.hour("start_time").alias("hour"),
+        F.dayofmonth("start_time").alias("day"),
+        F.weekofyear("start_time").alias("week"),
+        F.month("start_time").alias("month"),
+        F.year("start_time").alias("year"),
+        F.dayofweek("start_time").alias("weekday"),
+    )
+
+
+def _files_per_partition(spark, location):
+    root = storage.qualify(spark, location)
+    counts = {}
+    for path in storage.list_data_files(spark, location):
+        directory = path[len(root):].strip("/").rsplit("/", 1)[0]
+        counts[directory] = counts.get(directory, 0) + 1
+    return counts
+
+
+def test_files_of_a_partition_are_split_to_the_target_size(spark, tmp_path):
+    output_data = f"{tmp_path}/"
+    df = _time_table(spark, 20000)
+    write_table(df, "time", output_data, target_file_bytes=16 * 1024)
+
+    location = table_path(output_data, "time")
+    assert set(_files_per_partition(spark, location)) == {"year=2018/month=11"}
+    assert _files_per_partition(spark, location)["year=2018/month=11"] > 1
+    assert spark.read.parquet(location).count() == 20000
+    # the statistics are computed from the same (cached) rows
+    statistics = storage.read_json(spark, stats_path(output_data, "time"))
+    assert statistics["partitions"]["year=2018/month=11"]["row_count"] == 20000
+
+
+def test_keeps_the_cache_of_the_caller(spark, tmp_path):
+    df = _time_table(spark, 100).cache()
+    df.count()
+    write_table(df, "time", f"{tmp_path}/")
+    assert df.storageLevel.useMemory
+    df.unpersist()
+
+
+def test_one_file_per_partition_at_the_default_target(spark, tmp_path):
+    output_data = f"{tmp_path}/"
+    write_table(_time_table(spark, 20000), "time", output_data)
+    assert _files_per_partition(spark, table_path(output_data, "time")) == {"year=2018/month=11": 1}
+
+
+def test_songs_of_many_artists_are_compacted(spark, tmp_path):
+    output_data = f"{tmp_path}/"
+    location = table_path(output_data, "songs")
+    songs = spark.range(300).selectExpr(
+        "concat('SO', lpad(id, 4, '0')) as song_id", "concat('song ', id) as title",
+        "concat('AR', lpad(id % 100, 3, '0')) as artist_id", "cast(id as double) as duration",
+        "cast(2000 + id % 3 as int) as year",
+    )
+    # small files as many small writes leave them; a directory per artist would have been one of them each,
+    # which the compaction leaves alone
+    write_table(songs, "songs", output_data, target_file_bytes=1)
+    files_before = _files_per_partition(spark, location)
+    assert set(files_before) == {"year=2000", "year=2001", "year=2002"}
+    assert min(files_before.values()) > 1
+
+    result = compact_table(spark, "songs", output_data)
+    assert result["partitions"] == 3
+    assert _files_per_partition(spark, location) == {"year=2000": 1, "year=2001": 1, "year=2002": 1}
+    assert sorted(read_table(spark, output_data, "songs").collect()) == sorted(songs.collect())
+    # the songs of an artist are still easy to find, the row groups are sorted by artist
+    for path in storage.list_data_files(spark, location):
+        artist_ids = [row.artist_id for row in spark.read.parquet(path).collect()]
+        assert artist_ids == sorted(artist_ids)
+    # one file per directory is what the compaction aims for
+    assert compact_table(spark, "songs", output_data)["partitions"] == 0
+
+
+def test_an_interrupted_commit_is_finished_by_the_next_write(spark, tmp_path, monkeypatch):
+    output_data = f"{tmp_path}/"
+    location = table_path(output_data, "time")
+    write_table(_time_table(spark, 100), "time", output_data)
+    old_files = set(storage.list_data_files(spark, location))
+
+    # the step dies after the new files were moved in, before the old ones were deleted
+    delete = storage.delete
+
+    def failing_delete(spark, path, recursive=True):
+        if path in old_files:
+            raise IOError("killed")
+        return delete(spark, path, recursive=recursive)
+
+    monkeypatch.setattr(storage, "delete", failing_delete)
+    with pytest.raises(IOError):
+        write_table(_time_table(spark, 200), "time", output_data)
+    monkeypatch.setattr(storage, "delete", delete)
+
+    assert spark.read.parquet(location).count() == 300
+    commit = storage.read_json(spark, pending_commit_path(output_data, "time"))
+    assert set(commit["replaced"]) == old_files
+
+    assert finish_pending_commit(spark, output_data, "time") == ["year=2018/month=11"]
+    assert spark.read.parquet(location).count() == 200
+    assert not old_files & set(storage.list_data_files(spark, location))
+    assert storage.read_json(spark, pending_commit_path(output_data, "time")) is None
+    # the bookkeeping of the interrupted write is there as well
+    assert read_table(spark, output_data, "time").count() == 200
+    statistics = storage.read_json(spark, stats_path(output_data, "time"))
+    assert statistics["partitions"]["year=2018/month=11"]["row_count"] == 200
+    assert finish_pending_commit(spark, output_data, "time") is None
+
+
+def _interrupt(spark, output_data, monkeypatch, module, name, target_file_bytes=TARGET_FILE_BYTES):
+    """a write of 200 rows over 100 that dies in `module.name` after it recorded its commit"""
+    write_table(_time_table(spark, 100), "time", output_data)
+
+    def killed(*args, **kwargs):
+        raise IOError("killed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(module, name, killed)
+        with pytest.raises(IOError):
+            write_table(_time_table(spark, 200), "time", output_data, target_file_bytes=target_file_bytes)
+    return storage.read_json(spark, pending_commit_path(output_data, "time"))
+
+
+def test_a_reader_finishes_a_pending_commit(spark, tmp_path, monkeypatch):
+    output_data = f"{tmp_path}/"
+    # the files are in place, the index still lists the old ones, reading through it would fail
+    assert _interrupt(spark, output_data, monkeypatch, writer, "write_zone_maps") is not None
+
+    assert read_table(spark, output_data, "time").count() == 200
+    assert storage.read_json(spark, pending_commit_path(output_data, "time")) is None
+
+
+def test_a_commit_finished_by_two_steps_at_once(spark, tmp_path, monkeypatch):
+    output_data = f"{tmp_path}/"
+    commit = _interrupt(spark, output_data, monkeypatch, storage, "move", target_file_bytes=1024)
+    assert len(commit["moves"]) > 1
+    (first_source, first_destination), *_ = sorted(commit["moves"].items())
+    # an S3 move of the other step copied the first file already
+    shutil.copy(first_source.split(":", 1)[1], first_destination.split(":", 1)[1])
+
+    # the other step moves the remaining files right before this one does
+    move = storage.move
+
+    def racing_move(spark, source, destination):
+        move(spark, source, destination)
+        return move(spark, source, destination)
+
+    monkeypatch.setattr(storage, "move", racing_move)
+    assert finish_pending_commit(spark, output_data, "time") == ["year=2018/month=11"]
+    monkeypatch.setattr(storage, "move", move)
+
+    assert spark.read.parquet(table_path(output_data, "time")).count() == 200
+    assert read_table(spark, output_data, "time").count() == 200
@@ -0,0 +1,90 @@
+import pytest
+
+pytest.importorskip("pyspark")
+pytest.importorskip("pyarrow")
+
+import storage  # noqa: E402
+from local_engine import LocalEngine  # noqa: E402
+from table_stats import stats_path  # noqa: E402
+from tables import table_path  # noqa: E402
+from writer import write_table  # noqa: E402
+from zone_maps import covered_partitions, index_path, prune_files, read_table  # noqa: E402
+
+
+def _zone_map(partition, low, high):
+    return {"partition": partition, "row_count": 1, "columns": {"song_id": {"nulls": 0, "min": low, "max": high}}}
+
+
+INDEX = {
+    "complete": True,
+    "partitions": ["year=2018", "year=2019"],
+    "files": {
+        "year=2018/a.parquet": _zone_map("year=2018", "S1", "S4"),
+        "year=2018/b.parquet": _zone_map("year=2018", "S5", "S8"),
+        "year=2019/c.parquet": _zone_map("year=2019", "S3", "S6"),
+    },
+}
+
+
+def test_prune_files():
+    assert prune_files(INDEX) == sorted(INDEX["files"])
+    assert prune_files(INDEX, partitions=["year=2019"]) == ["year=2019/c.parquet"]
+    assert prune_files(INDEX, partitions=["year=2017"]) == []
+
+
+def test_covered_partitions_of_an_index_without_the_list():
+    index = {"files": INDEX["files"]}
+    assert covered_partitions(index) == {"year=2018", "year=2019"}
+
+
+def _rows(df):
+    return sorted(tuple(row) for row in df.select(*sorted(df.columns)).collect())
+
+
+def test_merge_into_a_table_of_the_local_engine(spark, input_data, tmp_path):
+    output_data = f"{tmp_path}/"
+    LocalEngine(input_data, output_data).run()
+    location = table_path(output_data, "songs")
+    expected = _rows(spark.read.parquet(location))
+    # the local engine leaves neither statistics nor zone maps
+    assert storage.read_json(spark, index_path(output_data, "songs")) is None
+
+    partitions = sorted({
+        "/".join(path[len(storage.qualify(spark, location)):].strip("/").split("/")[:-1])
+        for path in storage.list_data_files(spark, location)
+    })
+    rewritten, untouched = partitions[0], partitions[-1]
+    write_table(spark.read.option("basePath", location).parquet(f"{location}{rewritten}"), "songs", output_data)
+
+    index = storage.read_json(spark, index_path(output_data, "songs"))
+    assert not index["complete"]
+    assert index["partitions"] == [rewritten]
+    assert {zone_map["partition"] for zone_map in index["files"].values()} == {rewritten}
+    assert not storage.read_json(spark, stats_path(output_data, "songs"))["complete"]
+
+    # the partitions the index does not cover are listed
+    assert _rows(read_table(spark, output_data, "songs")) == expected
+    assert _rows(read_table(spark, output_data, "songs", partitions=[untouched])) == \
+        _rows(spark.read.option("basePath", location).parquet(f"{location}{untouched}"))
+    assert _rows(read_table(spark, output_data, "songs", partitions=[rewritten, untouched])) == \
+        _rows(spark.read.option("basePath", location).parquet(f"{location}{rewritten}", f"{location}{untouched}"))
+
+    # a write of the whole table completes the index again
+    write_table(read_table(spark, output_data, "songs"), "songs", output_data, replace_all=True)
+    index = storage.read_json(spark, index_path(output_data, "songs"))
+    assert index["complete"]
+    assert index["partitions"] == partitions
+    assert storage.read_json(spark, stats_path(output_data, "songs"))["complete"]
+    assert _rows(read_table(spark, output_data, "songs")) == expected
+
+
+def test_first_write_of_a_table_is_complete(spark, tmp_path):
+    output_data = f"{tmp_path}/"
+    df = spark.createDataFrame([("AR1", "a", "x", 1.0, 2.0), ("AR2", "b", "y", None, None)],
+                               "artist_id string, name string, location string, latitude double, longitude double")
+    write_table(df, "artists", output_data, target_file_bytes=1)
+    assert storage.read_json(spark, index_path(output_data, "artists"))["complete"]
+    assert storage.read_json(spark, stats_path(output_data, "artists"))["complete"]
+    # two files of one row each
+    assert len(storage.read_json(spark, index_path(output_data, "artists"))["files"]) == 2
+    assert _rows(read_table(spark, output_data, "artists")) == _rows(df)